@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import time
+import heapq
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import awsbulk
+from awssts import sts_client
+from awslimit import is_throttling
+from awsrefresh import awsrelogin, expiration
+
+class awsagent:
+    # Keeps the credentials of a set of (instance, role name) targets fresh. Every target is
+    # refreshed refresh_margin seconds (minus a random jitter) before its Expiration on a bounded
+    # worker pool. Failures are retried with exponential backoff, throttling backs off further.
+    # Fresh credentials are published by swapping an immutable mapping, so readers never block.
+    def __init__(self, sso, targets, region, workers=4, refresh_margin=300, jitter=60, profile_template=awsbulk.DEFAULT_PROFILE_TEMPLATE,
+                 catalog=None, on_refresh=None, relogin=None, min_backoff=5, max_backoff=300, client=None):
+        self.sso = sso
+        self.region = region
+        self.workers = workers
+        self.refresh_margin = refresh_margin
+        self.jitter = jitter
+        self.catalog = catalog
+        self.on_refresh = on_refresh
+        self.relogin = awsrelogin(relogin)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.targets = {}
+        # Pairs sharing a profile name would overwrite each other's credentials, they are left
+        # out and kept in duplicates for the caller to report
+        targets, self.duplicates = awsbulk.duplicate_profiles(targets, profile_template)
+        for instance, role_name in targets:
+            self.targets[awsbulk.profile_name(profile_template, instance, role_name)] = (instance, role_name)
+        self._credentials = {}
+        self._failures = {}
+        self._schedule = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._publish_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._client = client
+
+    def get(self, profile):
+        # Latest credentials of profile (an AssumeRoleWithSAML response) or None
+        return self._credentials.get(profile)
+
+    def credentials(self):
+        return self._credentials
+
+    def seed(self, profile, token):
+        # Start from credentials obtained elsewhere, e.g. still valid ones from the credentials file
+        self._publish(profile, token)
+
+    def _publish(self, profile, token):
+        with self._publish_lock:
+            credentials = dict(self._credentials)
+            credentials[profile] = token
+            self._credentials = credentials
+
+    def _push(self, due, profile):
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._schedule, (due, self._sequence, profile))
+            self._condition.notify()
+
+    def _next_refresh(self, token):
+        due = expiration(token).timestamp() - self.refresh_margin - random.uniform(0, self.jitter)
+        # Never spin on credentials that are already inside the margin
+        return max(due, time.time() + self.min_backoff)
+
+    def _backoff(self, profile, throttled):
+        failures = self._failures.get(profile, 0) + 1
+        self._failures[profile] = failures
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (failures - 1))
+        if throttled:
+            delay = min(self.max_backoff, delay * 2)
+        # Full jitter so that throttled targets do not retry in lock step
+        return time.time() + random.uniform(delay / 2, delay)
+
+    def _refresh(self, profile):
+        instance, role_name = self.targets[profile]
+        token = self.relogin.call(awsbulk.assume_target, self.sso, instance, role_name, self.region, self._client, self.catalog)
+        self._publish(profile, token)
+        if self.on_refresh:
+            self.on_refresh(profile, instance['id'] + '/' + role_name, token)
+        return token
+
+    def _run_target(self, profile):
+        try:
+            token = self._refresh(profile)
+            self._failures.pop(profile, None)
+            due = self._next_refresh(token)
+            logging.debug('Refreshed ' + profile + ', next refresh in ' + str(int(due - time.time())) + 's')
+        except Exception as e:
+            throttled = is_throttling(e)
+            due = self._backoff(profile, throttled)
+            logging.warning('Refreshing ' + profile + ' failed' + (' (throttled)' if throttled else '') + ': ' + str(e))
+        if not self._stopped.is_set():
+            self._push(due, profile)
+
+    def run(self):
+        # Blocks until stop() is called
+        if self._client is None:
+            self._client = sts_client(self.region, 'boto3')
+        now = time.time()
+        for profile in self.targets:
+            token = self._credentials.get(profile)
+            if token is not None:
+                self._push(self._next_refresh(token), profile)
+            else:
+                # Spread the first round a little too
+                self._push(now + random.uniform(0, min(self.jitter, 5)), profile)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while not self._stopped.is_set():
+                    with self._condition:
+                        while not self._stopped.is_set():
+                            wait = self._schedule[0][0] - time.time() if self._schedule else None
+                            if wait is not None and wait <= 0:
+                                break
+                            self._condition.wait(wait)
+                        if self._stopped.is_set():
+                            break
+                        due, sequence, profile = heapq.heappop(self._schedule)
+                    executor.submit(self._run_target, profile)
+            finally:
+                # Also reached on KeyboardInterrupt, running refreshes finish but are not rescheduled
+                self._stopped.set()
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shlex
+import subprocess
+import configparser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import awsbulk
+from awsexceptions import InputError
+
+# Batch mode: log in to several SSO directories, or as several users, from one config file.
+# Every section other than DEFAULT is a job, DEFAULT holds the values shared by all jobs:
+#
+#   [DEFAULT]
+#   stsregion = us-west-2
+#
+#   [prod]
+#   directoryurl = d-1234567890.awsapps.com
+#   login = deploy@example.com
+#   password = env:PROD_SSO_PASSWORD
+#   appinstanceid = all
+#   rolename = ReadOnlyAccess
+#   profile_template = prod-{name}-{role}
+#
+# password is read from a secret source: env:VARIABLE, file:PATH or command:COMMAND LINE.
+# portal_url, directory_endpoint and sts_endpoint_url override the endpoints, e.g. for benchmarks/fakeaws.py.
+
+REQUIRED_OPTIONS = ('directoryurl', 'login', 'password', 'appinstanceid', 'rolename')
+JOB_DEFAULTS = {
+    'ssoregion': 'us-east-1',
+    'stsregion': 'us-west-2',
+    'profile_template': awsbulk.DEFAULT_PROFILE_TEMPLATE,
+    'workers': '8',
+    'sts_client': 'boto3',
+}
+
+def read_secret(source, job_name=''):
+    # Passwords never appear in the config file itself
+    kind, _, value = source.partition(':')
+    where = 'password of [' + job_name + ']'
+    if kind == 'env':
+        if value not in os.environ:
+            raise InputError(where, 'Environment variable ' + value + ' is not set')
+        return os.environ[value]
+    if kind == 'file':
+        with open(os.path.expanduser(value)) as secretfile:
+            return secretfile.read().rstrip('\r\n')
+    if kind == 'command':
+        completed = subprocess.run(shlex.split(value), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+        if completed.returncode != 0:
+            raise InputError(where, 'Secret command exited with status ' + str(completed.returncode))
+        return completed.stdout.rstrip('\r\n')
+    raise InputError(where, 'Use env:VARIABLE, file:PATH or command:COMMAND')
+
+def load_jobs(filename):
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({'DEFAULT': JOB_DEFAULTS})
+    if not config.read(filename):
+        raise InputError(filename, 'Batch config file can not be read')
+    jobs = []
+    for name in config.sections():
+        section = config[name]
+        missing = [option for option in REQUIRED_OPTIONS if not section.get(option)]
+        if missing:
+            raise InputError('[' + name + ']', 'Missing ' + ', '.join(missing))
+        job = dict(section)
+        job['name'] = name
+        job['dirname'] = job.get('dirname') or job['directoryurl'].split('.', 1)[0]
+        job['netbios'] = job.get('netbios') or job['dirname']
+        try:
+            job['workers'] = int(job['workers'])
+        except ValueError:
+            raise InputError('[' + name + ']', 'workers must be a number')
+        jobs.append(job)
+    if not jobs:
+        raise InputError(filename, 'Batch config file does not define any job')
+    return jobs
+
+# pool_size, timeout and retries of the http connections, portal_rate and sts_rate of awslimit
+DEFAULT_SETTINGS = {'pool_size': 10, 'timeout': 30, 'retries': 3, 'portal_rate': 0, 'sts_rate': 0}
+
+def run_job(job, settings=None):
+    # One directory and login, isolated from the other jobs: its own awssso object, cookie
+    # jar and STS client. Runs in a worker process or thread, never raises, the outcome
+    # and the credentials are returned to the parent which writes them all at once.
+    import awslimit
+    from awssso import awssso
+    from awshttp import httpconfig
+    from awssts import sts_client
+    start = time.time()
+    report = {'job': job['name'], 'directory': job['directoryurl'], 'login': job['login'], 'ok': 0, 'failed': [], 'entries': []}
+    try:
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        pool_size = max(settings['pool_size'], job['workers'])
+        http_config = httpconfig(pool_connections=pool_size, pool_maxsize=pool_size, timeout=(min(5, settings['timeout']), settings['timeout']), retries=settings['retries'])
+        # Spawned worker processes start without the limiter settings of the parent. Limiters
+        # are per host, jobs of different directories never share one, except for STS.
+        awslimit.configure(awslimit.limitconfig(rate=settings['portal_rate'] or None, concurrency=pool_size, retries=settings['retries']))
+        awslimit.configure(awslimit.limitconfig(rate=settings['sts_rate'] or None, concurrency=pool_size, retries=settings['retries']), 'sts:' + job['stsregion'])
+        sso = awssso(job['netbios'], job['dirname'], job['directoryurl'], job['ssoregion'], job['login'], read_secret(job['password'], job['name']),
+                     http_config=http_config, portal_url=job.get('portal_url'), directory_endpoint=job.get('directory_endpoint'))
+        authcode = sso.get_authentication_code()
+        sso.get_access_token(authcode['authcode'], authcode['referer'])
+        targets, errors = awsbulk.select_targets(sso, awsbulk.split_patterns(job['appinstanceid']), awsbulk.split_patterns(job['rolename']), job['workers'])
+        for error in errors:
+            report['failed'].append(error['instance']['id'] + ': ' + _message(error['error']))
+        client = sts_client(job['stsregion'], job['sts_client'], job.get('sts_endpoint_url'))
+        for result in awsbulk.assume_many(sso, targets, job['stsregion'], job['workers'], job['profile_template'], client=client):
+            pair = result['instance']['id'] + '/' + result['role']
+            if 'error' in result:
+                report['failed'].append(pair + ': ' + _message(result['error']))
+                continue
+            report['ok'] += 1
+            report['entries'].append((result['profile'], result['token'], job['stsregion'], pair))
+    except Exception as e:
+        report['error'] = _message(e)
+    report['duration'] = round(time.time() - start, 3)
+    return report
+
+def _message(e):
+    # The exceptions of awsexceptions keep their text in message. Response bodies quoted in
+    # errors may carry tokens, the report only gets redacted text.
+    from awstrace import redact
+    return redact(getattr(e, 'message', None) or str(e) or type(e).__name__)
+
+def run_batch(jobs, executor='process', max_workers=4, settings=None):
+    # Yields the report of each job as it completes. Independent directories run in parallel,
+    # in separate processes by default so a job can not affect another one's state.
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool_class(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        futures = {pool.submit(run_job, job, settings): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # Only when the worker itself died, e.g. a killed process
+                job = futures[future]
+                yield {'job': job['name'], 'directory': job['directoryurl'], 'login': job['login'], 'ok': 0, 'failed': [], 'entries': [], 'error': _message(e), 'duration': None}
+
+def duplicate_profiles(reports):
+    # Profile names written by more than one job, the later write would silently win
+    seen = {}
+    for report in reports:
+        for entry in report['entries']:
+            seen.setdefault(entry[0], set()).add(report['job'])
+    return {profile: sorted(jobs) for profile, jobs in seen.items() if len(jobs) > 1}
+
+def summary(reports):
+    # Aggregated report without credentials, suitable for logs and --batch-report
+    jobs = []
+    for report in sorted(reports, key=lambda report: report['job']):
+        job = {key: value for key, value in report.items() if key != 'entries'}
+        job['profiles'] = sorted(entry[0] for entry in report['entries'])
+        job['status'] = 'failed' if 'error' in report else ('partial' if report['failed'] else 'ok')
+        jobs.append(job)
+    return {
+        'jobs': jobs,
+        'profiles': sum(len(job['profiles']) for job in jobs),
+        'failed_pairs': sum(len(job['failed']) for job in jobs),
+        'failed_jobs': sum(1 for job in jobs if job['status'] == 'failed'),
+    }
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import re
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from awssaml import awssaml, select_role
+from awssts import sts_client
+from awsexceptions import ApplicationInstancesError
+
+DEFAULT_PROFILE_TEMPLATE = '{name}-{role}'
+
+def split_patterns(value):
+    # "ins-1,ins-2", "prod-*" or "all"
+    return [pattern.strip() for pattern in value.split(',') if pattern.strip()]
+
+def matches(patterns, *values):
+    for pattern in patterns:
+        if pattern.lower() == 'all':
+            return True
+        for value in values:
+            if fnmatch(value, pattern):
+                return True
+    return False
+
+def profile_name(template, instance, role_name):
+    name = template.format(id=instance['id'], name=instance['name'], role=role_name)
+    # Keep the section header usable from the AWS CLI
+    return re.sub(r'[^A-Za-z0-9_.@-]+', '-', name)
+
+def duplicate_profiles(targets, template=DEFAULT_PROFILE_TEMPLATE):
+    # Split the pairs whose profile name is shared with another pair off the targets, e.g. two
+    # instances with the same name under the default template. Neither pair is kept, which one
+    # would win depends on timing. Returns (unique targets, {profile: [pairs]}).
+    pairs = {}
+    for instance, role_name in targets:
+        pairs.setdefault(profile_name(template, instance, role_name), []).append((instance, role_name))
+    duplicates = dict((profile, shared) for profile, shared in pairs.items() if len(shared) > 1)
+    return [target for target in targets if profile_name(template, *target) not in duplicates], duplicates
+
+def _call(relogin, function, *args):
+    # Through awsrefresh.awsrelogin when given: a portal call that finds the session expired
+    # logs in again once and is repeated, instead of failing as a per-pair error
+    if relogin is None:
+        return function(*args)
+    return relogin.call(function, *args)
+
+def select_targets(sso, instance_patterns, role_patterns, workers=8, catalog=None, relogin=None):
+    # Expand the instance and role patterns into (instance, role name) pairs.
+    # The profiles of the selected instances are listed concurrently, or taken from the catalog while fresh.
+    targets = []
+    errors = []
+    if catalog is not None:
+        instances = _call(relogin, catalog.instances, sso)
+        selected = [instance for instance in instances if matches(instance_patterns, instance['id'], instance['name'])]
+        profiles = catalog.refresh_profiles(sso, [instance['id'] for instance in selected], workers, relogin=relogin)
+        for instance in selected:
+            result = profiles[instance['id']]
+            if isinstance(result, Exception):
+                errors.append({'instance': instance, 'role': None, 'error': result})
+                continue
+            for role in result:
+                if matches(role_patterns, role['name']):
+                    targets.append((instance, role['name']))
+    else:
+        instances = _call(relogin, sso.list_application_instances)
+        if not instances or 'result' not in instances:
+            raise ApplicationInstancesError('Error listing application instances..')
+        selected = [instance for instance in instances['result'] if matches(instance_patterns, instance['id'], instance['name'])]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for instance in selected:
+                futures[executor.submit(_call, relogin, sso.list_roles_for_appinstanceid, instance['id'])] = instance
+            for future in as_completed(futures):
+                instance = futures[future]
+                try:
+                    roles = future.result()
+                    if not roles or 'result' not in roles:
+                        raise ApplicationInstancesError('Error listing profiles for application instance ' + instance['id'] + '..')
+                    for role in roles['result']:
+                        if matches(role_patterns, role['name']):
+                            targets.append((instance, role['name']))
+                except Exception as e:
+                    errors.append({'instance': instance, 'role': None, 'error': e})
+    targets.sort(key=lambda target: (target[0]['name'], target[1]))
+    return targets, errors
+
+def assume_target(sso, instance, role_name, region, client=None, catalog=None):
+    saml_endpoint = None
+    if catalog is not None:
+        saml_endpoint = catalog.endpoint(sso, instance['id'], role_name)
+    encoded_saml = sso.get_saml_assertion(instance['id'], role_name, saml_endpoint=saml_endpoint)
+    saml = awssaml(encoded_saml)
+    saml_attributes = saml.parse_all()
+    role = select_role(saml_attributes['roles'], role_name)
+    return saml.assume_role(role['role_arn'], role['principal_arn'], region, client=client, duration_seconds=saml_attributes['session_duration'])
+
+def assume_many(sso, targets, region, workers=8, profile_template=DEFAULT_PROFILE_TEMPLATE, catalog=None, client=None, relogin=None):
+    # Fetch the assertions and call AssumeRoleWithSAML on a bounded thread pool.
+    # Results are yielded as they complete, a failing pair never aborts the batch.
+    if client is None:
+        client = sts_client(region, 'boto3')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for instance, role_name in targets:
+            futures[executor.submit(_call, relogin, assume_target, sso, instance, role_name, region, client, catalog)] = (instance, role_name)
+        for future in as_completed(futures):
+            instance, role_name = futures[future]
+            result = {
+                'instance': instance,
+                'role': role_name,
+                'profile': profile_name(profile_template, instance, role_name),
+            }
+            try:
+                result['token'] = future.result()
+            except Exception as e:
+                result['error'] = e
+            yield result
+
+def crawl(sso, instances, concurrency=16, catalog=None, relogin=None):
+    # List the profiles of every instance with at most concurrency requests in flight and
+    # yield one record per instance as soon as it finishes, in completion order.
+    def fetch(instance):
+        if catalog is not None:
+            return _call(relogin, catalog.profiles, sso, instance['id'], True)
+        roles = _call(relogin, sso.list_roles_for_appinstanceid, instance['id'])
+        if not roles or 'result' not in roles:
+            raise ApplicationInstancesError('Error listing profiles for application instance ' + instance['id'] + '..')
+        return roles['result']
+
+    pending = iter(instances)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        running = {}
+        for instance in pending:
+            running[executor.submit(fetch, instance)] = instance
+            if len(running) >= concurrency:
+                break
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                instance = running.pop(future)
+                record = {
+                    'id': instance['id'],
+                    'name': instance['name'],
+                    'description': instance.get('description'),
+                }
+                try:
+                    record['roles'] = [profile['name'] for profile in future.result()]
+                except Exception as e:
+                    record['error'] = str(e)
+                # Keep the pool full without queueing every instance up front
+                for following in pending:
+                    running[executor.submit(fetch, following)] = following
+                    break
+                yield record
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from os.path import expanduser
+from awsexceptions import InputError
+
+DEFAULT_CACHE_DIR = '/.aws/ssocli/cache'
+SSO_COOKIE = 'x-amz-sso_authn'
+
+def cookies_to_list(cookies):
+    cookie_list = []
+    for cookie in cookies:
+        cookie_list.append({
+            'name': cookie.name,
+            'value': cookie.value,
+            'domain': cookie.domain,
+            'path': cookie.path,
+            'secure': cookie.secure,
+            'expires': cookie.expires,
+        })
+    return cookie_list
+
+def cookies_from_list(cookie_list):
+    from requests.cookies import RequestsCookieJar, create_cookie
+    jar = RequestsCookieJar()
+    for cookie in cookie_list:
+        jar.set_cookie(create_cookie(**cookie))
+    return jar
+
+def cache_key(directoryurl, login, ssoregion):
+    return hashlib.sha256((directoryurl + '|' + login + '|' + ssoregion).encode('utf-8')).hexdigest()
+
+def write_private_file(filename, data):
+    # Write data readable by the owner only, replacing filename atomically
+    os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+    tmpname = filename + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as cachefile:
+            cachefile.write(data)
+        os.replace(tmpname, filename)
+    except Exception:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+def new_fernet(key, salt, option='--cache-key'):
+    # Any passphrase is accepted, it is stretched into a valid Fernet key
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise InputError(option, 'The cryptography package is required for encryption')
+    derived = hashlib.pbkdf2_hmac('sha256', key.encode('utf-8'), salt.encode('utf-8'), 100000)
+    return Fernet(base64.urlsafe_b64encode(derived))
+
+def private_file_ok(filename):
+    # False when the file is missing or can be read or replaced by others
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    return not (os.name == 'posix' and st.st_mode & 0o077)
+
+class awssessioncache:
+    # On disk cache of the portal token and cookie jar returned by awssso.get_access_token,
+    # one file per directory/login/region.
+    def __init__(self, directoryurl, login, ssoregion, cache_dir=None, ttl=3600, key=None):
+        if cache_dir is None:
+            cache_dir = expanduser('~') + DEFAULT_CACHE_DIR
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.cache_key = cache_key(directoryurl, login, ssoregion)
+        self.filename = os.path.join(cache_dir, 'session-' + self.cache_key[:32] + '.json')
+        self.fernet = None
+        if key:
+            self.fernet = new_fernet(key, self.cache_key)
+
+    def load(self):
+        # Returns a dict shaped like awssso.get_access_token output, or None when there
+        # is no usable entry. Only local checks are done here, no request is sent.
+        if not private_file_ok(self.filename):
+            # Missing, or someone else could have read or replaced it, do not trust it
+            self.clear()
+            return None
+        try:
+            with open(self.filename, 'rb') as cachefile:
+                data = cachefile.read()
+            if self.fernet is not None:
+                data = self.fernet.decrypt(data)
+            entry = json.loads(data.decode('utf-8'))
+        except Exception:
+            self.clear()
+            return None
+        if entry.get('key') != self.cache_key or entry.get('expires', 0) <= time.time():
+            self.clear()
+            return None
+        cookies = cookies_from_list(entry['cookies'])
+        if not any(cookie.name == SSO_COOKIE and cookie.value == entry['token'] for cookie in cookies):
+            self.clear()
+            return None
+        return {'token': entry['token'], 'cookies': cookies}
+
+    def save(self, token, cookies):
+        now = time.time()
+        expires = now + self.ttl
+        for cookie in cookies:
+            if cookie.name == SSO_COOKIE and cookie.expires:
+                expires = min(expires, cookie.expires)
+        entry = {
+            'key': self.cache_key,
+            'created': now,
+            'expires': expires,
+            'token': token,
+            'cookies': cookies_to_list(cookies),
+        }
+        data = json.dumps(entry).encode('utf-8')
+        if self.fernet is not None:
+            data = self.fernet.encrypt(data)
+        write_private_file(self.filename, data)
+
+    def clear(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import difflib
+import threading
+from os.path import expanduser
+from concurrent.futures import ThreadPoolExecutor
+from awscache import DEFAULT_CACHE_DIR, cache_key, write_private_file, private_file_ok
+from awsexceptions import ApplicationInstancesError
+from awsexceptions import InputError
+
+class awscatalog:
+    # Local catalog of the application instances and their profiles (roles), including the
+    # SAML endpoint url of every profile. Each entry carries the time it was fetched and is
+    # only fetched again from the portal once it is older than ttl.
+    def __init__(self, directoryurl, login, ssoregion, cache_dir=None, ttl=3600):
+        if cache_dir is None:
+            cache_dir = expanduser('~') + DEFAULT_CACHE_DIR
+        self.ttl = ttl
+        self.filename = os.path.join(cache_dir, 'catalog-' + cache_key(directoryurl, login, ssoregion)[:32] + '.json')
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.data = {'instances': {'fetched': 0, 'items': {}}, 'profiles': {}}
+        self._index()
+        self.load()
+
+    def load(self):
+        if not private_file_ok(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as catalogfile:
+                data = json.load(catalogfile)
+        except Exception:
+            return
+        if 'items' not in data.get('instances', {}) or 'profiles' not in data:
+            return
+        self.data = data
+        self._index()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            write_private_file(self.filename, json.dumps(self.data).encode('utf-8'))
+            self.dirty = False
+
+    def _index(self):
+        # Lookup tables rebuilt whenever an entry changes
+        self.by_name = {}
+        for instance in self.data['instances']['items'].values():
+            self.by_name.setdefault(instance['name'].lower(), []).append(instance)
+        self.endpoints = {}
+        for instance_id, entry in self.data['profiles'].items():
+            for profile in entry['items']:
+                self.endpoints[(instance_id, profile['name'])] = profile['url']
+
+    def _stale(self, entry):
+        return entry is None or entry['fetched'] + self.ttl <= time.time()
+
+    def instances(self, sso=None, refresh=False):
+        # Application instances, fetched from the portal when stale and sso is given
+        with self.lock:
+            if sso is not None and (refresh or self._stale(self.data['instances'])):
+                instances = sso.list_application_instances()
+                if not instances or 'result' not in instances:
+                    raise ApplicationInstancesError('Error listing application instances..')
+                items = {}
+                for instance in instances['result']:
+                    items[instance['id']] = instance
+                self.data['instances'] = {'fetched': time.time(), 'items': items}
+                # Profiles of instances that are gone are dropped, the others are kept
+                for instance_id in list(self.data['profiles']):
+                    if instance_id not in items:
+                        del self.data['profiles'][instance_id]
+                self.dirty = True
+                self._index()
+            return list(self.data['instances']['items'].values())
+
+    def _fetch_profiles(self, sso, instance_id):
+        roles = sso.list_roles_for_appinstanceid(instance_id)
+        if not roles or 'result' not in roles:
+            raise ApplicationInstancesError('Error listing profiles for application instance ' + instance_id + '..')
+        with self.lock:
+            # Only the index entries of this instance change
+            previous = self.data['profiles'].get(instance_id)
+            if previous:
+                for profile in previous['items']:
+                    self.endpoints.pop((instance_id, profile['name']), None)
+            for profile in roles['result']:
+                self.endpoints[(instance_id, profile['name'])] = profile['url']
+            self.data['profiles'][instance_id] = {'fetched': time.time(), 'items': roles['result']}
+            self.dirty = True
+        return roles['result']
+
+    def profiles(self, sso, instance_id, refresh=False):
+        with self.lock:
+            entry = self.data['profiles'].get(instance_id)
+            if sso is None or not (refresh or self._stale(entry)):
+                return entry['items'] if entry else []
+        return self._fetch_profiles(sso, instance_id)
+
+    def refresh_profiles(self, sso, instance_ids, workers=8, refresh=False, relogin=None):
+        # Fetch only the stale profile lists, concurrently. Returns {instance id: profiles or exception}.
+        # With an awsrefresh.awsrelogin an expired portal session is logged in again once.
+        results = {}
+        stale = []
+        with self.lock:
+            for instance_id in instance_ids:
+                entry = self.data['profiles'].get(instance_id)
+                if refresh or self._stale(entry):
+                    stale.append(instance_id)
+                else:
+                    results[instance_id] = entry['items']
+        if stale:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for instance_id in stale:
+                    if relogin is not None:
+                        futures[instance_id] = executor.submit(relogin.call, self._fetch_profiles, sso, instance_id)
+                    else:
+                        futures[instance_id] = executor.submit(self._fetch_profiles, sso, instance_id)
+                for instance_id, future in futures.items():
+                    try:
+                        results[instance_id] = future.result()
+                    except Exception as e:
+                        results[instance_id] = e
+        return results
+
+    def endpoint(self, sso, instance_id, role_name):
+        # SAML endpoint url of a profile, a dict lookup unless the entry is missing or stale
+        with self.lock:
+            url = self.endpoints.get((instance_id, role_name))
+            if url is not None and not self._stale(self.data['profiles'].get(instance_id)):
+                return url
+        if sso is None:
+            return url
+        self._fetch_profiles(sso, instance_id)
+        with self.lock:
+            return self.endpoints.get((instance_id, role_name))
+
+    def find_instance(self, name_or_id):
+        # By id, by name (case insensitive) or by a unique name prefix
+        with self.lock:
+            items = self.data['instances']['items']
+            if name_or_id in items:
+                return items[name_or_id]
+            candidates = self.by_name.get(name_or_id.lower())
+            if not candidates:
+                candidates = [instance for name, instances in self.by_name.items() if name.startswith(name_or_id.lower()) for instance in instances]
+            if len(candidates) > 1:
+                raise InputError(name_or_id, 'Application instance name ' + name_or_id + ' is ambiguous: ' + ', '.join(instance['name'] + ' (' + instance['id'] + ')' for instance in candidates))
+            return candidates[0] if candidates else None
+
+    def resolve(self, target, sso=None):
+        # "account-name/role" or "ins-.../role" into (instance, role name), None when unknown
+        if '/' not in target:
+            raise InputError(target, 'Target must be given as account-name/role')
+        name, role_name = target.rsplit('/', 1)
+        self.instances(sso)
+        instance = self.find_instance(name)
+        if instance is None:
+            return None
+        for profile in self.profiles(sso, instance['id']):
+            if profile['name'].lower() == role_name.lower():
+                return instance, profile['name']
+        return None
+
+    def search(self, term, limit=20):
+        # Prefix, substring and then fuzzy matches over "account-name/role" and instance ids
+        entries = []
+        with self.lock:
+            for instance in self.data['instances']['items'].values():
+                profiles = self.data['profiles'].get(instance['id'], {'items': []})['items']
+                if not profiles:
+                    entries.append((instance['name'], instance, None))
+                for profile in profiles:
+                    entries.append((instance['name'] + '/' + profile['name'], instance, profile['name']))
+        term = term.lower()
+        prefix = [i for i, entry in enumerate(entries) if entry[0].lower().startswith(term) or entry[1]['id'].startswith(term)]
+        seen = set(prefix)
+        substring = [i for i, entry in enumerate(entries) if i not in seen and term in entry[0].lower()]
+        found = prefix + substring
+        seen.update(substring)
+        if len(found) < limit:
+            keys = dict((entry[0].lower(), i) for i, entry in enumerate(entries) if i not in seen)
+            for key in difflib.get_close_matches(term, list(keys), n=limit - len(found), cutoff=0.5):
+                found.append(keys[key])
+        return [(entries[i][1], entries[i][2]) for i in found[:limit]]
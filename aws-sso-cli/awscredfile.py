@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from os.path import expanduser
+import awstrace
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+SECTION_RE = re.compile(r'^\s*\[(?P<name>[^\]]+)\]')
+OPTION_RE = re.compile(r'^(?P<key>[^=:\s\[;#][^=:]*?)\s*[=:]\s*(?P<value>.*)$')
+
+class awscredentialsfile:
+    # Writes many profiles to the AWS credentials file in one transaction. Sections that are
+    # not updated are kept byte for byte, the file is replaced atomically under an advisory lock
+    # and it is not written at all when no value changes.
+    _thread_lock = threading.Lock()
+
+    def __init__(self, awsconfigfile='/.aws/credentials', filename=None):
+        if filename is None:
+            filename = expanduser('~') + awsconfigfile
+        # The temporary file replaces the target of a symlinked credentials file (dotfiles
+        # setups), not the link, and every writer locks next to that same target
+        self.filename = os.path.realpath(filename)
+        self.lockfile = self.filename + '.lock'
+
+    @contextmanager
+    def locked(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        with awscredentialsfile._thread_lock:
+            fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.filename, 'r') as credentialsfile:
+                return credentialsfile.read()
+        except FileNotFoundError:
+            return ''
+
+    def _split(self, text):
+        # [(section name or None for the lines before the first section, [lines])]
+        sections = [(None, [])]
+        for line in text.splitlines(True):
+            match = SECTION_RE.match(line)
+            if match:
+                sections.append((match.group('name').strip(), [line]))
+            else:
+                sections[-1][1].append(line)
+        return sections
+
+    def _merge(self, lines, values):
+        # Returns the section lines with values applied, or None when nothing changes
+        remaining = dict(values)
+        changed = False
+        merged = []
+        for line in lines:
+            match = OPTION_RE.match(line)
+            if match and match.group('key').strip().lower() in remaining:
+                key = match.group('key').strip().lower()
+                value = remaining.pop(key)
+                if match.group('value').strip() != value:
+                    changed = True
+                    line = key + ' = ' + value + '\n'
+            merged.append(line)
+        if remaining:
+            changed = True
+            # New options go after the last option, before trailing blank lines
+            position = len(merged)
+            while position > 1 and not merged[position - 1].strip():
+                position -= 1
+            if position > 0 and not merged[position - 1].endswith('\n'):
+                merged[position - 1] += '\n'
+            merged[position:position] = [key + ' = ' + value + '\n' for key, value in remaining.items()]
+        return merged if changed else None
+
+    @awstrace.traced('credentials_write')
+    def update(self, profiles):
+        # profiles maps a profile name to the options to set in it.
+        # Returns the names of the profiles that actually changed.
+        with self.locked():
+            text = self._read()
+            sections = self._split(text)
+            index = dict((name, position) for position, (name, lines) in enumerate(sections) if name is not None)
+            changed = []
+            for profile, values in profiles.items():
+                values = dict((key.lower(), str(value)) for key, value in values.items())
+                if profile in index:
+                    position = index[profile]
+                    merged = self._merge(sections[position][1], values)
+                    if merged is not None:
+                        sections[position] = (profile, merged)
+                        changed.append(profile)
+                else:
+                    previous = sections[-1][1]
+                    if previous and not previous[-1].endswith('\n'):
+                        previous[-1] += '\n'
+                    if previous and previous[-1].strip():
+                        previous.append('\n')
+                    lines = ['[' + profile + ']\n'] + [key + ' = ' + value + '\n' for key, value in values.items()] + ['\n']
+                    index[profile] = len(sections)
+                    sections.append((profile, lines))
+                    changed.append(profile)
+            if changed:
+                self._write(''.join(''.join(lines) for name, lines in sections))
+            return changed
+
+    def _write(self, text):
+        directory = os.path.dirname(self.filename) or '.'
+        try:
+            mode = os.stat(self.filename).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o600
+        fd, tmpname = tempfile.mkstemp(prefix='.credentials.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as tmpfile:
+                tmpfile.write(text)
+                tmpfile.flush()
+                os.fsync(tmpfile.fileno())
+            os.chmod(tmpname, mode)
+            os.replace(tmpname, self.filename)
+        except Exception:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        if fcntl is not None:
+            # Make the rename itself durable
+            dirfd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
@@ -18,6 +18,21 @@ class ApplicationInstancesError(Error):
     def __init__(self, message):
         self.message = message
 
+class PortalSessionError(Error):
+    def __init__(self, message):
+        self.message = message
+
+class STSError(Error):
+    def __init__(self, code, message, status=None):
+        self.code = code
+        self.message = message
+        self.status = status
+        # Same shape as botocore's ClientError.response so throttling checks work for both
+        self.response = {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+    def __str__(self):
+        return self.code + ': ' + self.message
+
 class InputError(Error):
     """Exception raised for errors in the input.
 
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import namedtuple
+import awstrace
+
+# Connection pool, timeout and retry settings for the HTTP session used by awssso and awsssoasync.
+# requests is only imported when a session is built, so the config can be used without it.
+# timeout is passed straight to requests, so it can be a number or a (connect, read) tuple.
+# retries and backoff_factor are used by awsssoasync. The requests sessions do not retry:
+# awssso sends every request through awslimit, which retries with jitter under the
+# endpoint's rate and concurrency limits, and a second layer here would multiply the attempts.
+httpconfig = namedtuple('httpconfig', ['pool_connections', 'pool_maxsize', 'timeout', 'retries', 'backoff_factor'])
+httpconfig.__new__.__defaults__ = (10, 10, (5, 30), 3, 0.5)
+
+# One adapter (and therefore one keep-alive connection pool) per distinct config,
+# shared by every session created in this process.
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+def get_adapter(config=None):
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    config = config or httpconfig()
+    with _adapters_lock:
+        adapter = _adapters.get(config)
+        if adapter is None:
+            retry = Retry(total=0, raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=config.pool_connections,
+                pool_maxsize=config.pool_maxsize,
+                max_retries=retry,
+            )
+            _adapters[config] = adapter
+        return adapter
+
+def new_session(config=None):
+    # Every session gets its own cookie jar but reuses the pooled connections,
+    # so many logins in one process only pay the TCP+TLS handshake once per host.
+    import requests
+    session = requests.Session()
+    adapter = get_adapter(config)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(awstrace.http_hook)
+    return session
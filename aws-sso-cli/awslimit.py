@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import threading
+from collections import namedtuple, deque
+
+# Rate limiting, adaptive concurrency and retries shared by every outbound call of awssso
+# (directory and portal) and awssaml.assume_role (STS). One awslimiter per endpoint is kept
+# for the whole process, so all threads and all awssso objects calling an endpoint share
+# its budget. The urllib3 adapters of awshttp and the boto3 STS client do not retry on their
+# own, this is the only retry layer.
+
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', 'SlowDown')
+# Only these are rate signals. 5xx are retried without slowing down, an overloaded or
+# failing backend is not a quota and cutting the rate for it only slows the whole run.
+THROTTLING_STATUS_CODES = (429,)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+THROTTLED = 'throttled'
+FAILED = 'failed'
+
+# rate: requests per second allowed by the token bucket, None for no limit. burst: bucket size.
+# concurrency: upper bound of the adaptive limit of calls in flight, initial_concurrency where it starts.
+# latency_tolerance: recent calls this many times slower than the median of the last calls count as congestion.
+# min_rate: floor of the rate cuts. recovery: seconds without a throttle after which a bucket installed by
+# throttling is removed, once the calls no longer use half of its rate.
+limitconfig = namedtuple('limitconfig', ['rate', 'burst', 'concurrency', 'initial_concurrency', 'retries', 'backoff_base', 'backoff_max', 'latency_tolerance', 'min_rate', 'recovery'])
+limitconfig.__new__.__defaults__ = (None, 10, 64, 4, 3, 0.5, 20.0, 4.0, 1.0, 10.0)
+
+def is_throttling(e):
+    # botocore ClientError and awssts STSError carry the error code in response, requests errors the http response
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+    return getattr(response, 'status_code', None) in THROTTLING_STATUS_CODES
+
+def backoff(attempt, base=0.5, maximum=20.0):
+    # Exponential backoff with full jitter, callers retrying at once do not retry in step
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+def http_outcome(response=None, error=None):
+    # Classifies a requests call: retry throttling and server errors, connection errors and timeouts
+    if error is not None:
+        from requests.exceptions import ConnectionError, Timeout
+        return FAILED if isinstance(error, (ConnectionError, Timeout)) else None
+    if response.status_code in THROTTLING_STATUS_CODES:
+        return THROTTLED
+    if response.status_code in RETRY_STATUS_CODES:
+        return FAILED
+    return None
+
+def sts_outcome(response=None, error=None):
+    # Classifies an AssumeRoleWithSAML call made with awssts or boto3
+    if error is None:
+        return None
+    if is_throttling(error):
+        return THROTTLED
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return FAILED if status is not None and status >= 500 else None
+    # Connection level errors of http.client and botocore
+    return FAILED if isinstance(error, (OSError, ConnectionError)) or type(error).__name__ in ('EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError') else None
+
+class tokenbucket:
+    # Allows rate calls per second on average and bursts of up to burst calls. Tokens are
+    # reserved under the lock and the caller sleeps outside of it, so waiting callers are
+    # served in arrival order without holding the lock.
+    def __init__(self, rate, burst=10):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = float(rate)
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+# Successful calls the latency baseline is taken from, and the number needed before latency counts
+LATENCY_WINDOW = 100
+LATENCY_SAMPLES = 20
+
+class aimdlimiter:
+    # Limit of calls in flight. It doubles per round trip until the first congestion signal
+    # (slow start), then grows by one per round trip, and is halved on a throttle. When the
+    # recent latency (moving average) climbs well above the median of the last calls it shrinks
+    # slightly, so queueing at the endpoint is caught before it starts throttling. Signals of
+    # calls sent before the last decrease were caused by the old limit and decrease nothing.
+    def __init__(self, maximum=64, initial=4, minimum=1, latency_tolerance=4.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_tolerance = latency_tolerance
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.baseline = None
+        self.recent = None
+        self.slow_start = True
+        self.decreased = 0
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+    def _decrease(self, factor, admitted):
+        if admitted > self.decreased:
+            self.decreased = time.monotonic()
+            self.limit = max(self.minimum, self.limit * factor)
+
+    def _observe(self, latency):
+        # The baseline follows the route when it gets slower for good, a single slow or fast
+        # call moves neither the median nor, much, the moving average
+        self.latencies.append(latency)
+        self.recent = latency if self.recent is None else self.recent + 0.2 * (latency - self.recent)
+        if len(self.latencies) >= LATENCY_SAMPLES:
+            self.baseline = sorted(self.latencies)[len(self.latencies) // 2]
+
+    def acquire(self):
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, outcome, admitted, latency):
+        with self.condition:
+            self.inflight -= 1
+            if outcome == THROTTLED:
+                self.slow_start = False
+                self._decrease(0.5, admitted)
+            elif outcome is None:
+                self._observe(latency)
+                if self.latency_tolerance and self.baseline and self.recent > self.latency_tolerance * self.baseline:
+                    self.slow_start = False
+                    self._decrease(0.9, admitted)
+                elif self.slow_start:
+                    self.limit = min(self.maximum, self.limit + 1)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class awslimiter:
+    # Limits of one endpoint. Fast calls can exceed a rate quota even one at a time, so besides
+    # the concurrency limit the token bucket adapts too: the first throttle installs one at 70%
+    # of the measured call rate (if config.rate is not already lower), each throttle cuts it to
+    # 70% again down to config.min_rate and each success adds 1/rate, i.e. about one call per
+    # second every second, up to config.rate. Without config.rate the bucket is removed only after
+    # config.recovery seconds without a throttle and once it no longer slows the calls down.
+    # Failed (5xx, connection) calls are retried but change neither limit.
+    def __init__(self, name, config=None):
+        self.name = name
+        self.config = config or limitconfig()
+        self.bucket = tokenbucket(self.config.rate, self.config.burst) if self.config.rate else None
+        self.concurrency = aimdlimiter(self.config.concurrency, self.config.initial_concurrency, latency_tolerance=self.config.latency_tolerance)
+        self.stats = {'calls': 0, 'throttled': 0, 'failed': 0, 'retries': 0}
+        self.stats_lock = threading.Lock()
+        # Calls per second over the last full window of one second
+        self.window_start = time.monotonic()
+        self.window_calls = 0
+        self.measured_rate = None
+        self.rate_decreased = 0
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+            if name == 'calls':
+                now = time.monotonic()
+                self.window_calls += 1
+                if now - self.window_start >= 1:
+                    self.measured_rate = self.window_calls / (now - self.window_start)
+                    self.window_start = now
+                    self.window_calls = 0
+
+    @property
+    def rate(self):
+        bucket = self.bucket
+        return bucket.rate if bucket is not None else None
+
+    def _adapt_rate(self, outcome, admitted):
+        with self.stats_lock:
+            now = time.monotonic()
+            if outcome == THROTTLED:
+                # Once per congestion event, like the concurrency limit
+                if admitted <= self.rate_decreased:
+                    return
+                self.rate_decreased = now
+                current = self.measured_rate
+                if current is None:
+                    elapsed = max(now - self.window_start, 0.05)
+                    current = self.window_calls / elapsed
+                if self.bucket is not None:
+                    current = min(current, self.bucket.rate)
+                rate = max(self.config.min_rate, current * 0.7)
+                if self.bucket is None:
+                    self.bucket = tokenbucket(rate, 1)
+                else:
+                    self.bucket.set_rate(rate)
+            elif outcome is None and self.bucket is not None and self.rate_decreased:
+                # Probe upward from the adapted rate, jumping back to the configured limits
+                # would only hit the quota again
+                rate = self.bucket.rate + 1 / self.bucket.rate
+                if self.config.rate and rate >= self.config.rate:
+                    self.rate_decreased = 0
+                    rate = self.config.rate
+                elif not self.config.rate and now - self.rate_decreased > self.config.recovery and self.measured_rate is not None and rate >= 2 * self.measured_rate:
+                    # Twice the call rate, something else limits the calls now
+                    self.rate_decreased = 0
+                    self.bucket = None
+                    return
+                self.bucket.set_rate(rate)
+
+    def call(self, classify, function, *args, **kwargs):
+        # Runs function under the endpoint's limits and retries it while classify says the
+        # result or error is THROTTLED or FAILED. Once the retries are used up the last
+        # result is returned or the last error raised, as if there had been no retry.
+        attempt = 0
+        while True:
+            # Calls admitted before a decrease were let through by the old limits, their
+            # throttles are not a new signal
+            admitted = time.monotonic()
+            # Read once, _adapt_rate may lift the bucket meanwhile
+            bucket = self.bucket
+            if bucket is not None:
+                bucket.acquire()
+            self.concurrency.acquire()
+            self._count('calls')
+            start = time.monotonic()
+            result = error = outcome = None
+            try:
+                result = function(*args, **kwargs)
+                outcome = classify(response=result)
+            except Exception as e:
+                error = e
+                outcome = classify(error=e)
+            finally:
+                self.concurrency.release(outcome, admitted, time.monotonic() - start)
+            self._adapt_rate(outcome, admitted)
+            if outcome is not None:
+                self._count(outcome)
+            if outcome is None or attempt >= self.config.retries:
+                if error is not None:
+                    raise error
+                return result
+            self._count('retries')
+            time.sleep(backoff(attempt, self.config.backoff_base, self.config.backoff_max))
+            attempt += 1
+
+# Limiters are created on first use and live for the process
+_limiters = {}
+_configs = {}
+_limiters_lock = threading.Lock()
+
+def configure(config, name=None):
+    # Settings for the limiter of name, or the default for every endpoint when name is None.
+    # Only limiters created afterwards use them.
+    with _limiters_lock:
+        _configs[name] = config
+
+def get_limiter(name):
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = awslimiter(name, _configs.get(name) or _configs.get(None))
+        return limiter
+
+def limiters():
+    with _limiters_lock:
+        return dict(_limiters)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from awsexceptions import PortalSessionError
+
+# Helpers shared by the library API, the agent and the credentials server to keep
+# credentials fresh. Only the standard library is imported here.
+
+def expiration(token):
+    # Expiration of an AssumeRoleWithSAML response as an aware datetime. The credentials file
+    # and the botocore-free client hold ISO 8601 strings, with a 'Z' or without any offset (UTC).
+    value = token['Credentials']['Expiration']
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+# Share of a token's lifetime usable as refresh margin, credentials assumed for 900 seconds
+# with a 900 seconds margin would otherwise be stale as soon as they arrive
+MAX_MARGIN_FRACTION = 0.5
+
+class awscredentialcache:
+    # In memory credentials per key, fetched lazily when missing or within refresh_margin
+    # seconds of Expiration. Concurrent misses for one key share a single fetch.
+    def __init__(self, fetch, refresh_margin=300):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._fetched = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def margin(self, key):
+        # refresh_margin, clamped to a fraction of the lifetime of the token held for key
+        token = self._tokens.get(key)
+        if token is None:
+            return self.refresh_margin
+        lifetime = (expiration(token) - self._fetched[key]).total_seconds()
+        return max(0, min(self.refresh_margin, lifetime * MAX_MARGIN_FRACTION))
+
+    def _valid(self, key, token):
+        return token is not None and expiration(token) - timedelta(seconds=self.margin(key)) > datetime.now(timezone.utc)
+
+    def get(self, key):
+        token = self._tokens.get(key)
+        if self._valid(key, token):
+            return token
+        with self._lock:
+            token = self._tokens.get(key)
+            if self._valid(key, token):
+                return token
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self._flights[key] = flight
+        if not leader:
+            return flight.result()
+        try:
+            token = self.fetch(key)
+            self.put(key, token)
+            flight.set_result(token)
+            return token
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def put(self, key, token):
+        self._fetched[key] = datetime.now(timezone.utc)
+        self._tokens[key] = token
+
+class awsrelogin:
+    # Logs in again once per expired portal session, however many threads see it expire at
+    # the same time. Callers remember the generation they started with, only the first one
+    # still on that generation calls login, the others find it already done.
+    def __init__(self, login):
+        self.login = login
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, generation):
+        if self.login is None:
+            raise PortalSessionError('Portal session is no longer valid..')
+        with self._lock:
+            if self.generation == generation:
+                logging.debug('Portal session expired, logging in again')
+                self.login()
+                self.generation += 1
+
+    def call(self, function, *args, **kwargs):
+        # function, run again once after logging in when the portal session has expired
+        generation = self.generation
+        try:
+            return function(*args, **kwargs)
+        except PortalSessionError:
+            self(generation)
+            return function(*args, **kwargs)
@@ -1,11 +1,122 @@
 #!/usr/bin/env python3
 
 import sys
-import boto3
 import configparser
 import base64
+import json
+from io import BytesIO
 import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
 from os.path import expanduser
+from awsexceptions import SAMLAssertionError
+from awscredfile import awscredentialsfile
+import awstrace
+import awslimit
+import awsrefresh
+
+# lxml is faster for large assertions, the standard library parser is used when it is missing.
+# It is only imported on the first parse.
+_lxml = []
+
+def _lxml_etree():
+    if not _lxml:
+        try:
+            from lxml import etree
+        except ImportError:
+            etree = None
+        _lxml.append(etree)
+    return _lxml[0]
+
+SAML_ASSERTION_NS = '{urn:oasis:names:tc:SAML:2.0:assertion}'
+SAML_ATTRIBUTE = SAML_ASSERTION_NS + 'Attribute'
+SAML_ATTRIBUTE_VALUE = SAML_ASSERTION_NS + 'AttributeValue'
+SAML_ATTRIBUTE_STATEMENT = SAML_ASSERTION_NS + 'AttributeStatement'
+SAML_CONDITIONS = SAML_ASSERTION_NS + 'Conditions'
+SAML_SUBJECT_CONFIRMATION_DATA = SAML_ASSERTION_NS + 'SubjectConfirmationData'
+ROLE_ATTRIBUTE = 'https://aws.amazon.com/SAML/Attributes/Role'
+SESSION_DURATION_ATTRIBUTE = 'https://aws.amazon.com/SAML/Attributes/SessionDuration'
+
+# Extra keys kept in the credentials file next to the standard ones, the AWS CLI and SDKs ignore them
+EXPIRATION_KEY = 'x_security_token_expires'
+SOURCE_KEY = 'x_ssocli_source'
+
+def load_cached_credentials(profile='saml', refresh_margin=300, awsconfigfile='/.aws/credentials', source=None):
+    # Return the credentials stored in profile, shaped like the AssumeRoleWithSAML response,
+    # if they are still valid for at least refresh_margin seconds. Otherwise return None.
+    filename = expanduser("~") + awsconfigfile
+    config = configparser.RawConfigParser()
+    config.read(filename)
+    if not config.has_section(profile):
+        return None
+    try:
+        token = {'Credentials': {
+            'AccessKeyId': config.get(profile, 'aws_access_key_id'),
+            'SecretAccessKey': config.get(profile, 'aws_secret_access_key'),
+            'SessionToken': config.get(profile, 'aws_session_token'),
+            'Expiration': config.get(profile, EXPIRATION_KEY),
+        }}
+        # Handed out as an aware datetime, a value written without an offset is UTC
+        token['Credentials']['Expiration'] = awsrefresh.expiration(token)
+    except (configparser.Error, ValueError):
+        return None
+    if source is not None and config.get(profile, SOURCE_KEY, fallback=None) != source:
+        return None
+    if token['Credentials']['Expiration'] - timedelta(seconds=refresh_margin) <= datetime.now(timezone.utc):
+        return None
+    return token
+
+def credentials_section(token, region, output_format='json', source=None):
+    # Options of the credentials file profile holding an AssumeRoleWithSAML response
+    expiration = token['Credentials']['Expiration']
+    if isinstance(expiration, datetime):
+        expiration = expiration.isoformat()
+    section = {
+        'output': output_format,
+        'region': region,
+        'aws_access_key_id': token['Credentials']['AccessKeyId'],
+        'aws_secret_access_key': token['Credentials']['SecretAccessKey'],
+        'aws_session_token': token['Credentials']['SessionToken'],
+        EXPIRATION_KEY: expiration,
+    }
+    if source is not None:
+        section[SOURCE_KEY] = source
+    return section
+
+def credential_process_output(token):
+    # JSON document expected from a credential_process command by the AWS CLI and SDKs
+    expiration = token['Credentials']['Expiration']
+    if isinstance(expiration, datetime):
+        expiration = expiration.isoformat()
+    return json.dumps({
+        'Version': 1,
+        'AccessKeyId': token['Credentials']['AccessKeyId'],
+        'SecretAccessKey': token['Credentials']['SecretAccessKey'],
+        'SessionToken': token['Credentials']['SessionToken'],
+        'Expiration': expiration,
+    })
+
+def _iterparse(xml):
+    lxml_etree = _lxml_etree()
+    if lxml_etree is not None:
+        return lxml_etree.iterparse(BytesIO(xml), events=('end',), resolve_entities=False, no_network=True)
+    return ET.iterparse(BytesIO(xml), events=('end',))
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def select_role(roles, role_name=None):
+    # Pick the pair whose role name matches, AWS SSO role names look like AWSReservedSSO_<role_name>_<suffix>.
+    # A single role is used as is, among several the wrong one must never be assumed.
+    if not roles:
+        raise SAMLAssertionError('The SAML assertion does not contain any role..')
+    if role_name:
+        for role in roles:
+            name = role['role_arn'].rsplit('/', 1)[-1]
+            if name == role_name or name.startswith('AWSReservedSSO_' + role_name + '_'):
+                return role
+        if len(roles) > 1:
+            raise SAMLAssertionError('None of the ' + str(len(roles)) + ' roles of the SAML assertion matches ' + role_name + '..')
+    return roles[0]
 
 class awssaml:
     def __init__(self, assertion):
@@ -18,56 +129,93 @@ class awssaml:
             print('Response did not contain a valid SAML assertion')
             sys.exit(1)
 
-        # Parse the returned assertion and extract the authorized roles
-        awsroles = []
-        root = ET.fromstring(base64.b64decode(self.assertion))
-        for saml2attribute in root.iter('{urn:oasis:names:tc:SAML:2.0:assertion}Attribute'):
-            if (saml2attribute.get('Name') == 'https://aws.amazon.com/SAML/Attributes/Role'):
-                for saml2attributevalue in saml2attribute.iter('{urn:oasis:names:tc:SAML:2.0:assertion}AttributeValue'):
-                    awsroles.append(saml2attributevalue.text)
-        arns = {}
-        arns['role_arn'] = awsroles[0].split(',')[0]
-        arns['principal_arn'] = awsroles[0].split(',')[1]
-        return arns
-
-    def assume_role(self, role_arn, principal_arn, region):
-        # Use the assertion to get an AWS STS token using Assume Role with SAML
-        client = boto3.client(
-            'sts',
-            region_name=region
-        )
-        token = client.assume_role_with_saml(
+        # Parse the returned assertion and return the first authorized role, see parse_all for all of them
+        return self.parse_all()['roles'][0]
+
+    @awstrace.traced('saml_parse')
+    def parse_all(self):
+        # Returns every (role_arn, principal_arn) pair of the Role attribute, the SessionDuration
+        # attribute in seconds and the earliest NotOnOrAfter of the assertion.
+        # The decoded XML is parsed incrementally and parsing stops once the attributes are read.
+        if not self.assertion:
+            raise SAMLAssertionError('Response did not contain a valid SAML assertion')
+        try:
+            xml = base64.b64decode(self.assertion)
+        except (TypeError, ValueError):
+            raise SAMLAssertionError('SAML assertion is not valid base64')
+
+        attributes = {'roles': [], 'session_duration': None, 'not_on_or_after': None}
+        try:
+            for event, element in _iterparse(xml):
+                tag = element.tag
+                if tag == SAML_SUBJECT_CONFIRMATION_DATA or tag == SAML_CONDITIONS:
+                    not_on_or_after = element.get('NotOnOrAfter')
+                    if not_on_or_after:
+                        not_on_or_after = _parse_timestamp(not_on_or_after)
+                        if attributes['not_on_or_after'] is None or not_on_or_after < attributes['not_on_or_after']:
+                            attributes['not_on_or_after'] = not_on_or_after
+                elif tag == SAML_ATTRIBUTE:
+                    name = element.get('Name')
+                    if name == ROLE_ATTRIBUTE:
+                        for value in element.iter(SAML_ATTRIBUTE_VALUE):
+                            arns = [arn.strip() for arn in value.text.split(',')]
+                            # The IdP may list the provider first
+                            if ':saml-provider/' in arns[0]:
+                                arns.reverse()
+                            attributes['roles'].append({'role_arn': arns[0], 'principal_arn': arns[1]})
+                    elif name == SESSION_DURATION_ATTRIBUTE:
+                        for value in element.iter(SAML_ATTRIBUTE_VALUE):
+                            attributes['session_duration'] = int(value.text)
+                    element.clear()
+                    if attributes['roles'] and attributes['session_duration'] is not None:
+                        break
+                elif tag == SAML_ATTRIBUTE_STATEMENT:
+                    break
+        except (ET.ParseError, ValueError, IndexError, AttributeError) as e:
+            raise SAMLAssertionError('SAML assertion could not be parsed: ' + str(e))
+        except Exception as e:
+            lxml_etree = _lxml_etree()
+            if lxml_etree is not None and isinstance(e, lxml_etree.XMLSyntaxError):
+                raise SAMLAssertionError('SAML assertion could not be parsed: ' + str(e))
+            raise
+        if not attributes['roles']:
+            raise SAMLAssertionError('SAML assertion does not contain any AWS role')
+        return attributes
+
+    @awstrace.traced('sts')
+    def assume_role(self, role_arn, principal_arn, region, client=None, duration_seconds=None):
+        # Use the assertion to get an AWS STS token using Assume Role with SAML.
+        # A client can be passed in to share it between threads, boto3 clients are thread safe.
+        # awssts.awsstsclient can be passed instead to avoid loading botocore.
+        # Calls go through the STS limiter of the region, which retries throttling.
+        if client is None:
+            from awssts import sts_client
+            client = sts_client(region, 'boto3')
+        kwargs = {}
+        if duration_seconds:
+            kwargs['DurationSeconds'] = duration_seconds
+        awstrace.annotate(role_arn=role_arn, region=region)
+        token = awslimit.get_limiter('sts:' + region).call(
+            awslimit.sts_outcome,
+            client.assume_role_with_saml,
             RoleArn=role_arn,
             PrincipalArn=principal_arn,
             SAMLAssertion=self.assertion,
+            **kwargs
         )
         return token
 
-    def write_credentials_file(self, token, region, output_format = 'json', awsconfigfile = '/.aws/credentials'):
-        # Write the AWS STS token into the AWS credential file
-        home = expanduser("~")
-        filename = home + awsconfigfile
-
-        # Read in the existing config file
-        config = configparser.RawConfigParser()
-        config.read(filename)
-
+    def write_credentials_file(self, token, region, output_format = 'json', awsconfigfile = '/.aws/credentials', profile = 'saml', source = None, quiet = False):
+        # Write the AWS STS token into the AWS credential file.
         # Put the credentials into a saml specific section instead of clobbering
         # the default credentials
-        if not config.has_section('saml'):
-            config.add_section('saml')
-
-        config.set('saml', 'output', output_format)
-        config.set('saml', 'region', region)
-        config.set('saml', 'aws_access_key_id', token['Credentials']['AccessKeyId'])
-        config.set('saml', 'aws_secret_access_key', token['Credentials']['SecretAccessKey'])
-        config.set('saml', 'aws_session_token', token['Credentials']['SessionToken'])
-
-        # Write the updated config file
-        with open(filename, 'w+') as configfile:
-            config.write(configfile)
+        credentials_file = awscredentialsfile(awsconfigfile)
+        filename = credentials_file.filename
+        credentials_file.update({profile: credentials_section(token, region, output_format, source)})
 
-        print('\n\rSTS credentials have been stored in the AWS configuration file {0} under the saml profile.'.format(filename))
+        if quiet:
+            return
+        print('\n\rSTS credentials have been stored in the AWS configuration file {0} under the {1} profile.'.format(filename, profile))
         print('Note that they will expire at {0}.'.format(token['Credentials']['Expiration']))
         print('To use these credentials, call the AWS CLI with the --profile option. See example below: \n\r')
-        print('aws sts get-caller-identity --profile saml \n\r')
+        print('aws sts get-caller-identity --profile {0} \n\r'.format(profile))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import hmac
+import json
+import logging
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from awsrefresh import expiration
+
+def container_credentials(token):
+    # Document returned by the ECS container credentials endpoint
+    credentials = {
+        'AccessKeyId': token['Credentials']['AccessKeyId'],
+        'SecretAccessKey': token['Credentials']['SecretAccessKey'],
+        'Token': token['Credentials']['SessionToken'],
+        'Expiration': expiration(token).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    if 'AssumedRoleUser' in token:
+        credentials['RoleArn'] = token['AssumedRoleUser']['Arn']
+    return credentials
+
+class awscredentialhandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, document):
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if server.auth_token is not None:
+            if not hmac.compare_digest(self.headers.get('Authorization', ''), server.auth_token):
+                self._send(403, {'Code': 'AccessDenied', 'Message': 'Invalid authorization token'})
+                return
+        profile = self.path.split('?', 1)[0].strip('/')
+        if profile not in server.profiles:
+            self._send(404, {'Code': 'NotFound', 'Message': 'Unknown profile ' + profile})
+            return
+        try:
+            token = server.cache.get(profile)
+        except Exception as e:
+            logging.warning('Getting credentials for ' + profile + ' failed: ' + str(e))
+            self._send(500, {'Code': 'CredentialsUnavailable', 'Message': str(e)})
+            return
+        self._send(200, container_credentials(token))
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s' % (self.address_string(), format % args))
+
+class awscredentialserver(ThreadingHTTPServer):
+    # Serves credentials from an awscredentialcache on the loopback interface, in the format
+    # the AWS SDKs read from AWS_CONTAINER_CREDENTIALS_FULL_URI. Each profile is one path.
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, cache, profiles, port=0, auth_token=None, host='127.0.0.1'):
+        self.cache = cache
+        self.profiles = profiles
+        self.auth_token = auth_token
+        ThreadingHTTPServer.__init__(self, (host, port), awscredentialhandler)
+
+    def url(self, profile):
+        return 'http://' + self.server_address[0] + ':' + str(self.server_address[1]) + '/' + profile
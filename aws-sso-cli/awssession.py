@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import awsbulk
+from awssso import awssso
+from awssts import sts_client
+from awsrefresh import awscredentialcache, awsrelogin, expiration
+
+class awsssosession:
+    # Library entry point: logs in to the SSO directory once and hands out credentials for
+    # any application instance and role of the user. Credentials are kept in memory only and
+    # assumed again from a new SAML assertion once they are within refresh_margin seconds of
+    # expiring, logging in again when the portal session has expired in the meantime.
+    #
+    #   sso = awsssosession('d-1234567890.awsapps.com', 'user1@example.com', password)
+    #   s3 = sso.boto3_session('ins-1becf2edf4961234', 'ViewOnlyAccess').client('s3')
+    def __init__(self, directoryurl, login, password, ssoregion='us-east-1', stsregion='us-west-2', dirname=None, netbios=None,
+                 refresh_margin=900, sts='boto3', http_config=None, portal_url=None, directory_endpoint=None, sts_endpoint_url=None):
+        dirname = dirname or directoryurl.split('.', 1)[0]
+        self.sso = awssso(netbios or dirname, dirname, directoryurl, ssoregion, login, password,
+                          http_config=http_config, portal_url=portal_url, directory_endpoint=directory_endpoint)
+        self.stsregion = stsregion
+        self.refresh_margin = refresh_margin
+        self.client = sts_client(stsregion, sts, sts_endpoint_url)
+        self.cache = awscredentialcache(self._fetch, refresh_margin)
+        # Generation 0 is the first login, done by whichever thread needs it first
+        self.relogin = awsrelogin(self._login)
+
+    def _login(self):
+        self.sso.reset()
+        authcode = self.sso.get_authentication_code()
+        self.sso.get_access_token(authcode['authcode'], authcode['referer'])
+
+    def _fetch(self, key):
+        instance_id, role_name = key
+        if self.relogin.generation == 0:
+            self.relogin(0)
+        return self.relogin.call(awsbulk.assume_target, self.sso, {'id': instance_id}, role_name, self.stsregion, self.client)
+
+    def login(self):
+        # Optional, the first call for credentials logs in. Raises AuthCodeError or
+        # AccessTokenError early for a wrong password or directory.
+        self.relogin(self.relogin.generation)
+
+    def token(self, instance_id, role_name):
+        # AssumeRoleWithSAML response (Credentials, AssumedRoleUser...) valid for at least refresh_margin seconds
+        return self.cache.get((instance_id, role_name))
+
+    def credentials(self, instance_id, role_name):
+        # botocore RefreshableCredentials which call back into this object before expiry
+        from botocore.credentials import RefreshableCredentials
+
+        def refresh():
+            token = self.token(instance_id, role_name)
+            return {
+                'access_key': token['Credentials']['AccessKeyId'],
+                'secret_key': token['Credentials']['SecretAccessKey'],
+                'token': token['Credentials']['SessionToken'],
+                'expiry_time': expiration(token).isoformat(),
+            }
+
+        metadata = refresh()
+        # botocore refreshes 15 (advisory) and 10 (mandatory) minutes before expiry by default,
+        # aligned with the cache's margin so each refresh is a new AssumeRoleWithSAML call
+        margin = int(self.cache.margin((instance_id, role_name)))
+
+        class ssoclicredentials(RefreshableCredentials):
+            _advisory_refresh_timeout = margin
+            _mandatory_refresh_timeout = margin // 2
+
+        return ssoclicredentials.create_from_metadata(metadata=metadata, refresh_using=refresh, method='ssocli')
+
+    def boto3_session(self, instance_id, role_name, region_name=None):
+        # boto3 Session whose clients keep working across credential expiry, without a credentials file
+        import boto3
+        import botocore.session
+        from botocore.credentials import CredentialProvider
+        credentials = self.credentials(instance_id, role_name)
+
+        class ssocliprovider(CredentialProvider):
+            METHOD = 'ssocli'
+            CANONICAL_NAME = 'ssocli'
+
+            def load(self):
+                return credentials
+
+        botocore_session = botocore.session.Session()
+        botocore_session.get_component('credential_provider').insert_before('env', ssocliprovider())
+        return boto3.Session(botocore_session=botocore_session, region_name=region_name or self.stsregion)
+
+def boto3_session(directoryurl, login, password, instance_id, role_name, **kwargs):
+    # One role, for scripts that only need a single session
+    region_name = kwargs.pop('region_name', None)
+    return awsssosession(directoryurl, login, password, **kwargs).boto3_session(instance_id, role_name, region_name)
@@ -2,11 +2,14 @@
 
 from io import StringIO
 import json
-import requests
-import boto3
+from urllib.parse import urlsplit
+import awshttp
+import awslimit
+import awstrace
 from awsexceptions import AuthCodeError
 from awsexceptions import AccessTokenError
 from awsexceptions import SAMLAssertionError
+from awsexceptions import PortalSessionError
 
 class awssso:
     # CONSTANTS
@@ -16,7 +19,7 @@ class awssso:
     CFDISTURL = 'https://d32i4gd7pg4909.cloudfront.net/d4a64633fc550d3b73b374cc1fa5e8229d4ca51e/WarpDriveLogin/'
     FIXEDSTRING = '3848C107E2AD28077897B8F9CEA6E94D'
 
-    def __init__(self, netbios, dirname, directoryurl, ssoregion, login, password, verbose=None, debug=None):
+    def __init__(self, netbios, dirname, directoryurl, ssoregion, login, password, verbose=None, debug=None, session=None, http_config=None, portal_url=None, directory_endpoint=None):
         self.headers = {}
         self.headers['Content-Type'] = 'text/x-gwt-rpc; charset=utf-8'
         self.headers['X-GWT-Permutation'] = awssso.GWTPERMUTATION
@@ -27,26 +30,80 @@ class awssso:
         self.login = login
         self.sso_region = ssoregion
         self.assertion = ''
-        self.password = password
         self.verbose = verbose
         self.debug = debug
-        self.data = '7|0|11|' + awssso.CFDISTURL + '|' + awssso.FIXEDSTRING + '|com.amazonaws.warpdrive.console.client.GalaxyInternalGWTService|authenticateUser|com.amazonaws.warpdrive.console.shared.LoginRequest_v4/3859384737||' + awssso.CLIENT_ID + '|' + self.netbios + '|' + self.dirname + '|' + self.password + '|' + self.login + '|1|2|3|4|1|5|5|6|6|7|8|0|9|10|6|11|'
-        self.authcode_url = 'https://' + self.directoryurl + '/login/WarpDriveLogin/GalaxyInternalService'
+        self.set_password(password)
+        # Both endpoints can be overridden, e.g. to run against a local stand-in of the service
+        self.directory_endpoint = directory_endpoint or 'https://' + self.directoryurl
+        self.portal_url = portal_url or 'https://portal.sso.' + self.sso_region + '.amazonaws.com'
+        self.authcode_url = self.directory_endpoint + '/login/WarpDriveLogin/GalaxyInternalService'
+        # A single pooled session carries the cookie jar from one step to the next.
+        # Pass session to share it, otherwise a new one is built on the process wide connection pool.
+        self.http_config = http_config or awshttp.httpconfig()
+        self.timeout = self.http_config.timeout
+        if session is None:
+            session = awshttp.new_session(self.http_config)
+        self.session = session
+
+    # The request bodies and urls below are shared with awsssoasync.awsssoasync
+    @staticmethod
+    def authcode_data(netbios, dirname, login, password):
+        return '7|0|11|' + awssso.CFDISTURL + '|' + awssso.FIXEDSTRING + '|com.amazonaws.warpdrive.console.client.GalaxyInternalGWTService|authenticateUser|com.amazonaws.warpdrive.console.shared.LoginRequest_v4/3859384737||' + awssso.CLIENT_ID + '|' + netbios + '|' + dirname + '|' + password + '|' + login + '|1|2|3|4|1|5|5|6|6|7|8|0|9|10|6|11|'
+
+    @staticmethod
+    def parse_authcode(text):
+        # The GWT-RPC answer is //OK followed by a JSON array, None when the login was refused
+        if '//OK' not in text:
+            return None
+        return json.load(StringIO(text[4:]))[8][1]
+
+    @staticmethod
+    def authcode_referer(directory_endpoint, portal_url, dirname):
+        return directory_endpoint + '/login/?client_id=' + awssso.CLIENT_ID +  '&redirect_uri=' + portal_url + '/auth/wd&organization=' + dirname
 
+    @staticmethod
+    def token_url(portal_url, authcode, dirname, sso_region):
+        # Note: the csrf_token below can be anything but it has to be present in the request
+        return portal_url + '/auth/wd?auth_code=' + authcode + '&organization=' + dirname + '&region=' + sso_region + '&wdc_csrf_token=a'
+
+    def set_password(self, password):
+        # The password may only be known after a cached portal session turned out to be stale
+        self.password = password
+        self.data = awssso.authcode_data(self.netbios, self.dirname, self.login, self.password)
+
+    def _send(self, method, url, **kwargs):
+        # Every request goes through the limiter of its host, which retries throttling,
+        # server errors and connection errors with jittered backoff
+        limiter = awslimit.get_limiter(urlsplit(url).netloc)
+        return limiter.call(awslimit.http_outcome, self.session.request, method, url, timeout=self.timeout, **kwargs)
+
+    def _check_portal_session(self, response):
+        # The portal answers 401/403 once the x-amz-sso_authn cookie has expired or was revoked
+        if response.status_code in (401, 403):
+            raise PortalSessionError('Portal session is no longer valid..')
+
+    def _merge_cookies(self, cookies):
+        # Cookies passed in by callers of the older API are folded into the session jar
+        if cookies is not None and cookies is not self.session.cookies:
+            self.session.cookies.update(cookies)
+
+    def reset(self):
+        # Forget the portal session so the same object can be used for another login
+        self.session.cookies.clear()
+
+    @awstrace.traced('authcode')
     def get_authentication_code(self):
         # Parameters as passed in the http POST request
-        referer = 'https://' + self.directoryurl + '/login/?client_id=' + awssso.CLIENT_ID +  '&redirect_uri=https://portal.sso.' + self.sso_region + '.amazonaws.com/auth/wd&organization=' + self.dirname
+        referer = awssso.authcode_referer(self.directory_endpoint, self.portal_url, self.dirname)
         self.headers['referer'] = referer
 
         try:
-            AUTHCODE_response = requests.post(self.authcode_url, data=self.data, headers=self.headers)
+            AUTHCODE_response = self._send('POST', self.authcode_url, data=self.data, headers=self.headers)
             if AUTHCODE_response.status_code != 200:
                 print('Error status code: ' + str(AUTHCODE_response.status_code))
                 raise AuthCodeError('Error retreiving authcode..')
-            if '//OK' in AUTHCODE_response.text:
-                jsontext = json.load(StringIO(AUTHCODE_response.text[4:]))
-                AUTHCODE = jsontext[8][1]
-            else:
+            AUTHCODE = awssso.parse_authcode(AUTHCODE_response.text)
+            if AUTHCODE is None:
                 print(AUTHCODE_response.text)
                 raise AuthCodeError('Error retreiving Authentication Code..')
 
@@ -56,14 +113,15 @@ class awssso:
             authcode_return_values = {}
             authcode_return_values['referer'] = referer
             authcode_return_values['authcode'] = AUTHCODE
-            authcode_return_values['cookies'] = AUTHCODE_response.cookies
+            authcode_return_values['cookies'] = self.session.cookies
             return authcode_return_values
         except AuthCodeError:
             raise
         except Exception:
             raise
 
-    def get_access_token(self, authcode, referer, cookies):
+    @awstrace.traced('token')
+    def get_access_token(self, authcode, referer, cookies=None):
         if self.verbose:    
             print('\n\rStep 2: Get Access Token using the Authentication Code')
             print('-------')
@@ -71,82 +129,114 @@ class awssso:
 
         headers = {}
         headers['referer'] = referer
-        # Note: the csrf_token below can be anything but it has to be present in the request
-        token_url = 'https://portal.sso.' + self.sso_region + '.amazonaws.com/auth/wd?auth_code=' + authcode + '&organization=' + self.dirname + '&region=' + self.sso_region + '&wdc_csrf_token=a'
+        token_url = awssso.token_url(self.portal_url, authcode, self.dirname, self.sso_region)
 
         try:
-            TOKEN_response = requests.get(
+            self._merge_cookies(cookies)
+            TOKEN_response = self._send(
+                'GET',
                 token_url,
-                cookies=cookies,
                 headers=headers,
             )
-            if not 'x-amz-sso_authn' in TOKEN_response.request._cookies.keys():
+            TOKEN = None
+            for cookie in self.session.cookies:
+                if cookie.name == 'x-amz-sso_authn':
+                    TOKEN = cookie.value
+            if TOKEN is None and 'x-amz-sso_authn' in TOKEN_response.request._cookies.keys():
+                TOKEN = TOKEN_response.request._cookies['x-amz-sso_authn']
+            if TOKEN is None:
                 raise AccessTokenError('Error retreiving Access Token..')
-            TOKEN = TOKEN_response.request._cookies['x-amz-sso_authn']
             if self.verbose or self.debug:
                 print('\n\rTOKEN: ' + TOKEN + '\n\r')
             access_token_values = {}
             access_token_values['token'] = TOKEN
-            access_token_values['cookies'] = TOKEN_response.request._cookies
+            access_token_values['cookies'] = self.session.cookies
             return access_token_values
         except AccessTokenError:
             raise
         except Exception:
             raise
 
-    def list_application_instances(self, token, cookies):
+    @awstrace.traced('list_instances')
+    def list_application_instances(self, token=None, cookies=None):
         try:
-            application_instances_response = requests.get(
-                'https://portal.sso.' + self.sso_region + '.amazonaws.com/instance/appinstances',
-                cookies=cookies,
+            self._merge_cookies(cookies)
+            application_instances_response = self._send(
+                'GET',
+                self.portal_url + '/instance/appinstances',
             )
+            self._check_portal_session(application_instances_response)
             instances = json.loads(application_instances_response.text)
             return instances
+        except PortalSessionError:
+            raise
         except Exception as e:
             print(e)
             instances = None
             return instances
 
-    def list_roles_for_appinstanceid(self, application_instance_id, cookies):
+    @awstrace.traced('list_profiles')
+    def list_roles_for_appinstanceid(self, application_instance_id, cookies=None):
         try:
-            roles_response = application_instances_response = requests.get(
-                'https://portal.sso.' + self.sso_region + '.amazonaws.com/instance/appinstance/' + application_instance_id + '/profiles',
-                cookies=cookies,
+            self._merge_cookies(cookies)
+            roles_response = self._send(
+                'GET',
+                self.portal_url + '/instance/appinstance/' + application_instance_id + '/profiles',
             )
+            self._check_portal_session(roles_response)
             roles = json.loads(roles_response.text)
             return roles
+        except PortalSessionError:
+            raise
         except Exception as e:
             print(e)
             roles = None
             return roles
 
-    # If both the application instance id and the role name are passed as argument then get the SAML assertion and call STS AssumeRoleWithSAML
-    def get_saml_assertion(self, app_instance_id, role_name, cookies):
-        if self.verbose or self.debug:
-            print('\n\rStep 3: Get SAML assertion for the application by using the Access Token')
-            print('--------')
-            print('   - Getting the SAML endpoint for the application instance ' + app_instance_id + '...\n\r')
-
-        #Get the SAML endpoint for the specific SAML application instance (this returns the URL where this module will get the SAML assertion)
-        SAMLENDPOINT_response = requests.get(
-            'https://portal.sso.' + self.sso_region + '.amazonaws.com/instance/appinstance/' + app_instance_id + '/profiles',
+    # Get the SAML endpoint for the specific SAML application instance (this returns the URL where this module will get the SAML assertion)
+    @awstrace.traced('saml_endpoint')
+    def get_saml_endpoint(self, app_instance_id, role_name, cookies=None):
+        self._merge_cookies(cookies)
+        SAMLENDPOINT_response = self._send(
+            'GET',
+            self.portal_url + '/instance/appinstance/' + app_instance_id + '/profiles',
             headers=self.headers,
-            cookies=cookies,
         )
+        self._check_portal_session(SAMLENDPOINT_response)
         if 'result' not in json.loads(SAMLENDPOINT_response.text).keys():
             raise SAMLAssertionError(SAMLENDPOINT_response.text)
         SAMLENDPOINTS = json.loads(SAMLENDPOINT_response.text)['result']
+        SAMLENDPOINT = None
         for endpoint in SAMLENDPOINTS:
             if endpoint['name'] == role_name:
                 SAMLENDPOINT = endpoint['url']
+        if SAMLENDPOINT is None:
+            raise SAMLAssertionError('Role ' + role_name + ' is not available for application instance ' + app_instance_id)
+        return SAMLENDPOINT
+
+    # If both the application instance id and the role name are passed as argument then get the SAML assertion and call STS AssumeRoleWithSAML.
+    # The endpoint lookup is skipped when saml_endpoint is already known, e.g. from awscatalog.
+    @awstrace.traced('saml_assertion')
+    def get_saml_assertion(self, app_instance_id, role_name, cookies=None, saml_endpoint=None):
+        if self.verbose or self.debug:
+            print('\n\rStep 3: Get SAML assertion for the application by using the Access Token')
+            print('--------')
+            print('   - Getting the SAML endpoint for the application instance ' + app_instance_id + '...\n\r')
+
+        self._merge_cookies(cookies)
+        awstrace.annotate(instance=app_instance_id, role=role_name)
+        SAMLENDPOINT = saml_endpoint
+        if SAMLENDPOINT is None:
+            SAMLENDPOINT = self.get_saml_endpoint(app_instance_id, role_name)
         if self.verbose or self.debug:
-            print('\n\r   - Getting SAML assertion from portal.sso.' + self.sso_region + '.amazonaws.com using the Access Token...')
+            print('\n\r   - Getting SAML assertion from ' + self.portal_url + ' using the Access Token...')
             print('\n\rSAMLENDPOINT: ' + SAMLENDPOINT + '\n\r')
 
-        saml_response = requests.get(
+        saml_response = self._send(
+            'GET',
             SAMLENDPOINT,
-            cookies=cookies,
         )
+        self._check_portal_session(saml_response)
         encoded_saml = json.loads(saml_response.text)['encodedResponse']
         if self.verbose or self.debug:
             print(encoded_saml)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+import json
+import asyncio
+import logging
+from urllib.parse import urlencode
+import awshttp
+import awslimit
+import awstrace
+from awssso import awssso
+from awssaml import awssaml, select_role
+from awsbulk import DEFAULT_PROFILE_TEMPLATE, profile_name
+from awssts import sts_endpoint, assume_role_with_saml_params, parse_assume_role_with_saml, REQUEST_HEADERS
+from awsexceptions import AuthCodeError
+from awsexceptions import AccessTokenError
+from awsexceptions import SAMLAssertionError
+from awsexceptions import PortalSessionError
+from awsexceptions import InputError
+from awsexceptions import STSError
+
+# aiohttp is optional, only this module needs it
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+SSO_COOKIE = 'x-amz-sso_authn'
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise InputError('aiohttp', 'The aiohttp package is required for the asyncio client')
+
+def _client_timeout(config):
+    # httpconfig.timeout is a number or a (connect, read) tuple like for requests
+    timeout = config.timeout
+    if isinstance(timeout, (tuple, list)):
+        return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+
+def new_connector(config=None):
+    # A connector is a keep-alive connection pool. Pass one to every client of a service
+    # so the logins of all users share it, it must be created on the loop that uses it.
+    _require_aiohttp()
+    config = config or awshttp.httpconfig()
+    return aiohttp.TCPConnector(limit=config.pool_connections * config.pool_maxsize, limit_per_host=config.pool_maxsize)
+
+def _trace_config():
+    # Adds DNS, connection (TCP and TLS) and response header times to the open awstrace span.
+    # aiohttp runs these callbacks in the task of the request, so the span is the right one.
+    loop_time = lambda: asyncio.get_running_loop().time()
+
+    async def on_request_start(session, context, params):
+        context.request_start = loop_time()
+
+    async def on_request_end(session, context, params):
+        tracer = awstrace.get_tracer()
+        if tracer is not None:
+            tracer.add_http(params.response.status, (loop_time() - context.request_start) * 1000)
+
+    async def on_dns_resolvehost_start(session, context, params):
+        context.dns_start = loop_time()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        awstrace.annotate(dns_ms=round((loop_time() - context.dns_start) * 1000, 3))
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = loop_time()
+
+    async def on_connection_create_end(session, context, params):
+        awstrace.annotate(connect_ms=round((loop_time() - context.connect_start) * 1000, 3))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+def new_session(config=None, connector=None):
+    # Every session has its own cookie jar, which holds the portal session of one user.
+    # The jar accepts cookies from IP addresses so a local stand-in of the portal works too.
+    _require_aiohttp()
+    config = config or awshttp.httpconfig()
+    return aiohttp.ClientSession(
+        connector=connector,
+        connector_owner=connector is None,
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+        timeout=_client_timeout(config),
+        trace_configs=[_trace_config()],
+    )
+
+class awsssoasync:
+    # asyncio counterpart of awssso. The steps, return values and exceptions are the same,
+    # every method is a coroutine. The aiohttp session is created on first use so the object
+    # can be built outside of the loop. Pass semaphore to bound the requests in flight across
+    # many clients, connector to share one connection pool between them.
+    def __init__(self, netbios, dirname, directoryurl, ssoregion, login, password, session=None, http_config=None, portal_url=None, directory_endpoint=None, connector=None, semaphore=None):
+        _require_aiohttp()
+        self.headers = {}
+        self.headers['Content-Type'] = 'text/x-gwt-rpc; charset=utf-8'
+        self.headers['X-GWT-Permutation'] = awssso.GWTPERMUTATION
+        self.headers['X-GWT-Module-Base'] = awssso.CFDISTURL
+        self.netbios = netbios
+        self.dirname = dirname
+        self.directoryurl = directoryurl
+        self.login = login
+        self.sso_region = ssoregion
+        self.set_password(password)
+        self.directory_endpoint = directory_endpoint or 'https://' + self.directoryurl
+        self.portal_url = portal_url or 'https://portal.sso.' + self.sso_region + '.amazonaws.com'
+        self.authcode_url = self.directory_endpoint + '/login/WarpDriveLogin/GalaxyInternalService'
+        self.http_config = http_config or awshttp.httpconfig()
+        self.connector = connector
+        self.semaphore = semaphore
+        self.session = session
+
+    def set_password(self, password):
+        self.password = password
+        self.data = awssso.authcode_data(self.netbios, self.dirname, self.login, self.password)
+
+    def _session(self):
+        if self.session is None:
+            self.session = new_session(self.http_config, self.connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def cookies(self):
+        return self._session().cookie_jar
+
+    def _merge_cookies(self, cookies):
+        # Cookies from another jar (aiohttp or http.cookiejar) are added to this client's jar
+        if cookies is None or cookies is self.cookies:
+            return
+        values = {}
+        for cookie in cookies:
+            values[getattr(cookie, 'key', None) or cookie.name] = cookie.value
+        self.cookies.update_cookies(values, URL(self.portal_url))
+
+    def reset(self):
+        self.cookies.clear()
+
+    async def _request(self, method, url, **kwargs):
+        # Same retries as awslimit for awssso: on connection errors and on RETRY_STATUS_CODES,
+        # with jittered exponential backoff. Returns the status and body. The adaptive limits
+        # of awslimit block threads and are not used on the loop, the semaphore bounds concurrency.
+        session = self._session()
+        retries = self.http_config.retries
+        for attempt in range(retries + 1):
+            try:
+                if self.semaphore is not None:
+                    async with self.semaphore:
+                        async with session.request(method, url, **kwargs) as response:
+                            status, text = response.status, await response.text()
+                else:
+                    async with session.request(method, url, **kwargs) as response:
+                        status, text = response.status, await response.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            else:
+                if status not in awslimit.RETRY_STATUS_CODES or attempt == retries:
+                    return status, text
+            await asyncio.sleep(awslimit.backoff(attempt, self.http_config.backoff_factor))
+
+    def _check_portal_session(self, status):
+        if status in (401, 403):
+            raise PortalSessionError('Portal session is no longer valid..')
+
+    @awstrace.traced_async('authcode')
+    async def get_authentication_code(self):
+        referer = awssso.authcode_referer(self.directory_endpoint, self.portal_url, self.dirname)
+        headers = dict(self.headers)
+        headers['referer'] = referer
+        status, text = await self._request('POST', self.authcode_url, data=self.data, headers=headers)
+        if status != 200:
+            raise AuthCodeError('Error retreiving authcode, status code ' + str(status) + '..')
+        authcode = awssso.parse_authcode(text)
+        if authcode is None:
+            raise AuthCodeError('Error retreiving Authentication Code..')
+        return {'referer': referer, 'authcode': authcode, 'cookies': self.cookies}
+
+    @awstrace.traced_async('token')
+    async def get_access_token(self, authcode, referer, cookies=None):
+        self._merge_cookies(cookies)
+        token_url = awssso.token_url(self.portal_url, authcode, self.dirname, self.sso_region)
+        await self._request('GET', token_url, headers={'referer': referer})
+        token = None
+        for cookie in self.cookies:
+            if cookie.key == SSO_COOKIE:
+                token = cookie.value
+        if token is None:
+            raise AccessTokenError('Error retreiving Access Token..')
+        return {'token': token, 'cookies': self.cookies}
+
+    async def _get_portal(self, url, headers=None):
+        status, text = await self._request('GET', url, headers=headers)
+        self._check_portal_session(status)
+        return status, text
+
+    @awstrace.traced_async('list_instances')
+    async def list_application_instances(self, token=None, cookies=None):
+        # Like awssso, None when the portal answer can not be read
+        self._merge_cookies(cookies)
+        try:
+            status, text = await self._get_portal(self.portal_url + '/instance/appinstances')
+            return json.loads(text)
+        except PortalSessionError:
+            raise
+        except Exception as e:
+            logging.warning('Listing from the portal failed: %s', e)
+            return None
+
+    @awstrace.traced_async('list_profiles')
+    async def list_roles_for_appinstanceid(self, application_instance_id, cookies=None):
+        self._merge_cookies(cookies)
+        try:
+            status, text = await self._get_portal(self.portal_url + '/instance/appinstance/' + application_instance_id + '/profiles')
+            return json.loads(text)
+        except PortalSessionError:
+            raise
+        except Exception as e:
+            logging.warning('Listing from the portal failed: %s', e)
+            return None
+
+    @awstrace.traced_async('saml_endpoint')
+    async def get_saml_endpoint(self, app_instance_id, role_name, cookies=None):
+        self._merge_cookies(cookies)
+        status, text = await self._get_portal(self.portal_url + '/instance/appinstance/' + app_instance_id + '/profiles', self.headers)
+        profiles = json.loads(text)
+        if 'result' not in profiles:
+            raise SAMLAssertionError(text)
+        saml_endpoint = None
+        for profile in profiles['result']:
+            if profile['name'] == role_name:
+                saml_endpoint = profile['url']
+        if saml_endpoint is None:
+            raise SAMLAssertionError('Role ' + role_name + ' is not available for application instance ' + app_instance_id)
+        return saml_endpoint
+
+    @awstrace.traced_async('saml_assertion')
+    async def get_saml_assertion(self, app_instance_id, role_name, cookies=None, saml_endpoint=None):
+        self._merge_cookies(cookies)
+        awstrace.annotate(instance=app_instance_id, role=role_name)
+        if saml_endpoint is None:
+            saml_endpoint = await self.get_saml_endpoint(app_instance_id, role_name)
+        status, text = await self._get_portal(saml_endpoint)
+        return json.loads(text)['encodedResponse']
+
+class awsstsclientasync:
+    # asyncio counterpart of awssts.awsstsclient, same request and response handling
+    def __init__(self, region_name, endpoint_url=None, timeout=30, session=None, connector=None):
+        _require_aiohttp()
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url or sts_endpoint(region_name)
+        self.http_config = awshttp.httpconfig(timeout=timeout)
+        self.connector = connector
+        self.session = session
+
+    def _session(self):
+        if self.session is None:
+            self.session = new_session(self.http_config, self.connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def assume_role_with_saml(self, RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds=None, Policy=None):
+        # Retried like awssaml.assume_role does through awslimit: throttling, 5xx and connection
+        # errors, with jittered exponential backoff. As for awsssoasync there is no adaptive
+        # rate limit on the loop, assume_many's semaphore bounds the calls in flight.
+        body = urlencode(assume_role_with_saml_params(RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds, Policy))
+        retries = self.http_config.retries
+        for attempt in range(retries + 1):
+            try:
+                async with self._session().post(self.endpoint_url, data=body, headers=REQUEST_HEADERS) as response:
+                    status, data = response.status, await response.read()
+                return parse_assume_role_with_saml(status, data)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            except STSError as e:
+                if awslimit.sts_outcome(error=e) is None or attempt == retries:
+                    raise
+            await asyncio.sleep(awslimit.backoff(attempt, self.http_config.backoff_factor))
+
+@awstrace.traced_async('sts')
+async def assume_role(saml, role_arn, principal_arn, region, client, duration_seconds=None):
+    # asyncio counterpart of awssaml.assume_role, client is an awsstsclientasync
+    kwargs = {}
+    if duration_seconds:
+        kwargs['DurationSeconds'] = duration_seconds
+    awstrace.annotate(role_arn=role_arn, region=region)
+    return await client.assume_role_with_saml(
+        RoleArn=role_arn,
+        PrincipalArn=principal_arn,
+        SAMLAssertion=saml.assertion,
+        **kwargs
+    )
+
+async def assume_target(sso, instance, role_name, region, client, saml_endpoint=None):
+    encoded_saml = await sso.get_saml_assertion(instance['id'], role_name, saml_endpoint=saml_endpoint)
+    # Parsing is a fraction of a millisecond, it stays on the loop
+    saml = awssaml(encoded_saml)
+    saml_attributes = saml.parse_all()
+    role = select_role(saml_attributes['roles'], role_name)
+    return await assume_role(saml, role['role_arn'], role['principal_arn'], region, client, saml_attributes['session_duration'])
+
+async def assume_many(sso, targets, region, concurrency=64, profile_template=DEFAULT_PROFILE_TEMPLATE, client=None):
+    # Async generator with the same results as awsbulk.assume_many, at most concurrency
+    # pairs are in flight. Pairs still running are cancelled when the caller stops early.
+    owns_client = client is None
+    if owns_client:
+        client = awsstsclientasync(region)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(instance, role_name):
+        result = {
+            'instance': instance,
+            'role': role_name,
+            'profile': profile_name(profile_template, instance, role_name),
+        }
+        async with semaphore:
+            try:
+                result['token'] = await assume_target(sso, instance, role_name, region, client)
+            except Exception as e:
+                result['error'] = e
+        return result
+
+    tasks = [asyncio.ensure_future(run(instance, role_name)) for instance, role_name in targets]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        if owns_client:
+            await client.close()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import sqlite3
+import secrets
+import threading
+from datetime import datetime, timezone
+from os.path import expanduser
+from awscache import new_fernet
+from awsexceptions import InputError
+
+DEFAULT_STORE = '/.aws/ssocli/credentials.db'
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS credentials (
+    profile TEXT PRIMARY KEY,
+    account TEXT,
+    role TEXT,
+    instance_id TEXT,
+    region TEXT,
+    output TEXT,
+    access_key_id TEXT NOT NULL,
+    secret_access_key BLOB NOT NULL,
+    session_token BLOB NOT NULL,
+    encrypted INTEGER NOT NULL,
+    expiration REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS credentials_account ON credentials (account, role);
+CREATE INDEX IF NOT EXISTS credentials_role ON credentials (role);
+CREATE INDEX IF NOT EXISTS credentials_expiration ON credentials (expiration);
+'''
+
+def _timestamp(expiration):
+    if isinstance(expiration, str):
+        expiration = datetime.fromisoformat(expiration.replace('Z', '+00:00'))
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return expiration.timestamp()
+
+def _account(token):
+    # arn:aws:sts::123456789012:assumed-role/AWSReservedSSO_Role_0123/user
+    arn = token.get('AssumedRoleUser', {}).get('Arn') or ''
+    parts = arn.split(':')
+    return parts[4] if len(parts) > 5 and parts[4] else None
+
+class awscredentialstore:
+    # Credentials of many profiles in a SQLite database instead of the flat credentials file.
+    # Profiles are looked up by primary key and listed by account, role or expiry through
+    # indexes, so neither reads nor writes parse every profile. The database runs in WAL mode:
+    # readers never block each other nor the single writer. With a key the secret access key
+    # and session token are Fernet encrypted, the other columns stay queryable.
+    def __init__(self, filename=None, key=None):
+        if filename is None:
+            filename = expanduser('~') + DEFAULT_STORE
+        self.filename = filename
+        self._local = threading.local()
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not os.path.exists(filename):
+            # Created private, like the credentials file
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        connection = self._connection()
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute('INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)', ('schema_version', str(SCHEMA_VERSION)))
+            # The salt of the encryption key is random per database
+            connection.execute('INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)', ('salt', secrets.token_hex(16)))
+        self.fernet = None
+        if key:
+            salt = connection.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()[0]
+            self.fernet = new_fernet(key, salt, '--cache-key')
+            # A wrong key is caught here, before rows encrypted with two keys end up mixed
+            with connection:
+                connection.execute('INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)', ('key_check', self.fernet.encrypt(b'ssocli').decode('ascii')))
+            check = connection.execute("SELECT value FROM meta WHERE name = 'key_check'").fetchone()[0]
+            self._decrypt(check.encode('ascii'), True)
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads, each thread opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _encrypt(self, value):
+        if self.fernet is None:
+            return value
+        return self.fernet.encrypt(value.encode('utf-8'))
+
+    def _decrypt(self, value, encrypted):
+        if not encrypted:
+            return value
+        if self.fernet is None:
+            raise InputError('--cache-key', 'The credential store is encrypted, a key is required to read it')
+        from cryptography.fernet import InvalidToken
+        try:
+            return self.fernet.decrypt(value).decode('utf-8')
+        except InvalidToken:
+            raise InputError('--cache-key', 'Wrong key for the credential store')
+
+    def save(self, profile, token, region, source=None, output_format='json'):
+        self.save_many([(profile, token, region, source)], output_format)
+
+    def save_many(self, entries, output_format='json'):
+        # entries are (profile, AssumeRoleWithSAML response, region, 'instance_id/role_name' or None),
+        # all written in one transaction
+        now = time.time()
+        rows = []
+        for profile, token, region, source in entries:
+            instance_id, role_name = source.split('/', 1) if source else (None, None)
+            credentials = token['Credentials']
+            rows.append((
+                profile, _account(token), role_name, instance_id, region, output_format,
+                credentials['AccessKeyId'],
+                self._encrypt(credentials['SecretAccessKey']),
+                self._encrypt(credentials['SessionToken']),
+                1 if self.fernet is not None else 0,
+                _timestamp(credentials['Expiration']),
+                now,
+            ))
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO credentials (profile, account, role, instance_id, region, output, access_key_id, secret_access_key, session_token, encrypted, expiration, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get(self, profile, refresh_margin=0, source=None):
+        # Same result as awssaml.load_cached_credentials: the stored credentials when they are
+        # valid for at least refresh_margin seconds, otherwise None
+        row = self._connection().execute(
+            'SELECT access_key_id, secret_access_key, session_token, encrypted, expiration, instance_id, role FROM credentials WHERE profile = ? AND expiration > ?',
+            (profile, time.time() + refresh_margin)).fetchone()
+        if row is None:
+            return None
+        if source is not None and (row[5] or '') + '/' + (row[6] or '') != source:
+            return None
+        return {'Credentials': {
+            'AccessKeyId': row[0],
+            'SecretAccessKey': self._decrypt(row[1], row[3]),
+            'SessionToken': self._decrypt(row[2], row[3]),
+            'Expiration': datetime.fromtimestamp(row[4], timezone.utc),
+        }}
+
+    def valid(self, refresh_margin=0, account=None, role=None):
+        # Profiles valid for at least refresh_margin seconds, answered from the indexes without
+        # reading or decrypting any secret
+        query = 'SELECT profile, account, role, instance_id, region, expiration FROM credentials WHERE expiration > ?'
+        params = [time.time() + refresh_margin]
+        if account is not None:
+            query += ' AND account = ?'
+            params.append(account)
+        if role is not None:
+            query += ' AND role = ?'
+            params.append(role)
+        query += ' ORDER BY profile'
+        return [{
+            'profile': row[0],
+            'account': row[1],
+            'role': row[2],
+            'instance_id': row[3],
+            'region': row[4],
+            'expiration': datetime.fromtimestamp(row[5], timezone.utc),
+        } for row in self._connection().execute(query, params)]
+
+    def delete(self, profile):
+        self._connection().execute('DELETE FROM credentials WHERE profile = ?', (profile,))
+
+    def purge_expired(self):
+        return self._connection().execute('DELETE FROM credentials WHERE expiration <= ?', (time.time(),)).rowcount
+
+    def export(self, awsconfigfile='/.aws/credentials', refresh_margin=0):
+        # Write every still valid profile to the credentials file for tools that only read it
+        from awssaml import credentials_section
+        from awscredfile import awscredentialsfile
+        sections = {}
+        for row in self._connection().execute('SELECT profile, instance_id, role, region, output, access_key_id, secret_access_key, session_token, encrypted, expiration FROM credentials WHERE expiration > ?',
+                                              (time.time() + refresh_margin,)):
+            token = {'Credentials': {
+                'AccessKeyId': row[5],
+                'SecretAccessKey': self._decrypt(row[6], row[8]),
+                'SessionToken': self._decrypt(row[7], row[8]),
+                'Expiration': datetime.fromtimestamp(row[9], timezone.utc),
+            }}
+            source = row[1] + '/' + row[2] if row[1] and row[2] else None
+            sections[row[0]] = credentials_section(token, row[3], row[4], source)
+        awscredentialsfile(awsconfigfile).update(sections)
+        return sorted(sections)
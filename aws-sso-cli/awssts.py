@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import os
+import ssl
+import time
+import base64
+import threading
+import http.client
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit, unquote
+from urllib.request import getproxies, proxy_bypass
+from awsexceptions import STSError
+import awstrace
+
+STS_API_VERSION = '2011-06-15'
+REQUEST_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8', 'Accept': 'text/xml'}
+
+def sts_endpoint(region):
+    suffix = '.amazonaws.com.cn' if region.startswith('cn-') else '.amazonaws.com'
+    return 'https://sts.' + region + suffix + '/'
+
+def _child(element, name):
+    # Children are namespaced in responses but not always in errors
+    for child in element:
+        if child.tag == name or child.tag.endswith('}' + name):
+            return child
+    return None
+
+def _text(element, name):
+    child = _child(element, name) if element is not None else None
+    return child.text if child is not None else None
+
+# Request and response handling are shared with the asyncio client in awsssoasync
+def assume_role_with_saml_params(RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds=None, Policy=None):
+    params = {
+        'Action': 'AssumeRoleWithSAML',
+        'Version': STS_API_VERSION,
+        'RoleArn': RoleArn,
+        'PrincipalArn': PrincipalArn,
+        'SAMLAssertion': SAMLAssertion,
+    }
+    if DurationSeconds:
+        params['DurationSeconds'] = str(DurationSeconds)
+    if Policy:
+        params['Policy'] = Policy
+    return params
+
+def parse_assume_role_with_saml(status, data):
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError:
+        raise STSError('InvalidResponse', 'STS returned HTTP ' + str(status) + ' with a body that is not XML', status)
+    if status != 200:
+        error = _child(root, 'Error')
+        raise STSError(_text(error, 'Code') or 'Unknown', _text(error, 'Message') or '', status)
+
+    result = _child(root, 'AssumeRoleWithSAMLResult')
+    credentials = _child(result, 'Credentials') if result is not None else None
+    if credentials is None:
+        raise STSError('InvalidResponse', 'STS response does not contain credentials', status)
+    assumed_role_user = _child(result, 'AssumedRoleUser')
+    token = {
+        'Credentials': {
+            'AccessKeyId': _text(credentials, 'AccessKeyId'),
+            'SecretAccessKey': _text(credentials, 'SecretAccessKey'),
+            'SessionToken': _text(credentials, 'SessionToken'),
+            'Expiration': datetime.fromisoformat(_text(credentials, 'Expiration').replace('Z', '+00:00')),
+        },
+        'AssumedRoleUser': {
+            'AssumedRoleId': _text(assumed_role_user, 'AssumedRoleId'),
+            'Arn': _text(assumed_role_user, 'Arn'),
+        },
+        'ResponseMetadata': {
+            'RequestId': _text(_child(root, 'ResponseMetadata'), 'RequestId'),
+            'HTTPStatusCode': status,
+        },
+    }
+    for name in ('Subject', 'SubjectType', 'Issuer', 'Audience', 'NameQualifier'):
+        value = _text(result, name)
+        if value is not None:
+            token[name] = value
+    packed_policy_size = _text(result, 'PackedPolicySize')
+    if packed_policy_size is not None:
+        token['PackedPolicySize'] = int(packed_policy_size)
+    return token
+
+def ca_bundle():
+    # Same variables as botocore and requests, for TLS inspecting proxies and private CAs
+    return os.environ.get('AWS_CA_BUNDLE') or os.environ.get('REQUESTS_CA_BUNDLE') or None
+
+class awsstsclient:
+    # Minimal STS client for AssumeRoleWithSAML. That call is not signed, the SAML assertion
+    # authenticates it, so a single https POST is enough and botocore is never imported.
+    # The method name, arguments and response shape follow the boto3 client. It honors
+    # HTTPS_PROXY/NO_PROXY and AWS_CA_BUNDLE/REQUESTS_CA_BUNDLE, not the endpoint settings
+    # of the AWS config files, which is why boto3 stays the default.
+    def __init__(self, region_name, endpoint_url=None, timeout=30):
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url or sts_endpoint(region_name)
+        self.timeout = timeout
+        url = urlsplit(self.endpoint_url)
+        self._scheme = url.scheme
+        self._netloc = url.netloc
+        self._path = url.path or '/'
+        self._context = ssl.create_default_context(cafile=ca_bundle()) if url.scheme == 'https' else None
+        self._proxy = None
+        proxy = getproxies().get(url.scheme)
+        if proxy and not proxy_bypass(url.hostname):
+            self._proxy = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+        # One keep-alive connection per thread, http.client connections are not thread safe
+        self._local = threading.local()
+
+    def _new_connection(self):
+        if self._proxy is None:
+            if self._scheme == 'https':
+                return http.client.HTTPSConnection(self._netloc, timeout=self.timeout, context=self._context)
+            return http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+        headers = {}
+        if self._proxy.username:
+            credentials = unquote(self._proxy.username) + ':' + unquote(self._proxy.password or '')
+            headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        proxy_port = self._proxy.port or (443 if self._proxy.scheme == 'https' else 80)
+        if self._scheme == 'https':
+            # CONNECT tunnel through the proxy, TLS is still end to end with STS
+            connection = http.client.HTTPSConnection(self._proxy.hostname, proxy_port, timeout=self.timeout, context=self._context)
+            connection.set_tunnel(self._netloc, headers=headers)
+        else:
+            connection = http.client.HTTPConnection(self._proxy.hostname, proxy_port, timeout=self.timeout)
+            connection.proxy_headers = headers
+        return connection
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._new_connection()
+        return connection
+
+    def _post(self, params):
+        body = urlencode(params)
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                start = time.perf_counter()
+                if connection.sock is None:
+                    # DNS, TCP and TLS handshake, only paid once per thread with keep-alive
+                    connection.connect()
+                    connected = time.perf_counter()
+                    awstrace.annotate(connect_ms=round((connected - start) * 1000, 3))
+                    start = connected
+                if self._proxy is not None and self._scheme == 'http':
+                    # Plain http proxies take the absolute url
+                    connection.request('POST', self.endpoint_url, body, dict(REQUEST_HEADERS, **connection.proxy_headers))
+                else:
+                    connection.request('POST', self._path, body, REQUEST_HEADERS)
+                response = connection.getresponse()
+                awstrace.annotate(response_ms=round((time.perf_counter() - start) * 1000, 3), http_status=response.status)
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # The server may have closed an idle keep-alive connection, retry once on a new one
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def assume_role_with_saml(self, RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds=None, Policy=None):
+        status, data = self._post(assume_role_with_saml_params(RoleArn, PrincipalArn, SAMLAssertion, DurationSeconds, Policy))
+        return parse_assume_role_with_saml(status, data)
+
+def sts_client(region, kind='boto3', endpoint_url=None):
+    # 'builtin' for awsstsclient, 'boto3' for a regular boto3 client
+    if kind == 'boto3':
+        import boto3
+        from botocore.config import Config
+        # Retries are done by awslimit, botocore's own would multiply the attempts
+        return boto3.client('sts', region_name=region, endpoint_url=endpoint_url, config=Config(retries={'total_max_attempts': 1}))
+    return awsstsclient(region, endpoint_url)
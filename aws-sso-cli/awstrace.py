@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Values of these keys are replaced wherever they show up in log messages and span errors:
+# key=value in urls and form bodies, "key": "value" in JSON and dict reprs (bytes values of
+# botocore's header dicts included), <Key>value</Key> in XML.
+SECRET_KEYS = (
+    'aws_secret_access_key', 'secretaccesskey', 'secret_access_key',
+    'aws_session_token', 'sessiontoken', 'session_token', 'token',
+    'x-amz-security-token', 'x-amz-sso_authn', 'authorization', 'auth_code', 'authcode',
+    'samlassertion', 'samlresponse', 'encodedresponse', 'password', 'cookie',
+)
+# Header values made of several words (Bearer <token>, AWS4-HMAC-SHA256 Credential=...,
+# name=value; name=value) are replaced whole, up to the closing quote or the end of the line
+HEADER_KEYS = ('authorization', 'proxy-authorization', 'cookie', 'set-cookie')
+REDACTED = '***'
+SECRET_RE = re.compile(r'(?i)(\b(?:' + '|'.join(re.escape(key) for key in SECRET_KEYS) + r')\b["\']?\s*(?:[:=]\s*(?:b(?=["\']))?["\']?|>))([^\s"\'&<>,;}\]]+)')
+HEADER_RE = re.compile(r'(?i)(\b(?:' + '|'.join(re.escape(key) for key in HEADER_KEYS) + r')\b["\']?\s*[:=]\s*)(?:(b?(["\']))(?:(?!\3).)*\3?|[^\r\n]+)')
+ACCESS_KEY_RE = re.compile(r'\b((?:AKIA|ASIA)[A-Z0-9]{4})[A-Z0-9]{8,}\b')
+
+def _redact_header(match):
+    if match.group(2) is None:
+        return match.group(1) + REDACTED
+    return match.group(1) + match.group(2) + REDACTED + match.group(3)
+
+def redact(text):
+    # Access key ids keep their prefix so a log line still tells which key was used
+    text = HEADER_RE.sub(_redact_header, str(text))
+    text = SECRET_RE.sub(lambda match: match.group(1) + REDACTED, text)
+    return ACCESS_KEY_RE.sub(lambda match: match.group(1) + REDACTED, text)
+
+class redactingfilter(logging.Filter):
+    # Attached to the handlers of the debug log so records of requests, urllib3 and
+    # botocore loggers are redacted too, not only those of this package
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+def debug_log_handler(filename='ssocli.log'):
+    # The log is created private, it holds account ids, role names and endpoints
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    handler = logging.StreamHandler(os.fdopen(fd, 'w'))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    handler.addFilter(redactingfilter())
+    return handler
+
+class awstracer:
+    # Collects one record per stage of a login: authcode POST, token exchange, listings,
+    # SAML endpoint and assertion, SAML parse, STS and credentials write. Spans can be opened
+    # from many threads and asyncio tasks, the stack of open spans is a context variable so
+    # each thread and task sees its own and nested spans know their parent.
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.started = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.stack = contextvars.ContextVar('awstrace_stack', default=())
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        stack = self.stack.get()
+        record = {'stage': stage, 'start': round(time.time(), 6), 'thread': threading.current_thread().name}
+        if stack:
+            record['parent'] = stack[-1]['stage']
+        record.update(attributes)
+        # A new tuple rather than an append, tasks copy the context but would share a list
+        token = self.stack.set(stack + (record,))
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = redact(type(e).__name__ + ': ' + str(e))
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.stack.reset(token)
+            with self.lock:
+                self.spans.append(record)
+
+    def annotate(self, **attributes):
+        # Adds attributes to the innermost open span of the calling thread or task
+        stack = self.stack.get()
+        if stack:
+            stack[-1].update(attributes)
+
+    def add_http(self, status, elapsed_ms):
+        # Time to the response headers of each HTTP request made inside a span
+        stack = self.stack.get()
+        if stack:
+            record = stack[-1]
+            record['http_requests'] = record.get('http_requests', 0) + 1
+            record['http_ms'] = round(record.get('http_ms', 0) + elapsed_ms, 3)
+            record['http_status'] = status
+
+    def records(self):
+        with self.lock:
+            return list(self.spans)
+
+    def summary(self):
+        stages = {}
+        for record in self.records():
+            stage = stages.setdefault(record['stage'], {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stage['count'] += 1
+            stage['errors'] += 1 if 'error' in record else 0
+            stage['total_ms'] = round(stage['total_ms'] + record['duration_ms'], 3)
+            stage['max_ms'] = max(stage['max_ms'], record['duration_ms'])
+        return stages
+
+    def write_json(self, stream):
+        json.dump({'labels': self.labels, 'started': self.started, 'spans': self.records(), 'summary': self.summary()}, stream, indent=2, default=str)
+        stream.write('\n')
+
+    def write_jsonl(self, stream):
+        for record in self.records():
+            line = dict(self.labels)
+            line.update(record)
+            stream.write(json.dumps(line, default=str) + '\n')
+
+    def write(self, filename, output_format='jsonl'):
+        # '-' writes to stderr, stdout may be reserved for credential_process or crawl output
+        write = self.write_json if output_format == 'json' else self.write_jsonl
+        if filename == '-':
+            write(sys.stderr)
+            sys.stderr.flush()
+            return
+        with open(filename, 'a' if output_format == 'jsonl' else 'w') as stream:
+            write(stream)
+
+    def prometheus(self):
+        def labels(stage=None):
+            values = dict(self.labels)
+            if stage is not None:
+                values['stage'] = stage
+            escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in map(str, values.values()))
+            return '{' + ','.join(key + '="' + value + '"' for key, value in zip(values.keys(), escaped)) + '}'
+
+        summary = self.summary()
+        metrics = [
+            ('ssocli_stage_duration_seconds_sum', 'Seconds spent in each stage during the last run', lambda stage: stage['total_ms'] / 1000.0),
+            ('ssocli_stage_duration_seconds_max', 'Slowest call of each stage during the last run', lambda stage: stage['max_ms'] / 1000.0),
+            ('ssocli_stage_calls', 'Calls of each stage during the last run', lambda stage: stage['count']),
+            ('ssocli_stage_errors', 'Failed calls of each stage during the last run', lambda stage: stage['errors']),
+        ]
+        lines = []
+        for name, help_text, value in metrics:
+            lines.append('# HELP ' + name + ' ' + help_text)
+            lines.append('# TYPE ' + name + ' gauge')
+            for stage in sorted(summary):
+                lines.append(name + labels(stage) + ' ' + repr(value(summary[stage])))
+        lines.append('# HELP ssocli_last_run_timestamp_seconds Start time of the last run')
+        lines.append('# TYPE ssocli_last_run_timestamp_seconds gauge')
+        lines.append('ssocli_last_run_timestamp_seconds' + labels() + ' ' + repr(self.started))
+        lines.append('# HELP ssocli_last_run_duration_seconds Wall time of the last run')
+        lines.append('# TYPE ssocli_last_run_duration_seconds gauge')
+        lines.append('ssocli_last_run_duration_seconds' + labels() + ' ' + repr(round(time.time() - self.started, 6)))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        # Written next to the target and renamed, the node_exporter textfile collector
+        # must never read a partial file
+        temporary = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'w') as stream:
+            stream.write(self.prometheus())
+        os.replace(temporary, filename)
+
+# Spans are only recorded once a tracer is installed, the helpers below are no-ops otherwise
+_tracer = None
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+def get_tracer():
+    return _tracer
+
+@contextmanager
+def span(stage, **attributes):
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(stage, **attributes) as record:
+        yield record
+
+def traced(stage):
+    # Decorator recording every call of the function as a span of the given stage
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_async(stage):
+    # Same as traced for coroutine functions
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return await function(*args, **kwargs)
+            with tracer.span(stage):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attributes):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.annotate(**attributes)
+
+def http_hook(response, *args, **kwargs):
+    # requests response hook, installed on the sessions built by awshttp
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_http(response.status_code, response.elapsed.total_seconds() * 1000)
+    return response
@@ -1,43 +1,81 @@
 #!/usr/bin/env python3
 
-from io import StringIO
+import sys
 import json
 import argparse
-import getpass
 import os
 import logging
-import requests
-import boto3
-from awssaml import awssaml
-from awssso import awssso
 from awsexceptions import AuthCodeError
 from awsexceptions import AccessTokenError
 from awsexceptions import SAMLAssertionError
+from awsexceptions import PortalSessionError
+from awsexceptions import ApplicationInstancesError
+from awsexceptions import InputError
+
+# Only the standard library and the light modules above are imported at startup.
+# requests, boto3 and the other modules are imported by the code paths that use them,
+# so -h and the cached credential_process path stay fast.
+DEFAULT_PROFILE_TEMPLATE = '{name}-{role}'
+
+args = None
+sso = None
+catalog = None
+session_cache = None
+credential_store = None
 
 #TODO 
 # switch from argparse to Click and prompt for required values
-parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--appinstanceid', nargs='?', const='NO', help='Application instance id. Every AWS account or custom SAML application has a specific id in AWS SSO')
-parser.add_argument('-r', '--rolename', nargs='?', const='NO', help='Role name. Actually it is the name of a profile but for practical terms it is the role you will assume')
-parser.add_argument('-v', '--verbose', nargs='?', const='NO', help='Verbose mode.')
-parser.add_argument('-D', '--debug', nargs='?', const='NO', help='Debug log mode. Warning ssocli.log may contain credentials.')
-parser.add_argument('-u', '--directoryurl', nargs='?', const='NO', default='d-example.awsapps.com', help='The URL of your SSO Directory')
-parser.add_argument('-d', '--dirname', nargs='?', const='NO', default='d-example', help='The Name of your SSO Directory')
-parser.add_argument('-n', '--netbios', nargs='?', const='NO', default='d-example', help='The NETBIOS Name of your SSO Directory')
-parser.add_argument('-l', '--login', nargs='?', const='NO', default='user1@example.com', help='The Active Directory UserName for Login to SSO Directory')
-parser.add_argument('-s', '--stsregion', nargs='?', const='NO', default='us-west-2', help='The Region to generate AWS STS credentials for and set as config file default')
-parser.add_argument('-S', '--ssoregion', nargs='?', const='NO', default='us-east-1', help='The Region where your SSO Directory resides')
-parser.add_argument('-p', '--password', nargs='?', const='NO', help='The Active Directory Password to Login to SSO Directory with User specified by -l')
-args = parser.parse_args()
-
-if args.debug:
-    logging.basicConfig(format = '%(asctime)s %(name)s %(levelname)s %(message)s', filename = 'ssocli.log', filemode='w', level = logging.DEBUG)
-
-print('\n\rDirectory URL: ' + args.directoryurl)
-print('Directory Name: ' + args.dirname)
-print('NETBIOS Name: ' + args.netbios)
-print('SSO Region: ' + args.ssoregion)
-print('STS Region: ' + args.stsregion + '\n\r')
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--appinstanceid', nargs='?', const='NO', help='Application instance id. Every AWS account or custom SAML application has a specific id in AWS SSO')
+    parser.add_argument('-r', '--rolename', nargs='?', const='NO', help='Role name. Actually it is the name of a profile but for practical terms it is the role you will assume')
+    parser.add_argument('-v', '--verbose', nargs='?', const='NO', help='Verbose mode.')
+    parser.add_argument('-D', '--debug', nargs='?', const='NO', help='Debug log mode. Passwords, tokens, assertions and secret keys are redacted from ssocli.log.')
+    parser.add_argument('-u', '--directoryurl', nargs='?', const='NO', default='d-example.awsapps.com', help='The URL of your SSO Directory')
+    parser.add_argument('-d', '--dirname', nargs='?', const='NO', default='d-example', help='The Name of your SSO Directory')
+    parser.add_argument('-n', '--netbios', nargs='?', const='NO', default='d-example', help='The NETBIOS Name of your SSO Directory')
+    parser.add_argument('-l', '--login', nargs='?', const='NO', default='user1@example.com', help='The Active Directory UserName for Login to SSO Directory')
+    parser.add_argument('-s', '--stsregion', nargs='?', const='NO', default='us-west-2', help='The Region to generate AWS STS credentials for and set as config file default')
+    parser.add_argument('-S', '--ssoregion', nargs='?', const='NO', default='us-east-1', help='The Region where your SSO Directory resides')
+    parser.add_argument('-p', '--password', nargs='?', const='NO', help='The Active Directory Password to Login to SSO Directory with User specified by -l')
+    parser.add_argument('--pool-size', type=int, default=10, help='Maximum number of pooled keep-alive connections per host')
+    parser.add_argument('--timeout', type=float, default=30, help='Timeout in seconds for each HTTP request to the SSO directory and portal')
+    parser.add_argument('--retries', type=int, default=3, help='Number of retries with jittered exponential backoff for throttled or failed requests to the SSO directory, portal and STS')
+    parser.add_argument('--portal-rate', type=float, default=0, help='Maximum requests per second to each SSO directory and portal host, 0 for no limit. Concurrency adapts to throttling either way')
+    parser.add_argument('--sts-rate', type=float, default=0, help='Maximum AssumeRoleWithSAML calls per second, 0 for no limit')
+    parser.add_argument('--no-session-cache', action='store_true', help='Do not reuse or store the SSO portal session on disk')
+    parser.add_argument('--session-cache-ttl', type=int, default=3600, help='Maximum age in seconds of a cached SSO portal session')
+    parser.add_argument('--cache-key', default=os.environ.get('SSOCLI_CACHE_KEY'), help='Passphrase to encrypt the SSO portal session cache and the secrets in --credential-store with (requires the cryptography package). Defaults to $SSOCLI_CACHE_KEY')
+    parser.add_argument('-P', '--profile', default='saml', help='Name of the profile to store the STS credentials under in the AWS credentials file')
+    parser.add_argument('--reuse-credentials', action='store_true', help='Do not log in when the credentials already stored in the profile are still valid for longer than --refresh-margin')
+    parser.add_argument('--credential-process', action='store_true', help='Print the credentials as credential_process JSON for the AWS CLI and SDKs. Implies --reuse-credentials')
+    parser.add_argument('--refresh-margin', type=int, default=300, help='Seconds before expiration at which stored credentials are no longer reused')
+    parser.add_argument('-b', '--bulk', action='store_true', help='Assume many roles in one login. --appinstanceid and --rolename take comma separated ids, names or glob patterns, or "all"')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='Number of concurrent assertion and AssumeRoleWithSAML calls in bulk mode')
+    parser.add_argument('--profile-template', default=DEFAULT_PROFILE_TEMPLATE, help='Profile name for each pair in bulk mode. {id}, {name} and {role} are replaced by the application instance id, name and role name')
+    parser.add_argument('-t', '--target', help='Application instance name (or id) and role to assume given as account-name/role, instead of --appinstanceid and --rolename')
+    parser.add_argument('--search', help='Search the application instances and roles by name prefix or fuzzy match')
+    parser.add_argument('--no-catalog', action='store_true', help='Do not keep a local catalog of application instances and roles')
+    parser.add_argument('--catalog-ttl', type=int, default=3600, help='Seconds before an entry of the local catalog is fetched from the portal again')
+    parser.add_argument('--refresh-catalog', action='store_true', help='Fetch every catalog entry used by this run from the portal')
+    parser.add_argument('--crawl', action='store_true', help='List the profiles (roles) of every application instance, or of those matching --appinstanceid patterns, and print them as JSON Lines')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum number of concurrent profile requests in crawl mode')
+    parser.add_argument('--agent', action='store_true', help='Keep running and refresh the credentials of every pair selected like in --bulk mode before they expire')
+    parser.add_argument('--refresh-jitter', type=int, default=60, help='Maximum random number of seconds subtracted from each refresh time in agent mode')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Serve the credentials of every pair selected like in --bulk mode from memory on http://127.0.0.1:PORT/<profile> for AWS_CONTAINER_CREDENTIALS_FULL_URI. Use 0 for any free port')
+    parser.add_argument('--serve-token', default=os.environ.get('SSOCLI_SERVE_TOKEN'), help='Authorization token clients must send in --serve mode (AWS_CONTAINER_AUTHORIZATION_TOKEN). Defaults to $SSOCLI_SERVE_TOKEN or a random token')
+    parser.add_argument('--sts-client', choices=['builtin', 'boto3'], default='boto3', help='Client for the AssumeRoleWithSAML call. builtin does a single https request without loading botocore, it honors HTTPS_PROXY and AWS_CA_BUNDLE but not the endpoint settings of the AWS config files')
+    parser.add_argument('--credential-store', nargs='?', const='', metavar='FILE', help='Keep the credentials in an indexed SQLite database (default ~/.aws/ssocli/credentials.db) instead of the AWS credentials file')
+    parser.add_argument('--list-valid', action='store_true', help='List the profiles of --credential-store valid for longer than --refresh-margin and exit')
+    parser.add_argument('--export-credentials', action='store_true', help='Write the valid profiles of --credential-store to the AWS credentials file and exit')
+    parser.add_argument('--timings', metavar='FILE', help='Record the duration of every login stage and write the spans to FILE, - for stderr')
+    parser.add_argument('--timings-format', choices=['jsonl', 'json'], default='jsonl', help='jsonl appends one span per line to --timings, json writes one document with the spans and a per stage summary')
+    parser.add_argument('--prometheus-textfile', metavar='FILE', help='Write the per stage durations of this run as Prometheus metrics for the node_exporter textfile collector')
+    parser.add_argument('--batch', metavar='CONFIG', help='Log in to every directory and user listed in the INI file CONFIG and assume their roles like in --bulk mode, independent jobs in parallel')
+    parser.add_argument('--batch-jobs', type=int, default=4, help='Number of --batch jobs run at the same time')
+    parser.add_argument('--batch-executor', choices=['process', 'thread'], default='process', help='Run each --batch job in its own process, or in a thread of this one')
+    parser.add_argument('--batch-report', metavar='FILE', help='Write the per job outcome of --batch as JSON to FILE, without any credentials')
+    return parser
 
 def get_authentication_code():
     if args.verbose or args.debug:
@@ -73,7 +111,10 @@ def list_application_instances(token_response):
         print('Step 3: Use the Access Token to get the list of applications configured in AWS SSO')
         print('-------')
 
-    instances = sso.list_application_instances(token_response['token'],token_response['cookies'])
+    if catalog:
+        instances = {'result': catalog.instances(sso)}
+    else:
+        instances = sso.list_application_instances(token_response['token'],token_response['cookies'])
     print('\n\r   - Listing application instances for user ' + args.login + ':\n\r')
     for instance in instances['result']:
         print('Id: ' + instance['id'],)
@@ -90,7 +131,10 @@ def list_roles(token_response):
         print('Step 3: Use the Access Token to get the list of profiles (roles) assigned to the AWS account')
         print('-------')
 
-    roles = sso.list_roles_for_appinstanceid(args.appinstanceid, token_response['cookies'])
+    if catalog:
+        roles = {'result': catalog.profiles(sso, args.appinstanceid)}
+    else:
+        roles = sso.list_roles_for_appinstanceid(args.appinstanceid, token_response['cookies'])
     print('\n\r   - Listing profiles (roles) available for the application instance ' + args.appinstanceid + '\n\r')
     for role in roles['result']:
         print('Name: ' + role['name'] + '\n\r')
@@ -103,12 +147,17 @@ def list_roles(token_response):
     exit(0)
 
 def get_saml_assertion(token_response):
+    from awssaml import awssaml, select_role, credential_process_output
+    from awssts import sts_client
     if args.verbose or args.debug:
         print('\n\rStep 3: Get SAML assertion for the application by using the Access Token')
         print('--------')
         print('   - Getting the SAML endpoint for the application instance ' + args.appinstanceid + '...\n\r')
 
-    encoded_saml = sso.get_saml_assertion(args.appinstanceid, args.rolename, token_response['cookies'])
+    saml_endpoint = None
+    if catalog:
+        saml_endpoint = catalog.endpoint(sso, args.appinstanceid, args.rolename)
+    encoded_saml = sso.get_saml_assertion(args.appinstanceid, args.rolename, token_response['cookies'], saml_endpoint=saml_endpoint)
 
     if args.verbose or args.debug:
         print('\n\rStep 4: Get AWS Credentials using the SAML assertion\n\r')
@@ -116,33 +165,343 @@ def get_saml_assertion(token_response):
         print('\n\r   - Calling parsesaml.py to extract the role and saml provider from response.saml and pass them to AssumeRoleWithSAML\n\r')
     
     saml = awssaml(encoded_saml)
-    saml_attributes=saml.parse()
-    token = saml.assume_role(saml_attributes['role_arn'], saml_attributes['principal_arn'], args.stsregion)
-    saml.write_credentials_file(token, args.stsregion)
+    try:
+        saml_attributes = saml.parse_all()
+        role = select_role(saml_attributes['roles'], args.rolename)
+    except SAMLAssertionError as e:
+        print(e.message)
+        exit(1)
+    token = saml.assume_role(role['role_arn'], role['principal_arn'], args.stsregion, client=sts_client(args.stsregion, args.sts_client), duration_seconds=saml_attributes['session_duration'])
+    if credential_store:
+        credential_store.save(args.profile, token, args.stsregion, credentials_source())
+        if not args.credential_process:
+            print('\n\rCredentials stored under the ' + args.profile + ' profile of ' + credential_store.filename + '\n\r')
+    else:
+        saml.write_credentials_file(token, args.stsregion, profile=args.profile, source=credentials_source(), quiet=args.credential_process)
+    if args.credential_process:
+        print(credential_process_output(token), file=sys.__stdout__)
+        return
 
-    sts = boto3.Session(profile_name='saml').client('sts')
-    who_am_i = json.dumps(sts.get_caller_identity()['Arn'])
+    # Checking the new identity is the only step of this path that needs boto3
+    import boto3
+    import awstrace
+    with awstrace.span('caller_identity'):
+        if credential_store:
+            sts = boto3.Session(aws_access_key_id=token['Credentials']['AccessKeyId'], aws_secret_access_key=token['Credentials']['SecretAccessKey'], aws_session_token=token['Credentials']['SessionToken']).client('sts', region_name=args.stsregion)
+        else:
+            sts = boto3.Session(profile_name=args.profile).client('sts')
+        who_am_i = json.dumps(sts.get_caller_identity()['Arn'])
     print('\n\rAssumedRoleIdentity: ' + who_am_i + '\n\r')
         
-if __name__ == '__main__':
+def bulk_assume(token_response):
+    import awsbulk
+    from awssaml import credentials_section
+    from awscredfile import awscredentialsfile
+    from awssts import sts_client
+    if args.verbose or args.debug:
+        print('Step 3: Use the Access Token to select the application instances and profiles (roles) to assume')
+        print('-------')
+
+    try:
+        targets, errors = awsbulk.select_targets(sso, awsbulk.split_patterns(args.appinstanceid), awsbulk.split_patterns(args.rolename), args.workers, catalog, portal_relogin)
+    except ApplicationInstancesError as e:
+        print(e.message)
+        exit(1)
+    for error in errors:
+        print('FAILED ' + error['instance']['id'] + ': ' + str(error['error']))
+    targets, duplicates = awsbulk.duplicate_profiles(targets, args.profile_template)
+    print('\n\r   - Assuming ' + str(len(targets)) + ' roles with ' + str(args.workers) + ' workers...\n\r')
+
+    failed = len(errors) + report_duplicates(duplicates)
+    sections = {}
+    entries = []
+    client = sts_client(args.stsregion, args.sts_client)
+    for result in awsbulk.assume_many(sso, targets, args.stsregion, args.workers, args.profile_template, catalog, client, portal_relogin):
+        pair = result['instance']['id'] + '/' + result['role']
+        if 'error' in result:
+            failed += 1
+            print('FAILED ' + pair + ': ' + str(result['error']))
+            continue
+        if credential_store:
+            entries.append((result['profile'], result['token'], args.stsregion, pair))
+        else:
+            sections[result['profile']] = credentials_section(result['token'], args.stsregion, source=pair)
+        print('OK ' + pair + ' -> [' + result['profile'] + '] expires ' + str(result['token']['Credentials']['Expiration']))
+
+    # All profiles are written in a single locked transaction
+    if credential_store:
+        credential_store.save_many(entries)
+    else:
+        awscredentialsfile().update(sections)
+    print('\n\r' + str(len(sections) + len(entries)) + ' profiles written, ' + str(failed) + ' failed.\n\r')
+    if failed:
+        exit(1)
+
+def report_duplicates(duplicates):
+    # Instance names are not unique, two pairs may map to one profile name. Neither is written
+    # or served. Returns the number of pairs left out.
+    failed = 0
+    for profile, pairs in sorted(duplicates.items()):
+        for instance, role_name in pairs:
+            failed += 1
+            print('FAILED ' + instance['id'] + '/' + role_name + ': profile [' + profile + '] is shared by ' + str(len(pairs)) + ' pairs, use {id} in --profile-template')
+    return failed
+
+def relogin():
+    # Full login after the portal rejected the session, through portal_relogin in the modes
+    # that call the portal concurrently. It runs on a worker thread, the password can only be
+    # asked for on a terminal.
+    if not args.password and not sys.stdin.isatty():
+        raise PortalSessionError('Portal session expired and no password to log in again, pass -p..')
+    if session_cache:
+        session_cache.clear()
+    sso.reset()
+    try:
+        login()
+    except SystemExit:
+        raise PortalSessionError('Logging in to the portal again failed..')
+
+def serve(token_response):
+    import secrets
+    import awsbulk
+    from awsserver import awscredentialserver
+    from awsrefresh import awscredentialcache
+    from awssts import sts_client
+    targets, errors = awsbulk.select_targets(sso, awsbulk.split_patterns(args.appinstanceid), awsbulk.split_patterns(args.rolename), args.workers, catalog, portal_relogin)
+    for error in errors:
+        print('FAILED ' + error['instance']['id'] + ': ' + str(error['error']))
+    targets, duplicates = awsbulk.duplicate_profiles(targets, args.profile_template)
+    report_duplicates(duplicates)
+    profiles = {}
+    for instance, role_name in targets:
+        profiles[awsbulk.profile_name(args.profile_template, instance, role_name)] = (instance, role_name)
+
+    client = sts_client(args.stsregion, args.sts_client)
+
+    def fetch(profile):
+        instance, role_name = profiles[profile]
+        return portal_relogin.call(awsbulk.assume_target, sso, instance, role_name, args.stsregion, client, catalog)
+
+    auth_token = args.serve_token or secrets.token_urlsafe(32)
+    server = awscredentialserver(awscredentialcache(fetch, args.refresh_margin), profiles, args.serve, auth_token)
+    print('\n\r   - Serving ' + str(len(profiles)) + ' profiles, press Ctrl-C to stop. Point the AWS SDKs at one of them with:\n\r')
+    print('export AWS_CONTAINER_AUTHORIZATION_TOKEN=' + auth_token)
+    for profile in sorted(profiles):
+        print('export AWS_CONTAINER_CREDENTIALS_FULL_URI=' + server.url(profile))
+    print('')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+def agent(token_response):
+    import awsbulk
+    from awsagent import awsagent
+    from awssaml import credentials_section
+    from awscredfile import awscredentialsfile
+    from awssts import sts_client
+    targets, errors = awsbulk.select_targets(sso, awsbulk.split_patterns(args.appinstanceid), awsbulk.split_patterns(args.rolename), args.workers, catalog, portal_relogin)
+    for error in errors:
+        print('FAILED ' + error['instance']['id'] + ': ' + str(error['error']))
+
+    def on_refresh(profile, pair, token):
+        if credential_store:
+            credential_store.save(profile, token, args.stsregion, pair)
+        else:
+            awscredentialsfile().update({profile: credentials_section(token, args.stsregion, source=pair)})
+        print('Refreshed ' + pair + ' -> [' + profile + '] expires ' + str(token['Credentials']['Expiration']))
+
+    refresh_agent = awsagent(sso, targets, args.stsregion, args.workers, args.refresh_margin, args.refresh_jitter, args.profile_template, catalog, on_refresh, relogin, client=sts_client(args.stsregion, args.sts_client))
+    report_duplicates(refresh_agent.duplicates)
+    # Credentials that are still valid in the credentials file are only refreshed when due
+    for profile, (instance, role_name) in refresh_agent.targets.items():
+        token = load_stored_credentials(profile, instance['id'] + '/' + role_name)
+        if token:
+            refresh_agent.seed(profile, token)
+    print('\n\r   - Refreshing ' + str(len(refresh_agent.targets)) + ' profiles, press Ctrl-C to stop...\n\r')
+    try:
+        refresh_agent.run()
+    except KeyboardInterrupt:
+        refresh_agent.stop()
+
+def crawl(token_response):
+    import awsbulk
+    # An entitlement audit must not miss instances created since the catalog was fetched
+    if catalog:
+        instances = portal_relogin.call(catalog.instances, sso, True)
+    else:
+        instances = portal_relogin.call(sso.list_application_instances)
+        if not instances or 'result' not in instances:
+            print('Error listing application instances..')
+            exit(1)
+        instances = instances['result']
+    if args.appinstanceid:
+        patterns = awsbulk.split_patterns(args.appinstanceid)
+        instances = [instance for instance in instances if awsbulk.matches(patterns, instance['id'], instance['name'])]
+    for record in awsbulk.crawl(sso, instances, args.concurrency, catalog, portal_relogin):
+        sys.__stdout__.write(json.dumps(record) + '\n')
+        sys.__stdout__.flush()
+
+def search(token_response):
+    # Runs against the local catalog, only stale entries are fetched from the portal
+    instances = portal_relogin.call(catalog.instances, sso)
+    catalog.refresh_profiles(sso, [instance['id'] for instance in instances], args.workers, relogin=portal_relogin)
+    for instance, role_name in catalog.search(args.search):
+        if role_name:
+            print(instance['id'] + '  ' + instance['name'] + '/' + role_name)
+        else:
+            print(instance['id'] + '  ' + instance['name'])
+
+def resolve_target(sso=None):
+    # Turn --target account-name/role into --appinstanceid and --rolename
+    try:
+        resolved = catalog.resolve(args.target, sso)
+    except InputError as e:
+        print(e.message)
+        exit(1)
+    if resolved:
+        args.appinstanceid = resolved[0]['id']
+        args.rolename = resolved[1]
+    return resolved
+
+def credentials_source():
+    # Recorded with the credentials so a profile is only reused for the same role
+    return args.appinstanceid + '/' + args.rolename
+
+def load_stored_credentials(profile, source):
+    # Credentials of profile still valid for --refresh-margin, from the store or the credentials file
+    if credential_store:
+        try:
+            return credential_store.get(profile, args.refresh_margin, source)
+        except InputError as e:
+            print(e.message)
+            exit(1)
+    from awssaml import load_cached_credentials
+    return load_cached_credentials(profile, args.refresh_margin, source=source)
+
+def list_valid_credentials():
+    for entry in credential_store.valid(args.refresh_margin):
+        print(entry['profile'] + '  ' + (entry['account'] or '-') + '  ' + (entry['role'] or '-') + '  expires ' + str(entry['expiration']))
+
+def export_credentials():
+    try:
+        profiles = credential_store.export(refresh_margin=args.refresh_margin)
+    except InputError as e:
+        print(e.message)
+        exit(1)
+    print(str(len(profiles)) + ' profiles written to the AWS credentials file.')
+
+def batch_login():
+    import awsbatch
+    from awssaml import credentials_section
+    from awscredfile import awscredentialsfile
+    try:
+        jobs = awsbatch.load_jobs(args.batch)
+    except InputError as e:
+        print(e.expression + ': ' + e.message)
+        exit(1)
+    settings = {'pool_size': args.pool_size, 'timeout': args.timeout, 'retries': args.retries, 'portal_rate': args.portal_rate, 'sts_rate': args.sts_rate}
+    print('\n\r   - Running ' + str(len(jobs)) + ' jobs from ' + args.batch + ' with ' + str(args.batch_jobs) + ' ' + args.batch_executor + ' workers...\n\r')
+
+    reports = []
+    for report in awsbatch.run_batch(jobs, args.batch_executor, args.batch_jobs, settings):
+        reports.append(report)
+        status = 'FAILED' if 'error' in report else 'OK'
+        print(status + ' [' + report['job'] + '] ' + report['login'] + '@' + report['directory'] + ': ' + str(report['ok']) + ' profiles, ' + str(len(report['failed'])) + ' failed in ' + str(report['duration']) + 's')
+        for error in ([report['error']] if 'error' in report else []) + report['failed']:
+            print('    ' + error)
+
+    # A profile written by two jobs is kept from neither, which one wins would depend on timing
+    duplicates = awsbatch.duplicate_profiles(reports)
+    for profile, job_names in sorted(duplicates.items()):
+        print('FAILED profile [' + profile + '] is written by jobs ' + ', '.join(job_names) + ', set distinct profile_template values')
+    entries = [entry for report in reports for entry in report['entries'] if entry[0] not in duplicates]
+    # All profiles of all jobs are written in a single locked transaction
+    if credential_store:
+        credential_store.save_many(entries)
+    else:
+        awscredentialsfile().update({profile: credentials_section(token, region, source=pair) for profile, token, region, pair in entries})
+
+    summary = awsbatch.summary(reports)
+    if args.batch_report:
+        with open(args.batch_report, 'w') as reportfile:
+            json.dump(summary, reportfile, indent=2)
+    print('\n\r' + str(len(entries)) + ' profiles written, ' + str(summary['failed_pairs']) + ' pairs and ' + str(summary['failed_jobs']) + ' jobs failed.\n\r')
+    if summary['failed_pairs'] or summary['failed_jobs'] or duplicates:
+        exit(1)
+
+def reuse_credentials():
+    from awssaml import credential_process_output
+    token = load_stored_credentials(args.profile, credentials_source())
+    if token is None:
+        return False
+    logging.debug('Reusing stored credentials from profile ' + args.profile)
+    if args.credential_process:
+        print(credential_process_output(token), file=sys.__stdout__)
+    else:
+        print('\n\rCredentials stored under the {0} profile are still valid until {1}.\n\r'.format(args.profile, token['Credentials']['Expiration']))
+    return True
+
+def login():
+    # Reuse a portal session from a previous run when there is one, this skips the
+    # password prompt, the authcode POST and the token exchange
+    if session_cache:
+        cached = session_cache.load()
+        if cached:
+            logging.debug('Reusing cached portal session')
+            # Calls made without cookies, like the catalog and bulk ones, use the session's jar
+            sso._merge_cookies(cached['cookies'])
+            if args.verbose or args.debug:
+                print('   - Reusing cached portal session for ' + args.login + '...\n\r')
+            return cached, True
+
     if not args.password:
         try:
             logging.debug('Asking for password')
+            import getpass
             args.password = getpass.getpass('Please type password for user ' + args.login + ': ')
         except Exception as e:
             print(e)
             exit(1)
-    logging.debug('Creating awssso object')
-    sso = awssso(args.netbios, args.dirname, args.directoryurl, args.ssoregion, args.login, args.password, args.verbose, args.debug)
+    sso.set_password(args.password)
     logging.debug('Calling get_authentication_code')
     authcode_res = get_authentication_code()
     logging.debug('Calling get_access_token')
     token_res = get_access_token(authcode_res)
+    if session_cache:
+        session_cache.save(token_res['token'], token_res['cookies'])
+    return token_res, False
+
+def run(token_res):
+    if args.target and not args.appinstanceid:
+        if not resolve_target(sso):
+            print('Target ' + args.target + ' was not found')
+            exit(1)
+    if args.serve is not None:
+        logging.debug('Calling serve')
+        serve(token_res)
+        return
+    if args.agent:
+        logging.debug('Calling agent')
+        agent(token_res)
+        return
+    if args.crawl:
+        logging.debug('Calling crawl')
+        crawl(token_res)
+        return
+    if args.search:
+        logging.debug('Calling search')
+        search(token_res)
+        return
+    # In bulk mode every matching application instance and role is assumed
+    if args.bulk:
+        logging.debug('Calling bulk_assume')
+        bulk_assume(token_res)
     # If an Access Token is successfully obtained then it will be used to
     # list the applications configured in AWS SSO for this user.
     # If appinstanceid and rolename args are not passed then it will show the list of sso applications
     # The the user copy the application instance id and pass it as an argument to this module.
-    if not args.appinstanceid and not args.rolename:
+    elif not args.appinstanceid and not args.rolename:
         logging.debug('Calling list_application_instances')
         list_application_instances(token_res)
     # If only the application instance id is passed as argument then
@@ -156,3 +515,159 @@ if __name__ == '__main__':
         logging.debug('Calling get_saml_assertion')
         get_saml_assertion(token_res)
 
+def main(argv=None):
+    global args
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        if not args.appinstanceid or not args.rolename:
+            parser.error('--serve requires --appinstanceid and --rolename')
+        if args.bulk or args.crawl or args.agent or args.credential_process:
+            parser.error('--serve can not be combined with --bulk, --crawl, --agent or --credential-process')
+
+    if args.agent:
+        if not args.appinstanceid or not args.rolename:
+            parser.error('--agent requires --appinstanceid and --rolename')
+        if args.bulk or args.crawl or args.credential_process:
+            parser.error('--agent can not be combined with --bulk, --crawl or --credential-process')
+
+    if args.crawl:
+        if args.bulk or args.credential_process:
+            parser.error('--crawl can not be combined with --bulk or --credential-process')
+        # stdout only carries the JSON Lines records
+        sys.stdout = sys.stderr
+
+    if args.batch:
+        if args.bulk or args.crawl or args.agent or args.serve is not None or args.credential_process or args.target or args.search:
+            parser.error('--batch can not be combined with --bulk, --crawl, --agent, --serve, --credential-process, --target or --search')
+
+    if args.refresh_catalog:
+        args.catalog_ttl = 0
+
+    if args.bulk:
+        if not args.appinstanceid or not args.rolename:
+            parser.error('--bulk requires --appinstanceid and --rolename')
+        if args.credential_process:
+            parser.error('--bulk can not be combined with --credential-process')
+
+    if args.credential_process:
+        if not args.target and (not args.appinstanceid or not args.rolename):
+            parser.error('--credential-process requires --target or --appinstanceid and --rolename')
+        # stdout is reserved for the JSON document read by the SDK
+        sys.stdout = sys.stderr
+
+    if args.debug or args.timings or args.prometheus_textfile:
+        import awstrace
+    if args.debug:
+        # requests, urllib3 and botocore log urls, cookies and response bodies at debug level
+        logging.basicConfig(handlers=[awstrace.debug_log_handler('ssocli.log')], level=logging.DEBUG)
+    tracer = None
+    if args.timings or args.prometheus_textfile:
+        tracer = awstrace.awstracer({'directory': args.directoryurl, 'sso_region': args.ssoregion, 'sts_region': args.stsregion})
+        awstrace.set_tracer(tracer)
+    try:
+        _main(parser)
+    finally:
+        if tracer:
+            write_timings(tracer)
+
+def write_timings(tracer):
+    try:
+        if args.timings:
+            tracer.write(args.timings, args.timings_format)
+        if args.prometheus_textfile:
+            tracer.write_prometheus(args.prometheus_textfile)
+    except OSError as e:
+        print('Writing timings failed: ' + str(e), file=sys.stderr)
+
+def _main(parser):
+    global sso, catalog, session_cache, credential_store, portal_relogin
+    # The directories of --batch come from its config file
+    if not args.batch:
+        print('\n\rDirectory URL: ' + args.directoryurl)
+        print('Directory Name: ' + args.dirname)
+        print('NETBIOS Name: ' + args.netbios)
+        print('SSO Region: ' + args.ssoregion)
+        print('STS Region: ' + args.stsregion + '\n\r')
+
+    credential_store = None
+    if args.credential_store is not None:
+        from awsstore import awscredentialstore
+        try:
+            credential_store = awscredentialstore(args.credential_store or None, args.cache_key)
+        except InputError as e:
+            print(e.message)
+            exit(1)
+    elif args.list_valid or args.export_credentials:
+        parser.error('--list-valid and --export-credentials need --credential-store')
+    # Both only read the local store
+    if args.list_valid:
+        list_valid_credentials()
+        exit(0)
+    if args.export_credentials:
+        export_credentials()
+        exit(0)
+    if args.batch:
+        batch_login()
+        exit(0)
+
+    catalog = None
+    if not args.no_catalog:
+        from awscatalog import awscatalog
+        catalog = awscatalog(args.directoryurl, args.login, args.ssoregion, ttl=args.catalog_ttl)
+    elif args.target or args.search:
+        parser.error('--target and --search need the local catalog')
+    # Names are resolved offline when the catalog already knows them
+    if args.target:
+        args.appinstanceid = None
+        args.rolename = None
+        resolve_target()
+    # Credentials that are still valid are returned without touching SSO or STS
+    if args.appinstanceid and args.rolename and (args.credential_process or args.reuse_credentials):
+        if reuse_credentials():
+            exit(0)
+    logging.debug('Creating awssso object')
+    from awssso import awssso
+    from awshttp import httpconfig
+    from awscache import awssessioncache
+    pool_size = args.pool_size
+    if args.bulk or args.agent or args.serve is not None:
+        pool_size = max(pool_size, args.workers)
+    if args.crawl:
+        pool_size = max(pool_size, args.concurrency)
+    http_config = httpconfig(pool_connections=pool_size, pool_maxsize=pool_size, timeout=(min(5, args.timeout), args.timeout), retries=args.retries)
+    # Every host gets its own bucket and adaptive concurrency limit, bounded by the pool size
+    import awslimit
+    awslimit.configure(awslimit.limitconfig(rate=args.portal_rate or None, concurrency=pool_size, retries=args.retries))
+    awslimit.configure(awslimit.limitconfig(rate=args.sts_rate or None, concurrency=pool_size, retries=args.retries), 'sts:' + args.stsregion)
+    sso = awssso(args.netbios, args.dirname, args.directoryurl, args.ssoregion, args.login, args.password or '', args.verbose, args.debug, http_config=http_config)
+    # One login at a time when concurrent portal calls find the session expired
+    from awsrefresh import awsrelogin
+    portal_relogin = awsrelogin(relogin)
+    session_cache = None
+    if not args.no_session_cache:
+        try:
+            session_cache = awssessioncache(args.directoryurl, args.login, args.ssoregion, ttl=args.session_cache_ttl, key=args.cache_key)
+        except InputError as e:
+            print(e.message)
+            exit(1)
+    token_res, from_cache = login()
+    try:
+        run(token_res)
+    except PortalSessionError as e:
+        if not from_cache:
+            print(e.message)
+            exit(1)
+        # The cached session was rejected by the portal, fall back to a full login once
+        logging.debug('Cached portal session rejected, logging in again')
+        session_cache.clear()
+        sso.reset()
+        token_res, from_cache = login()
+        run(token_res)
+    finally:
+        if catalog:
+            catalog.save()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# End to end benchmark of the login pipeline against the local stand-in from fakeaws.py.
+# The fake runs in its own process so it does not compete with the client for the GIL.
+#
+#   python benchmarks/bench_login.py --logins 50 --latency-ms 20 --workers 16
+#
+# Reports per stage latency percentiles of single logins, the throughput of a bulk refresh
+# of every account/role pair and, from a second refresh under tracemalloc, its memory use.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws-sso-cli'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeaws
+
+STAGES = ['authcode', 'token', 'list_instances', 'list_profiles', 'saml_endpoint', 'saml_assertion', 'saml_parse', 'sts', 'credentials_write', 'total']
+
+def serve_fake(options, queue):
+    server = fakeaws.fakeawsserver(fakeaws.from_arguments(options))
+    queue.put(server.base_url)
+    server.serve_forever()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+def new_sso(options, base_url):
+    from awssso import awssso
+    from awshttp import httpconfig
+    import awslimit
+    awslimit.configure(awslimit.limitconfig(concurrency=options.workers, retries=options.retries))
+    http_config = httpconfig(pool_connections=options.workers, pool_maxsize=options.workers, retries=options.retries)
+    return awssso('d-fake', 'd-fake', 'd-fake.awsapps.com', 'us-east-1', 'user@example.com', fakeaws.PASSWORD,
+                  http_config=http_config, portal_url=base_url, directory_endpoint=base_url)
+
+def timed(timings, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+def bench_logins(options, base_url, client):
+    # Every stage of a single role login, repeated options.logins times
+    from awssaml import awssaml, credentials_section
+    from awscredfile import awscredentialsfile
+    credentials_file = awscredentialsfile()
+    timings = {}
+    failures = 0
+    for _ in range(options.logins):
+        start = time.perf_counter()
+        try:
+            sso = new_sso(options, base_url)
+            authcode = timed(timings, 'authcode', sso.get_authentication_code)
+            timed(timings, 'token', sso.get_access_token, authcode['authcode'], authcode['referer'])
+            instances = timed(timings, 'list_instances', sso.list_application_instances)
+            instance_id = instances['result'][0]['id']
+            roles = timed(timings, 'list_profiles', sso.list_roles_for_appinstanceid, instance_id)
+            role_name = roles['result'][0]['name']
+            endpoint = timed(timings, 'saml_endpoint', sso.get_saml_endpoint, instance_id, role_name)
+            encoded_saml = timed(timings, 'saml_assertion', sso.get_saml_assertion, instance_id, role_name, saml_endpoint=endpoint)
+            saml = awssaml(encoded_saml)
+            attributes = timed(timings, 'saml_parse', saml.parse_all)
+            role = attributes['roles'][0]
+            token = timed(timings, 'sts', saml.assume_role, role['role_arn'], role['principal_arn'], 'us-east-1', client=client, duration_seconds=attributes['session_duration'])
+            timed(timings, 'credentials_write', credentials_file.update, {'bench': credentials_section(token, 'us-east-1')})
+        except Exception as e:
+            failures += 1
+            print('login failed: ' + str(e), file=sys.stderr)
+            continue
+        timings.setdefault('total', []).append((time.perf_counter() - start) * 1000)
+    return timings, failures
+
+def bulk_refresh(options, sso, client):
+    # Select and assume every account/role pair on options.workers threads, then write them
+    import awsbulk
+    from awssaml import credentials_section
+    from awscredfile import awscredentialsfile
+    start = time.perf_counter()
+    targets, errors = awsbulk.select_targets(sso, ['all'], ['all'], options.workers)
+    selected = time.perf_counter()
+    sections = {}
+    failures = len(errors)
+    for result in awsbulk.assume_many(sso, targets, 'us-east-1', options.workers, client=client):
+        if 'error' in result:
+            failures += 1
+        else:
+            sections[result['profile']] = credentials_section(result['token'], 'us-east-1')
+    assumed = time.perf_counter()
+    awscredentialsfile().update(sections)
+    end = time.perf_counter()
+    return {
+        'pairs': len(targets),
+        'failures': failures,
+        'select_s': round(selected - start, 3),
+        'assume_s': round(assumed - selected, 3),
+        'write_s': round(end - assumed, 3),
+        'total_s': round(end - start, 3),
+        'pairs_per_s': round(len(targets) / (end - start), 1) if end > start else None,
+    }
+
+def bench_bulk(options, base_url, client):
+    # One login, then a timed refresh of every account/role pair. tracemalloc slows every
+    # allocation down, the memory is measured in a second refresh that is not timed.
+    sso = new_sso(options, base_url)
+    authcode = sso.get_authentication_code()
+    sso.get_access_token(authcode['authcode'], authcode['referer'])
+
+    result = bulk_refresh(options, sso, client)
+    # Calls, throttles and retries seen by the limiter of each endpoint
+    import awslimit
+    for name, limiter in sorted(awslimit.limiters().items()):
+        stats = dict(limiter.stats)
+        stats['concurrency_limit'] = round(limiter.concurrency.limit, 1)
+        if limiter.rate is not None:
+            stats['rate_limit'] = round(limiter.rate, 1)
+        result['limiter ' + name] = stats
+    try:
+        import resource
+        # Kilobytes on Linux, bytes on macOS
+        result['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    if not options.skip_memory:
+        tracemalloc.start()
+        bulk_refresh(options, sso, client)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['tracemalloc_peak_kib'] = round(peak / 1024.0, 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    fakeaws.add_arguments(parser)
+    parser.add_argument('--logins', type=int, default=50, help='Number of single role logins to time stage by stage')
+    parser.add_argument('--workers', type=int, default=16, help='Threads used for the bulk refresh')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of throttled or failed portal and STS calls, see awslimit')
+    parser.add_argument('--sts-client', choices=['builtin', 'boto3'], default='builtin', help='STS client used for AssumeRoleWithSAML')
+    parser.add_argument('--skip-bulk', action='store_true', help='Only time single logins')
+    parser.add_argument('--skip-memory', action='store_true', help='Do not repeat the bulk refresh under tracemalloc to measure its memory')
+    parser.add_argument('--json', action='store_true', help='Print the results as one JSON document')
+    options = parser.parse_args()
+
+    # Credentials are written to a throw away HOME
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='ssocli-bench-')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'unused')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'unused')
+
+    queue = multiprocessing.Queue()
+    fake = multiprocessing.Process(target=serve_fake, args=(options, queue), daemon=True)
+    fake.start()
+    base_url = queue.get(timeout=30)
+    try:
+        from awssts import sts_client
+        client = sts_client('us-east-1', options.sts_client, endpoint_url=base_url + '/sts/')
+        timings, failures = bench_logins(options, base_url, client)
+        report = {'logins': options.logins, 'login_failures': failures, 'stages': {}}
+        for stage in STAGES:
+            values = timings.get(stage, [])
+            if values:
+                report['stages'][stage] = {
+                    'p50_ms': round(percentile(values, 0.50), 2),
+                    'p90_ms': round(percentile(values, 0.90), 2),
+                    'p99_ms': round(percentile(values, 0.99), 2),
+                    'max_ms': round(max(values), 2),
+                }
+        if not options.skip_bulk:
+            report['bulk'] = bench_bulk(options, base_url, client)
+    finally:
+        fake.terminate()
+
+    if options.json:
+        print(json.dumps(report, indent=2))
+        return
+    print('{0} logins, {1} failed'.format(report['logins'], report['login_failures']))
+    print('{0:<18} {1:>9} {2:>9} {3:>9} {4:>9}'.format('stage', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for stage in STAGES:
+        if stage in report['stages']:
+            values = report['stages'][stage]
+            print('{0:<18} {1:>9} {2:>9} {3:>9} {4:>9}'.format(stage, values['p50_ms'], values['p90_ms'], values['p99_ms'], values['max_ms']))
+    if 'bulk' in report:
+        print('')
+        for key, value in report['bulk'].items():
+            print('bulk {0:<22} {1}'.format(key, value))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Startup time of ssocli.py per subcommand. Each scenario runs in a fresh interpreter,
+# the wall time is measured around the subprocess and python -X importtime tells which
+# heavy modules were loaded. Nothing here talks to the network.
+#
+#   python benchmarks/bench_startup.py [-n RUNS] [--json]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws-sso-cli')
+SSOCLI = os.path.join(SRC, 'ssocli.py')
+HEAVY_MODULES = ('requests', 'urllib3', 'boto3', 'botocore', 'lxml', 'cryptography')
+
+def seed_home():
+    # A HOME with still valid credentials so --credential-process never logs in
+    home = tempfile.mkdtemp(prefix='ssocli-bench-')
+    os.makedirs(os.path.join(home, '.aws'))
+    expiration = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+    with open(os.path.join(home, '.aws', 'credentials'), 'w') as credentialsfile:
+        credentialsfile.write('[bench]\n'
+                              'aws_access_key_id = AKIABENCH\n'
+                              'aws_secret_access_key = secret\n'
+                              'aws_session_token = token\n'
+                              'x_security_token_expires = ' + expiration + '\n'
+                              'x_ssocli_source = ins-bench/Bench\n')
+    return home
+
+def scenarios():
+    return [
+        ('python', ['-c', 'pass']),
+        ('help', [SSOCLI, '-h']),
+        ('credential-process cached', [SSOCLI, '--credential-process', '-i', 'ins-bench', '-r', 'Bench', '-P', 'bench']),
+        ('import ssocli', ['-c', 'import ssocli']),
+        ('import awssaml', ['-c', 'import awssaml']),
+        ('import awssts', ['-c', 'import awssts']),
+        ('import awssso', ['-c', 'import awssso']),
+        ('import boto3 (reference)', ['-c', 'import boto3']),
+    ]
+
+def run(argv, env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + argv
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, cwd=SRC, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    return time.perf_counter() - start, completed.stderr
+
+def heavy_imports(stderr):
+    loaded = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        module = line.rsplit('|', 1)[-1].strip()
+        if module.split('.')[0] in HEAVY_MODULES:
+            loaded.add(module.split('.')[0])
+    return sorted(loaded)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Runs per scenario')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per scenario')
+    options = parser.parse_args()
+
+    env = dict(os.environ)
+    env['HOME'] = seed_home()
+    env['PYTHONPATH'] = SRC
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    results = []
+    for name, argv in scenarios():
+        # Warm the bytecode cache first
+        run(argv, env)
+        times = [run(argv, env)[0] * 1000 for _ in range(options.runs)]
+        heavy = heavy_imports(run(argv, env, importtime=True)[1])
+        results.append({
+            'scenario': name,
+            'min_ms': round(min(times), 1),
+            'median_ms': round(statistics.median(times), 1),
+            'heavy_imports': heavy,
+        })
+
+    if options.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print('{0:<28} {1:>9} {2:>11}  {3}'.format('scenario', 'min ms', 'median ms', 'heavy imports'))
+    for result in results:
+        print('{0:<28} {1:>9} {2:>11}  {3}'.format(result['scenario'], result['min_ms'], result['median_ms'], ', '.join(result['heavy_imports']) or '-'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the AWS SSO directory login, the SSO portal and STS AssumeRoleWithSAML.
+# Responses follow the shapes recorded from the real services, with configurable injected
+# latency and error rates. Used by bench_login.py, can also be run on its own:
+#
+#   python benchmarks/fakeaws.py --port 8080 --latency-ms 30
+#
+# then point awssso at it with portal_url and directory_endpoint set to http://127.0.0.1:8080
+# and the STS client at http://127.0.0.1:8080/sts/.
+
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+SSO_COOKIE = 'x-amz-sso_authn'
+PASSWORD = 'benchmark'
+
+SAML_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<saml2p:Response xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol" Destination="https://signin.aws.amazon.com/saml" ID="_{response_id}" IssueInstant="{now}" Version="2.0">
+<saml2:Issuer xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion">https://portal.sso.us-east-1.amazonaws.com/saml/assertion/{issuer}</saml2:Issuer>
+<saml2p:Status><saml2p:StatusCode Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></saml2p:Status>
+<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="_{assertion_id}" IssueInstant="{now}" Version="2.0">
+<saml2:Issuer>https://portal.sso.us-east-1.amazonaws.com/saml/assertion/{issuer}</saml2:Issuer>
+<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><ds:SignedInfo><ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/><ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/></ds:SignedInfo><ds:SignatureValue>{signature}</ds:SignatureValue><ds:KeyInfo><ds:X509Data><ds:X509Certificate>{certificate}</ds:X509Certificate></ds:X509Data></ds:KeyInfo></ds:Signature>
+<saml2:Subject><saml2:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress">{login}</saml2:NameID><saml2:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer"><saml2:SubjectConfirmationData NotOnOrAfter="{not_on_or_after}" Recipient="https://signin.aws.amazon.com/saml"/></saml2:SubjectConfirmation></saml2:Subject>
+<saml2:Conditions NotBefore="{now}" NotOnOrAfter="{not_on_or_after}"><saml2:AudienceRestriction><saml2:Audience>urn:amazon:webservices</saml2:Audience></saml2:AudienceRestriction></saml2:Conditions>
+<saml2:AuthnStatement AuthnInstant="{now}" SessionIndex="_{session_index}"><saml2:AuthnContext><saml2:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport</saml2:AuthnContextClassRef></saml2:AuthnContext></saml2:AuthnStatement>
+<saml2:AttributeStatement>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/RoleSessionName"><saml2:AttributeValue>{login}</saml2:AttributeValue></saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/Role"><saml2:AttributeValue>arn:aws:iam::{account}:role/aws-reserved/sso.amazonaws.com/AWSReservedSSO_{role}_{role_suffix},arn:aws:iam::{account}:saml-provider/AWSSSO_{provider}_DO_NOT_DELETE</saml2:AttributeValue></saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/SessionDuration"><saml2:AttributeValue>{session_duration}</saml2:AttributeValue></saml2:Attribute>
+</saml2:AttributeStatement>
+</saml2:Assertion>
+</saml2p:Response>'''
+
+STS_RESPONSE = '''<AssumeRoleWithSAMLResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleWithSAMLResult>
+    <Audience>https://signin.aws.amazon.com/saml</Audience>
+    <AssumedRoleUser>
+      <AssumedRoleId>AROA{role_id}:{login}</AssumedRoleId>
+      <Arn>arn:aws:sts::{account}:assumed-role/{role}/{login}</Arn>
+    </AssumedRoleUser>
+    <Credentials>
+      <AccessKeyId>ASIA{key_id}</AccessKeyId>
+      <SecretAccessKey>{secret}</SecretAccessKey>
+      <SessionToken>{session_token}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+    <Issuer>https://portal.sso.us-east-1.amazonaws.com/saml/assertion/fake</Issuer>
+    <NameQualifier>fake</NameQualifier>
+    <PackedPolicySize>6</PackedPolicySize>
+    <Subject>{login}</Subject>
+    <SubjectType>persistent</SubjectType>
+  </AssumeRoleWithSAMLResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</AssumeRoleWithSAMLResponse>'''
+
+STS_ERROR = '''<ErrorResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <Error>
+    <Type>Sender</Type>
+    <Code>{code}</Code>
+    <Message>{message}</Message>
+  </Error>
+  <RequestId>{request_id}</RequestId>
+</ErrorResponse>'''
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def _random_text(length):
+    return base64.b64encode(bytes(random.getrandbits(8) for _ in range(length))).decode('ascii')
+
+class fakeaws:
+    # State shared by the handler threads: the accounts, issued auth codes and sessions
+    def __init__(self, accounts=150, roles=('AdministratorAccess', 'ReadOnlyAccess'), latency_ms=0, latency_jitter_ms=0,
+                 portal_error_rate=0.0, sts_error_rate=0.0, session_duration=3600, portal_max_rps=0, sts_max_rps=0):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.portal_error_rate = portal_error_rate
+        self.sts_error_rate = sts_error_rate
+        self.session_duration = session_duration
+        # Requests beyond these rates are throttled like the real services do, 0 for no limit
+        self.capacity = {'portal': [portal_max_rps, portal_max_rps, time.monotonic()], 'sts': [sts_max_rps, sts_max_rps, time.monotonic()]}
+        self.lock = threading.Lock()
+        self.authcodes = {}
+        self.sessions = {}
+        self.requests = {}
+        self.instances = []
+        self.profiles = {}
+        for number in range(accounts):
+            account = str(100000000000 + number)
+            instance_id = 'ins-' + uuid.UUID(int=number).hex[-16:]
+            self.instances.append({
+                'id': instance_id,
+                'name': 'account-' + str(number),
+                'description': 'AWS Account',
+                'applicationId': 'app-' + uuid.UUID(int=number).hex[-16:],
+                'applicationName': 'AWS Account',
+                'icon': 'https://static.global.sso.amazonaws.com/app/aws-account.png',
+                'searchMetadata': {'AccountId': account, 'AccountName': 'account-' + str(number), 'AccountEmail': 'aws+' + str(number) + '@example.com'},
+            })
+            self.profiles[instance_id] = [{
+                'id': 'p-' + uuid.UUID(int=number * 100 + index).hex[-16:],
+                'name': role,
+                'description': '',
+                'url': None,
+                'protocol': 'SAML',
+                'relayState': None,
+                'account': account,
+            } for index, role in enumerate(roles)]
+
+    def delay(self):
+        if self.latency_ms or self.latency_jitter_ms:
+            time.sleep(max(0.0, random.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000.0)
+
+    def over_capacity(self, service):
+        # Token bucket of one second worth of requests
+        with self.lock:
+            bucket = self.capacity[service]
+            rate = bucket[0]
+            if not rate:
+                return False
+            now = time.monotonic()
+            bucket[1] = min(rate, bucket[1] + (now - bucket[2]) * rate)
+            bucket[2] = now
+            if bucket[1] < 1:
+                self.requests['throttled_' + service] = self.requests.get('throttled_' + service, 0) + 1
+                return True
+            bucket[1] -= 1
+            return False
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+class fakeawshandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, without TCP_NODELAY every response would wait
+    # for the client's delayed ACK (~40ms on Linux)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def _session(self):
+        cookies = self.headers.get('Cookie', '')
+        for cookie in cookies.split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == SSO_COOKIE and value in self.server.fake.sessions:
+                return self.server.fake.sessions[value]
+        return None
+
+    def _portal_error(self):
+        if self.server.fake.over_capacity('portal'):
+            self._send(429, json.dumps({'message': 'Too Many Requests'}))
+            return True
+        if random.random() < self.server.fake.portal_error_rate:
+            self._send(503, json.dumps({'message': 'Service Unavailable'}))
+            return True
+        return False
+
+    def do_POST(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        body = self._body()
+        fake.delay()
+        if url.path == '/login/WarpDriveLogin/GalaxyInternalService':
+            fake.count('authcode')
+            fields = body.split('|')
+            if len(fields) < 14 or fields[12] != PASSWORD:
+                self._send(200, '//EX[2,1,["com.amazonaws.warpdrive.console.shared.exception.AuthenticationFailedException/1","Incorrect username or password"],0,7]', 'application/json; charset=utf-8')
+                return
+            authcode = uuid.uuid4().hex
+            with fake.lock:
+                fake.authcodes[authcode] = fields[13]
+            self._send(200, '//OK' + json.dumps([8, 7, 6, 5, 4, 3, 2, 1, ['com.amazonaws.warpdrive.console.shared.LoginResponse_v4/2741225826', authcode, 'Bearer'], 0, 7]), 'application/json; charset=utf-8')
+        elif url.path == '/sts/':
+            fake.count('sts')
+            self._assume_role_with_saml(parse_qs(body))
+        else:
+            self._send(404, json.dumps({'message': 'Not Found'}))
+
+    def _assume_role_with_saml(self, params):
+        fake = self.server.fake
+        request_id = str(uuid.uuid4())
+        if fake.over_capacity('sts') or random.random() < fake.sts_error_rate:
+            self._send(400, STS_ERROR.format(code='Throttling', message='Rate exceeded', request_id=request_id), 'text/xml')
+            return
+        try:
+            base64.b64decode(params['SAMLAssertion'][0])
+            role_arn = params['RoleArn'][0]
+            if 'PrincipalArn' not in params:
+                raise KeyError('PrincipalArn')
+        except (KeyError, ValueError):
+            self._send(400, STS_ERROR.format(code='InvalidIdentityToken', message='Invalid SAML assertion', request_id=request_id), 'text/xml')
+            return
+        account = role_arn.split(':')[4]
+        duration = int(params.get('DurationSeconds', ['3600'])[0])
+        self._send(200, STS_RESPONSE.format(
+            role_id=uuid.uuid4().hex[:17].upper(),
+            login='user',
+            account=account,
+            role=role_arn.rsplit('/', 1)[-1],
+            key_id=uuid.uuid4().hex[:16].upper(),
+            secret=_random_text(30),
+            session_token=_random_text(600),
+            expiration=_timestamp(datetime.now(timezone.utc) + timedelta(seconds=duration)),
+            request_id=request_id,
+        ), 'text/xml')
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        fake.delay()
+        base = 'http://' + self.headers.get('Host')
+        if url.path == '/auth/wd':
+            fake.count('token')
+            authcode = parse_qs(url.query).get('auth_code', [''])[0]
+            with fake.lock:
+                login = fake.authcodes.pop(authcode, None)
+                if login is None:
+                    self._send(401, json.dumps({'message': 'Invalid auth code'}))
+                    return
+                token = _random_text(300).replace('/', '_').replace('+', '-').replace('=', '')
+                fake.sessions[token] = login
+            # The portal sets the session cookie and redirects to the start page
+            self._send(302, '', 'text/html', [('Location', '/start/'), ('Set-Cookie', SSO_COOKIE + '=' + token + '; Path=/; HttpOnly')])
+            return
+        if url.path == '/start/':
+            self._send(200, '<html><body>AWS SSO</body></html>', 'text/html')
+            return
+
+        login = self._session()
+        if login is None:
+            self._send(401, json.dumps({'message': 'Unauthorized'}))
+            return
+        if self._portal_error():
+            return
+        parts = url.path.strip('/').split('/')
+        if url.path == '/instance/appinstances':
+            fake.count('appinstances')
+            self._send(200, json.dumps({'result': fake.instances, 'paginationToken': None}))
+        elif len(parts) == 4 and parts[:2] == ['instance', 'appinstance'] and parts[3] == 'profiles':
+            fake.count('profiles')
+            instance_id = parts[2]
+            if instance_id not in fake.profiles:
+                self._send(404, json.dumps({'message': 'Not Found'}))
+                return
+            result = []
+            for profile in fake.profiles[instance_id]:
+                profile = dict(profile)
+                profile['url'] = base + '/federation/instance/appinstance/' + instance_id + '/profile/' + profile['id'] + '/saml'
+                del profile['account']
+                result.append(profile)
+            self._send(200, json.dumps({'result': result, 'paginationToken': None}))
+        elif len(parts) == 7 and parts[0] == 'federation' and parts[6] == 'saml':
+            fake.count('saml')
+            instance_id = parts[3]
+            profile = next((profile for profile in fake.profiles.get(instance_id, []) if profile['id'] == parts[5]), None)
+            if profile is None:
+                self._send(404, json.dumps({'message': 'Not Found'}))
+                return
+            now = datetime.now(timezone.utc)
+            xml = SAML_TEMPLATE.format(
+                response_id=uuid.uuid4().hex,
+                assertion_id=uuid.uuid4().hex,
+                session_index=uuid.uuid4().hex,
+                now=_timestamp(now),
+                not_on_or_after=_timestamp(now + timedelta(minutes=5)),
+                issuer='fake',
+                signature=_random_text(256),
+                certificate=_random_text(900),
+                login=login,
+                account=profile['account'],
+                role=profile['name'],
+                role_suffix=uuid.UUID(int=len(profile['name'])).hex[-16:],
+                provider='fake',
+                session_duration=fake.session_duration,
+            )
+            self._send(200, json.dumps({'encodedResponse': base64.b64encode(xml.encode('utf-8')).decode('ascii'), 'destination': 'https://signin.aws.amazon.com/saml', 'relayState': None}))
+        else:
+            self._send(404, json.dumps({'message': 'Not Found'}))
+
+class fakeawsserver(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, fake, port=0, host='127.0.0.1'):
+        self.fake = fake
+        ThreadingHTTPServer.__init__(self, (host, port), fakeawshandler)
+
+    @property
+    def base_url(self):
+        return 'http://' + self.server_address[0] + ':' + str(self.server_address[1])
+
+def add_arguments(parser):
+    parser.add_argument('--accounts', type=int, default=150, help='Number of application instances (AWS accounts)')
+    parser.add_argument('--roles', default='AdministratorAccess,ReadOnlyAccess', help='Comma separated profile (role) names of every account')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Mean latency injected into every response')
+    parser.add_argument('--latency-jitter-ms', type=float, default=0, help='Standard deviation of the injected latency')
+    parser.add_argument('--portal-error-rate', type=float, default=0.0, help='Share of portal requests answered with 503')
+    parser.add_argument('--sts-error-rate', type=float, default=0.0, help='Share of STS requests answered with Throttling')
+    parser.add_argument('--portal-max-rps', type=float, default=0, help='Portal requests per second above which 429 is returned, 0 for no limit')
+    parser.add_argument('--sts-max-rps', type=float, default=0, help='STS requests per second above which Throttling is returned, 0 for no limit')
+
+def from_arguments(options):
+    return fakeaws(options.accounts, [role.strip() for role in options.roles.split(',') if role.strip()], options.latency_ms,
+                   options.latency_jitter_ms, options.portal_error_rate, options.sts_error_rate,
+                   portal_max_rps=options.portal_max_rps, sts_max_rps=options.sts_max_rps)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on, 0 for any free port')
+    add_arguments(parser)
+    options = parser.parse_args()
+    server = fakeawsserver(from_arguments(options), options.port)
+    print('Listening on ' + server.base_url + ', log in with password "' + PASSWORD + '"', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
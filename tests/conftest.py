@@ -0,0 +1,53 @@
+import os
+import sys
+
+# The modules of aws-sso-cli import each other by their flat names, like ssocli.py does
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'aws-sso-cli'), os.path.join(ROOT, 'benchmarks')]
+
+import threading
+import pytest
+import fakeaws
+
+@pytest.fixture
+def fake():
+    # A local SSO portal and STS endpoint, see benchmarks/fakeaws.py
+    aws = fakeaws.fakeaws(accounts=3)
+    server = fakeaws.fakeawsserver(aws)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    aws.base_url = server.base_url
+    yield aws
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def portal(fake, home, monkeypatch):
+    # ssocli pointed at the fake: every awssso object and STS client talks to it
+    import awssso
+    import awssts
+    sso_class = awssso.awssso
+    sts_client = awssts.sts_client
+
+    class fakeawssso(sso_class):
+        def __init__(self, *args, **kwargs):
+            kwargs.update(portal_url=fake.base_url, directory_endpoint=fake.base_url)
+            sso_class.__init__(self, *args, **kwargs)
+
+    monkeypatch.setattr(awssso, 'awssso', fakeawssso)
+    monkeypatch.setattr(awssts, 'sts_client', lambda region, kind='boto3', endpoint_url=None: sts_client(region, 'builtin', fake.base_url + '/sts/'))
+    return fake
+
+@pytest.fixture
+def sso(fake):
+    # A portal session of the fake, logged in like awsbatch.run_job does
+    from awssso import awssso
+    session = awssso('d-example', 'd-example', 'd-example.awsapps.com', 'us-east-1', 'user1@example.com', fakeaws.PASSWORD,
+                     portal_url=fake.base_url, directory_endpoint=fake.base_url)
+    authcode = session.get_authentication_code()
+    session.get_access_token(authcode['authcode'], authcode['referer'])
+    return session
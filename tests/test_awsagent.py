@@ -0,0 +1,70 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from awsagent import awsagent
+from awssts import sts_client
+from awsexceptions import STSError
+
+def token(seconds):
+    return {'Credentials': {'AccessKeyId': 'ASIAEXAMPLE', 'Expiration': datetime.now(timezone.utc) + timedelta(seconds=seconds)}}
+
+def test_next_refresh_is_the_margin_before_expiry():
+    agent = awsagent(None, [], 'us-east-1', refresh_margin=300, jitter=0, min_backoff=5)
+    assert agent._next_refresh(token(3600)) == pytest.approx(time.time() + 3300, abs=2)
+    # Already inside the margin: not before min_backoff
+    assert agent._next_refresh(token(100)) == pytest.approx(time.time() + 5, abs=2)
+
+def test_backoff_grows_and_is_capped():
+    agent = awsagent(None, [], 'us-east-1', min_backoff=5, max_backoff=40)
+    delays = [agent._backoff('profile', False) - time.time() for _ in range(5)]
+    for delay, maximum in zip(delays, [5, 10, 20, 40, 40]):
+        assert maximum / 2 - 1 <= delay <= maximum
+    # Throttling doubles the delay of the same failure count
+    agent._failures.clear()
+    assert 5 - 1 <= agent._backoff('profile', True) - time.time() <= 10
+    agent._failures['profile'] = 10
+    assert agent._backoff('profile', True) - time.time() <= 40
+
+def run_until(agent, condition, timeout=10):
+    thread = threading.Thread(target=agent.run, daemon=True)
+    thread.start()
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    agent.stop()
+    thread.join(timeout)
+    assert not thread.is_alive()
+
+def test_run_refreshes_every_target(fake, sso):
+    instances = sso.list_application_instances()['result']
+    refreshed = []
+    agent = awsagent(sso, [(instance, 'ReadOnlyAccess') for instance in instances], 'us-east-1', jitter=0,
+                     on_refresh=lambda profile, source, token: refreshed.append(profile),
+                     client=sts_client('us-east-1', 'builtin', fake.base_url + '/sts/'))
+    run_until(agent, lambda: len(refreshed) == 3)
+    assert sorted(refreshed) == ['account-0-ReadOnlyAccess', 'account-1-ReadOnlyAccess', 'account-2-ReadOnlyAccess']
+    assert all(agent.get(profile)['Credentials']['AccessKeyId'].startswith('ASIA') for profile in refreshed)
+    # Rescheduled ahead of expiry, not retried
+    assert fake.requests['sts'] == 3
+    assert len(agent._schedule) == 3 and all(due > time.time() + 60 for due, sequence, profile in agent._schedule)
+
+def test_failed_refresh_is_retried_with_backoff():
+    attempts = []
+
+    def refresh(profile):
+        attempts.append(time.time())
+        if len(attempts) < 3:
+            raise STSError('Throttling', 'Rate exceeded', 400)
+        return token(3600)
+
+    agent = awsagent(None, [({'id': 'ins-0000000000000000', 'name': 'account-0'}, 'ReadOnlyAccess')], 'us-east-1',
+                     jitter=0, min_backoff=0.05, max_backoff=1, client=object())
+    agent._refresh = refresh
+    run_until(agent, lambda: len(attempts) == 3)
+    assert len(attempts) == 3
+    # Throttled twice: at least half of 2 * 0.05, then half of 4 * 0.05
+    assert attempts[1] - attempts[0] >= 0.05 and attempts[2] - attempts[1] >= 0.1
+    assert agent._failures == {}
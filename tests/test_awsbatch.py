@@ -0,0 +1,87 @@
+import sys
+import json
+
+import pytest
+
+import fakeaws
+import awsbatch
+from awsexceptions import InputError
+
+CONFIG = '''[DEFAULT]
+stsregion = eu-west-1
+
+[prod]
+directoryurl = d-1234567890.awsapps.com
+login = deploy@example.com
+password = env:PROD_SSO_PASSWORD
+appinstanceid = all
+rolename = ReadOnlyAccess
+workers = 4
+
+[dev]
+directoryurl = d-0987654321.awsapps.com
+dirname = dev
+login = dev@example.com
+password = file:~/dev-password
+appinstanceid = account-*
+rolename = AdministratorAccess
+'''
+
+def write(tmp_path, text):
+    filename = tmp_path / 'batch.ini'
+    filename.write_text(text)
+    return str(filename)
+
+def test_load_jobs_applies_defaults(tmp_path):
+    jobs = dict((job['name'], job) for job in awsbatch.load_jobs(write(tmp_path, CONFIG)))
+    assert sorted(jobs) == ['dev', 'prod']
+    assert jobs['prod']['dirname'] == 'd-1234567890'
+    assert jobs['prod']['netbios'] == 'd-1234567890'
+    assert jobs['prod']['workers'] == 4
+    assert jobs['prod']['stsregion'] == 'eu-west-1'
+    assert jobs['dev']['dirname'] == 'dev' and jobs['dev']['netbios'] == 'dev'
+    assert jobs['dev']['ssoregion'] == 'us-east-1'
+    assert jobs['dev']['workers'] == 8
+    assert jobs['dev']['sts_client'] == 'boto3'
+
+def test_load_jobs_errors(tmp_path):
+    with pytest.raises(InputError):
+        awsbatch.load_jobs(str(tmp_path / 'missing.ini'))
+    with pytest.raises(InputError):
+        awsbatch.load_jobs(write(tmp_path, '[DEFAULT]\nstsregion = eu-west-1\n'))
+    with pytest.raises(InputError) as error:
+        awsbatch.load_jobs(write(tmp_path, CONFIG.replace('login = dev@example.com\n', '')))
+    assert error.value.expression == '[dev]' and 'login' in error.value.message
+    with pytest.raises(InputError):
+        awsbatch.load_jobs(write(tmp_path, CONFIG.replace('workers = 4', 'workers = many')))
+
+def test_read_secret_sources(tmp_path, home, monkeypatch):
+    monkeypatch.setenv('PROD_SSO_PASSWORD', 'from the environment')
+    assert awsbatch.read_secret('env:PROD_SSO_PASSWORD', 'prod') == 'from the environment'
+    (home / 'dev-password').write_text('from a file\n')
+    assert awsbatch.read_secret('file:~/dev-password', 'dev') == 'from a file'
+    assert awsbatch.read_secret('command:' + sys.executable + ' -c "print(\'from a command\')"') == 'from a command'
+
+def test_read_secret_errors(monkeypatch):
+    monkeypatch.delenv('PROD_SSO_PASSWORD', raising=False)
+    with pytest.raises(InputError) as error:
+        awsbatch.read_secret('env:PROD_SSO_PASSWORD', 'prod')
+    assert error.value.expression == 'password of [prod]'
+    with pytest.raises(InputError):
+        awsbatch.read_secret('command:' + sys.executable + ' -c "raise SystemExit(3)"', 'prod')
+    # A password written in the config file itself is refused
+    with pytest.raises(InputError):
+        awsbatch.read_secret('hunter2', 'prod')
+
+def test_batch_job(portal, monkeypatch):
+    monkeypatch.setenv('SSO_PASSWORD', fakeaws.PASSWORD)
+    job = {
+        'name': 'fake', 'directoryurl': 'd-example.awsapps.com', 'dirname': 'd-example', 'netbios': 'd-example', 'login': 'user1@example.com',
+        'password': 'env:SSO_PASSWORD', 'appinstanceid': 'account-1,account-2', 'rolename': 'all', 'workers': 4,
+        'portal_url': portal.base_url, 'directory_endpoint': portal.base_url, 'sts_endpoint_url': portal.base_url + '/sts/',
+    }
+    job = dict(awsbatch.JOB_DEFAULTS, **job)
+    report = awsbatch.run_job(job)
+    assert 'error' not in report and report['failed'] == []
+    assert sorted(entry[0] for entry in report['entries']) == ['account-1-AdministratorAccess', 'account-1-ReadOnlyAccess', 'account-2-AdministratorAccess', 'account-2-ReadOnlyAccess']
+    assert json.dumps(awsbatch.summary([report])).count(fakeaws.PASSWORD) == 0
@@ -0,0 +1,20 @@
+import awsbulk
+from awsagent import awsagent
+
+INSTANCES = [{'id': 'ins-0000000000000000', 'name': 'prod'}, {'id': 'ins-0000000000000001', 'name': 'prod'}, {'id': 'ins-0000000000000002', 'name': 'dev'}]
+
+def test_duplicate_profiles():
+    targets = [(instance, role) for instance in INSTANCES for role in ('ReadOnlyAccess', 'AdministratorAccess')]
+    unique, duplicates = awsbulk.duplicate_profiles(targets)
+    assert unique == [(INSTANCES[2], 'ReadOnlyAccess'), (INSTANCES[2], 'AdministratorAccess')]
+    assert duplicates == {
+        'prod-ReadOnlyAccess': [(INSTANCES[0], 'ReadOnlyAccess'), (INSTANCES[1], 'ReadOnlyAccess')],
+        'prod-AdministratorAccess': [(INSTANCES[0], 'AdministratorAccess'), (INSTANCES[1], 'AdministratorAccess')],
+    }
+    # Unique once the id is part of the name
+    assert awsbulk.duplicate_profiles(targets, '{id}-{role}') == (targets, {})
+
+def test_agent_leaves_shared_profiles_out():
+    agent = awsagent(None, [(instance, 'ReadOnlyAccess') for instance in INSTANCES], 'us-west-2')
+    assert list(agent.targets) == ['dev-ReadOnlyAccess']
+    assert list(agent.duplicates) == ['prod-ReadOnlyAccess']
@@ -0,0 +1,44 @@
+import os
+
+from awscatalog import awscatalog
+
+def new_catalog(home, ttl=3600):
+    return awscatalog('d-example.awsapps.com', 'user1@example.com', 'us-east-1', cache_dir=str(home), ttl=ttl)
+
+def test_fresh_entries_are_not_fetched_again(fake, sso, home):
+    catalog = new_catalog(home)
+    instances = catalog.instances(sso)
+    ids = [instance['id'] for instance in instances]
+    assert sorted(ids) == sorted(instance['id'] for instance in fake.instances)
+    profiles = catalog.refresh_profiles(sso, ids)
+    assert sorted(profile['name'] for profile in profiles[ids[0]]) == ['AdministratorAccess', 'ReadOnlyAccess']
+    assert catalog.endpoint(sso, ids[0], 'ReadOnlyAccess').endswith('/saml')
+    catalog.instances(sso)
+    catalog.refresh_profiles(sso, ids)
+    assert fake.requests['appinstances'] == 1
+    assert fake.requests['profiles'] == len(ids)
+
+def test_catalog_is_reloaded_from_disk(fake, sso, home):
+    catalog = new_catalog(home)
+    catalog.refresh_profiles(sso, [instance['id'] for instance in catalog.instances(sso)])
+    catalog.save()
+    assert os.stat(catalog.filename).st_mode & 0o777 == 0o600
+    reloaded = new_catalog(home)
+    assert reloaded.resolve('account-1/readonlyaccess', sso) == (fake.instances[1], 'ReadOnlyAccess')
+    assert fake.requests['appinstances'] == 1
+
+def test_stale_entries_are_fetched_again(fake, sso, home):
+    catalog = new_catalog(home, ttl=0)
+    ids = [instance['id'] for instance in catalog.instances(sso)]
+    catalog.refresh_profiles(sso, ids)
+    catalog.instances(sso)
+    catalog.refresh_profiles(sso, ids[:1])
+    assert fake.requests['appinstances'] == 2
+    assert fake.requests['profiles'] == len(ids) + 1
+
+def test_refresh_fetches_fresh_entries(fake, sso, home):
+    catalog = new_catalog(home)
+    instance_id = catalog.instances(sso)[0]['id']
+    catalog.profiles(sso, instance_id)
+    catalog.profiles(sso, instance_id, refresh=True)
+    assert fake.requests['profiles'] == 2
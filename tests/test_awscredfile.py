@@ -0,0 +1,61 @@
+import os
+import threading
+
+from awscredfile import awscredentialsfile
+
+EXISTING = '''# managed by hand
+[default]
+aws_access_key_id = AKIAEXAMPLE
+aws_secret_access_key=keep   spacing
+
+[saml]
+region = us-west-2
+aws_session_token = old
+'''
+
+def test_update_keeps_other_sections_byte_for_byte(tmp_path):
+    filename = tmp_path / 'credentials'
+    filename.write_text(EXISTING)
+    changed = awscredentialsfile(filename=str(filename)).update({'saml': {'aws_session_token': 'new'}, 'other': {'region': 'eu-west-1'}})
+    assert changed == ['saml', 'other']
+    text = filename.read_text()
+    assert text.startswith(EXISTING.split('[saml]')[0])
+    assert '[saml]\nregion = us-west-2\naws_session_token = new\n' in text
+    assert text.endswith('[other]\nregion = eu-west-1\n\n')
+
+def test_update_without_changes_does_not_write(tmp_path):
+    filename = tmp_path / 'credentials'
+    filename.write_text(EXISTING)
+    os.utime(str(filename), (0, 0))
+    changed = awscredentialsfile(filename=str(filename)).update({'saml': {'region': 'us-west-2', 'AWS_SESSION_TOKEN': 'old'}})
+    assert changed == []
+    assert os.stat(str(filename)).st_mtime == 0
+    assert filename.read_text() == EXISTING
+
+def test_new_file_is_private(tmp_path):
+    filename = tmp_path / '.aws' / 'credentials'
+    awscredentialsfile(filename=str(filename)).update({'saml': {'region': 'us-west-2'}})
+    assert os.stat(str(filename)).st_mode & 0o777 == 0o600
+
+def test_concurrent_updates_are_all_kept(tmp_path):
+    filename = str(tmp_path / 'credentials')
+    profiles = ['profile-' + str(number) for number in range(20)]
+    # A new awscredentialsfile per thread, like separate ssocli runs
+    threads = [threading.Thread(target=lambda profile=profile: awscredentialsfile(filename=filename).update({profile: {'region': 'us-west-2'}})) for profile in profiles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    text = open(filename).read()
+    for profile in profiles:
+        assert text.count('[' + profile + ']') == 1
+
+def test_symlink_is_kept(tmp_path):
+    target = tmp_path / 'dotfiles' / 'credentials'
+    target.parent.mkdir()
+    target.write_text(EXISTING)
+    link = tmp_path / 'credentials'
+    link.symlink_to(target)
+    awscredentialsfile(filename=str(link)).update({'saml': {'aws_session_token': 'new'}})
+    assert link.is_symlink()
+    assert 'aws_session_token = new' in target.read_text()
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+import requests
+
+import awslimit
+from awslimit import awslimiter, aimdlimiter, tokenbucket, limitconfig, http_outcome, sts_outcome, THROTTLED, FAILED
+from awsexceptions import STSError
+
+class response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+def test_http_outcome():
+    assert http_outcome(response(429)) == THROTTLED
+    assert http_outcome(response(503)) == FAILED
+    assert http_outcome(response(200)) is None
+    assert http_outcome(response(403)) is None
+    assert http_outcome(error=requests.exceptions.ConnectionError()) == FAILED
+    assert http_outcome(error=ValueError()) is None
+
+def test_sts_outcome():
+    assert sts_outcome(error=STSError('Throttling', 'Rate exceeded', 400)) == THROTTLED
+    assert sts_outcome(error=STSError('InternalFailure', '', 500)) == FAILED
+    # A wrong role or an expired assertion is not retried
+    assert sts_outcome(error=STSError('AccessDenied', '', 403)) is None
+    assert sts_outcome(error=ConnectionResetError()) == FAILED
+    assert sts_outcome(response={'Credentials': {}}) is None
+
+def test_is_throttling():
+    assert awslimit.is_throttling(STSError('RequestLimitExceeded', '', 400))
+    error = requests.exceptions.HTTPError(response=response(429))
+    assert awslimit.is_throttling(error)
+    assert not awslimit.is_throttling(requests.exceptions.HTTPError(response=response(503)))
+    assert not awslimit.is_throttling(ValueError())
+
+def test_concurrency_is_halved_once_per_throttling_event():
+    limiter = aimdlimiter(maximum=64, initial=8)
+    before = time.monotonic()
+    limiter.acquire()
+    limiter.release(THROTTLED, time.monotonic(), 0.01)
+    assert limiter.limit == 4
+    # Sent before the decrease, caused by the old limit
+    limiter.acquire()
+    limiter.release(THROTTLED, before, 0.01)
+    assert limiter.limit == 4
+    # Congestion avoidance grows by 1/limit per success
+    limiter.acquire()
+    limiter.release(None, time.monotonic(), 0.01)
+    assert limiter.limit == pytest.approx(4.25)
+
+def test_token_bucket_paces_calls_after_the_burst():
+    bucket = tokenbucket(50, 1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+def throttled_limiter(config, measured_rate):
+    limiter = awslimiter('test', config)
+    limiter.measured_rate = measured_rate
+    limiter._adapt_rate(THROTTLED, time.monotonic())
+    return limiter
+
+def test_throttle_installs_a_bucket_below_the_measured_rate():
+    limiter = throttled_limiter(limitconfig(), 10.0)
+    assert limiter.rate == pytest.approx(7.0)
+    # A throttle of a call admitted before the cut is the same event
+    limiter._adapt_rate(THROTTLED, limiter.rate_decreased - 1)
+    assert limiter.rate == pytest.approx(7.0)
+    limiter._adapt_rate(THROTTLED, time.monotonic())
+    assert limiter.rate == pytest.approx(4.9)
+
+def test_adapted_rate_keeps_probing_upward_after_recovery():
+    limiter = throttled_limiter(limitconfig(recovery=10.0), 10.0)
+    limiter.rate_decreased -= 11
+    # Still about the rate the calls are made at: the bucket grows, it is not dropped
+    limiter.measured_rate = 7.0
+    limiter._adapt_rate(None, time.monotonic())
+    assert limiter.rate == pytest.approx(7.0 + 1 / 7.0)
+    # Calls no longer use half of the rate, the bucket does not limit them any more
+    limiter.measured_rate = 3.0
+    limiter._adapt_rate(None, time.monotonic())
+    assert limiter.rate is None
+
+def test_adapted_rate_grows_back_to_the_configured_rate():
+    limiter = throttled_limiter(limitconfig(rate=10.0, recovery=10.0), 20.0)
+    assert limiter.rate == pytest.approx(7.0)
+    limiter.rate_decreased -= 11
+    limiter._adapt_rate(None, time.monotonic())
+    assert limiter.rate == pytest.approx(7.0 + 1 / 7.0)
+    for _ in range(30):
+        limiter._adapt_rate(None, time.monotonic())
+    assert limiter.rate == 10.0
+    assert limiter.rate_decreased == 0
+
+def test_call_retries_throttling_then_returns():
+    limiter = awslimiter('test', limitconfig(retries=2, backoff_base=0))
+    errors = [STSError('Throttling', '', 400), STSError('Throttling', '', 400)]
+
+    def assume():
+        if errors:
+            raise errors.pop()
+        return 'token'
+
+    assert limiter.call(sts_outcome, assume) == 'token'
+    assert limiter.stats == {'calls': 3, 'throttled': 2, 'failed': 0, 'retries': 2}
+    assert limiter.rate is not None
+
+def test_call_raises_the_last_error_once_retries_are_used_up():
+    limiter = awslimiter('test', limitconfig(retries=1, backoff_base=0))
+
+    def assume():
+        raise STSError('InternalFailure', '', 500)
+
+    with pytest.raises(STSError):
+        limiter.call(sts_outcome, assume)
+    assert limiter.stats == {'calls': 2, 'throttled': 0, 'failed': 2, 'retries': 1}
+    # Server errors are not a quota
+    assert limiter.rate is None
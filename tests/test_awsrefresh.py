@@ -0,0 +1,79 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from awsrefresh import awscredentialcache, awsrelogin, expiration
+from awsexceptions import PortalSessionError
+
+def token(seconds):
+    return {'Credentials': {'AccessKeyId': 'ASIAEXAMPLE', 'Expiration': datetime.now(timezone.utc) + timedelta(seconds=seconds)}}
+
+def concurrently(function, count=8):
+    results = []
+    barrier = threading.Barrier(count)
+
+    def run():
+        barrier.wait()
+        try:
+            results.append(function())
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_misses_share_one_fetch():
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        # Slow enough for every other thread to miss meanwhile
+        time.sleep(0.2)
+        return token(3600)
+
+    cache = awscredentialcache(fetch)
+    results = concurrently(lambda: cache.get('profile'))
+    assert fetched == ['profile']
+    assert all(result is results[0] for result in results)
+    assert cache.get('profile') is results[0]
+
+def test_concurrent_misses_share_the_error_of_the_fetch():
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        time.sleep(0.2)
+        raise PortalSessionError('Portal session is no longer valid..')
+
+    cache = awscredentialcache(fetch)
+    results = concurrently(lambda: cache.get('profile'))
+    assert len(fetched) == 1
+    assert all(isinstance(result, PortalSessionError) for result in results)
+    # A failed fetch is not kept, the next miss tries again
+    with pytest.raises(PortalSessionError):
+        cache.get('profile')
+    assert len(fetched) == 2
+
+def test_token_within_the_margin_is_fetched_again():
+    tokens = [token(3600), token(200)]
+    cache = awscredentialcache(lambda key: tokens.pop(), refresh_margin=300)
+    cache.put('profile', tokens.pop())
+    # The margin is clamped to half the lifetime, 100 seconds here, so 200 seconds are still valid
+    assert cache.margin('profile') == pytest.approx(100, abs=1)
+    assert expiration(cache.get('profile')) < datetime.now(timezone.utc) + timedelta(seconds=300)
+    cache._fetched['profile'] -= timedelta(seconds=1000)
+    assert expiration(cache.get('profile')) > datetime.now(timezone.utc) + timedelta(seconds=3000)
+
+def test_relogin_once_per_generation():
+    logins = []
+    relogin = awsrelogin(lambda: logins.append(1))
+    concurrently(lambda: relogin(0))
+    assert len(logins) == 1 and relogin.generation == 1
+    with pytest.raises(PortalSessionError):
+        awsrelogin(None)(0)
@@ -0,0 +1,103 @@
+import time
+import json
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fakeaws
+from awssaml import awssaml, select_role, load_cached_credentials, credentials_section, credential_process_output
+from awsagent import awsagent
+from awscredfile import awscredentialsfile
+from awsexceptions import SAMLAssertionError
+
+PROVIDER = 'arn:aws:iam::100000000000:saml-provider/AWSSSO_fake_DO_NOT_DELETE'
+ADMIN = 'arn:aws:iam::100000000000:role/aws-reserved/sso.amazonaws.com/AWSReservedSSO_AdministratorAccess_0123456789abcdef'
+READONLY = 'arn:aws:iam::100000000000:role/aws-reserved/sso.amazonaws.com/AWSReservedSSO_ReadOnlyAccess_0123456789abcdef'
+
+def assertion(session_duration=3600, extra_roles=()):
+    # The assertion the fake portal issues, with more values in the Role attribute
+    xml = fakeaws.SAML_TEMPLATE.format(
+        response_id='1', assertion_id='2', session_index='3', now='2026-01-01T00:00:00.000Z',
+        not_on_or_after='2026-01-01T00:05:00.000Z', issuer='fake', signature='c2ln', certificate='Y2VydA==',
+        login='user1@example.com', account='100000000000', role='AdministratorAccess',
+        role_suffix='0123456789abcdef', provider='fake', session_duration=session_duration)
+    for value in extra_roles:
+        xml = xml.replace('_DO_NOT_DELETE</saml2:AttributeValue>', '_DO_NOT_DELETE</saml2:AttributeValue><saml2:AttributeValue>' + value + '</saml2:AttributeValue>', 1)
+    return base64.b64encode(xml.encode('utf-8')).decode('ascii')
+
+def test_parse_all_reads_every_role_and_the_session_duration():
+    # The IdP may list the provider before or after the role
+    attributes = awssaml(assertion(43200, [PROVIDER + ',' + READONLY])).parse_all()
+    assert attributes['roles'] == [
+        {'role_arn': ADMIN, 'principal_arn': PROVIDER},
+        {'role_arn': READONLY, 'principal_arn': PROVIDER},
+    ]
+    assert attributes['session_duration'] == 43200
+    assert attributes['not_on_or_after'] == datetime(2026, 1, 1, 0, 5, tzinfo=timezone.utc)
+
+def test_parse_all_rejects_invalid_assertions():
+    with pytest.raises(SAMLAssertionError):
+        awssaml('').parse_all()
+    with pytest.raises(SAMLAssertionError):
+        awssaml(base64.b64encode(b'<saml2p:Response').decode('ascii')).parse_all()
+
+def test_select_role_by_name():
+    roles = awssaml(assertion(extra_roles=[READONLY + ',' + PROVIDER])).parse_all()['roles']
+    assert select_role(roles, 'ReadOnlyAccess')['role_arn'] == READONLY
+    assert select_role(roles, 'AdministratorAccess')['role_arn'] == ADMIN
+
+def test_select_role_never_falls_back_to_another_role():
+    roles = awssaml(assertion(extra_roles=[READONLY + ',' + PROVIDER])).parse_all()['roles']
+    with pytest.raises(SAMLAssertionError):
+        select_role(roles, 'PowerUserAccess')
+    with pytest.raises(SAMLAssertionError):
+        select_role([], 'ReadOnlyAccess')
+    # A single role is what the portal issued for the profile, whatever its name
+    assert select_role(roles[:1], 'PowerUserAccess') == roles[0]
+
+def credentials(expiration):
+    return {'Credentials': {'AccessKeyId': 'ASIAEXAMPLE', 'SecretAccessKey': 'secret', 'SessionToken': 'session', 'Expiration': expiration}}
+
+def store(profile, section):
+    awscredentialsfile().update({profile: section})
+
+def test_stored_credentials_are_reused_while_valid(home):
+    expiration = datetime.now(timezone.utc) + timedelta(hours=1)
+    store('saml', credentials_section(credentials(expiration), 'us-west-2', source='ins-0000000000000000/ReadOnlyAccess'))
+    cached = load_cached_credentials('saml', 300, source='ins-0000000000000000/ReadOnlyAccess')
+    assert cached['Credentials']['AccessKeyId'] == 'ASIAEXAMPLE'
+    assert cached['Credentials']['Expiration'] == expiration
+    # Another role, too close to expiry, or a missing profile
+    assert load_cached_credentials('saml', 300, source='ins-0000000000000000/AdministratorAccess') is None
+    assert load_cached_credentials('saml', 7200) is None
+    assert load_cached_credentials('other') is None
+
+@pytest.fixture
+def local_zone(monkeypatch):
+    # A local zone far from UTC, where a naive expiration would be off by hours
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_expiration_without_offset_is_utc(home, local_zone):
+    expiration = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) + timedelta(hours=1)
+    store('saml', credentials_section(credentials(expiration.isoformat()), 'us-west-2'))
+    cached = load_cached_credentials('saml', 300)
+    assert cached['Credentials']['Expiration'] == expiration.replace(tzinfo=timezone.utc)
+    # Scheduled from the UTC expiry, not from the same wall clock time in the local zone
+    agent = awsagent(None, [], 'us-west-2', refresh_margin=300, jitter=0)
+    assert abs(agent._next_refresh(cached) - (time.time() + 3300)) < 5
+    assert abs(agent._next_refresh(credentials(expiration.isoformat() + 'Z')) - (time.time() + 3300)) < 5
+
+def test_credential_process_output():
+    expiration = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+    assert json.loads(credential_process_output(credentials(expiration))) == {
+        'Version': 1,
+        'AccessKeyId': 'ASIAEXAMPLE',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'session',
+        'Expiration': '2026-01-01T12:00:00+00:00',
+    }
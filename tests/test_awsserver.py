@@ -0,0 +1,59 @@
+import json
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime, timezone
+
+import pytest
+
+from awsrefresh import awscredentialcache
+from awsserver import awscredentialserver
+
+TOKEN = {
+    'Credentials': {'AccessKeyId': 'ASIAEXAMPLE', 'SecretAccessKey': 'secret', 'SessionToken': 'session',
+                    'Expiration': datetime(2099, 1, 1, 12, tzinfo=timezone.utc)},
+    'AssumedRoleUser': {'Arn': 'arn:aws:sts::100000000000:assumed-role/ReadOnlyAccess/user1@example.com'},
+}
+
+@pytest.fixture
+def server():
+    def fetch(profile):
+        if profile == 'broken':
+            raise ValueError('no such role')
+        return TOKEN
+
+    server = awscredentialserver(awscredentialcache(fetch), {'readonly': None, 'broken': None}, auth_token='secret-token')
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get(url, authorization='secret-token'):
+    request = urllib.request.Request(url, headers={'Authorization': authorization})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_serves_container_credentials(server):
+    status, document = get(server.url('readonly'))
+    assert status == 200
+    assert document == {
+        'AccessKeyId': 'ASIAEXAMPLE',
+        'SecretAccessKey': 'secret',
+        'Token': 'session',
+        'Expiration': '2099-01-01T12:00:00Z',
+        'RoleArn': 'arn:aws:sts::100000000000:assumed-role/ReadOnlyAccess/user1@example.com',
+    }
+
+def test_rejects_a_wrong_token(server):
+    assert get(server.url('readonly'), 'wrong')[0] == 403
+
+def test_unknown_profile(server):
+    status, document = get(server.url('admin'))
+    assert status == 404 and document['Code'] == 'NotFound'
+
+def test_failed_fetch(server):
+    status, document = get(server.url('broken'))
+    assert status == 500 and document['Message'] == 'no such role'
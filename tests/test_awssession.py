@@ -0,0 +1,73 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import fakeaws
+from awssession import awsssosession
+
+def new_session(fake, **kwargs):
+    return awsssosession('d-example.awsapps.com', 'user1@example.com', fakeaws.PASSWORD, sts='builtin',
+                         portal_url=fake.base_url, directory_endpoint=fake.base_url, sts_endpoint_url=fake.base_url + '/sts/', **kwargs)
+
+def expiring(token, seconds):
+    token = dict(token, Credentials=dict(token['Credentials']))
+    token['Credentials']['Expiration'] = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+    return token
+
+def test_token_is_fetched_once_while_valid(fake):
+    session = new_session(fake)
+    instance_id = fake.instances[0]['id']
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(session.token(instance_id, 'ReadOnlyAccess'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(tokens) == 8 and all(token is tokens[0] for token in tokens)
+    assert fake.requests['authcode'] == 1
+    assert fake.requests['sts'] == 1
+
+def test_token_is_refreshed_within_the_margin(fake):
+    session = new_session(fake, refresh_margin=300)
+    key = (fake.instances[0]['id'], 'ReadOnlyAccess')
+    token = session.token(*key)
+    # Assumed for 60 seconds only: the margin is clamped to half of that, nothing to refresh
+    short = expiring(token, 60)
+    session.cache.put(key, short)
+    assert session.token(*key) is short
+    # 60 seconds left out of 600: inside the 300 seconds margin
+    session.cache._fetched[key] -= timedelta(seconds=540)
+    refreshed = session.token(*key)
+    assert refreshed is not short
+    assert fake.requests['sts'] == 2
+    assert session.token(*key) is refreshed
+
+def test_expired_portal_session_logs_in_again(fake):
+    session = new_session(fake)
+    key = (fake.instances[1]['id'], 'AdministratorAccess')
+    session.cache.put(key, expiring(session.token(*key), -1))
+    fake.sessions.clear()
+    session.token(*key)
+    assert fake.requests['authcode'] == 2
+    assert fake.requests['sts'] == 2
+
+def test_wrong_password_fails_on_login(fake):
+    from awsexceptions import AuthCodeError
+    session = awsssosession('d-example.awsapps.com', 'user1@example.com', 'wrong', sts='builtin',
+                            portal_url=fake.base_url, directory_endpoint=fake.base_url)
+    with pytest.raises(AuthCodeError):
+        session.login()
+
+def test_botocore_credentials_refresh_with_the_cache_margin(fake):
+    pytest.importorskip('botocore')
+    fake.session_duration = 900
+    session = new_session(fake, refresh_margin=900)
+    instance_id = fake.instances[0]['id']
+    credentials = session.credentials(instance_id, 'ReadOnlyAccess')
+    token = session.token(instance_id, 'ReadOnlyAccess')
+    assert credentials.get_frozen_credentials().access_key == token['Credentials']['AccessKeyId']
+    # Half the 900 seconds lifetime, not botocore's 15 and 10 minutes
+    assert 440 <= type(credentials)._advisory_refresh_timeout <= 450
+    assert type(credentials)._mandatory_refresh_timeout == type(credentials)._advisory_refresh_timeout // 2
+    assert fake.requests['sts'] == 1
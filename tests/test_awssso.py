@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+import fakeaws
+import awshttp
+from awssso import awssso
+
+class countingserver(fakeaws.fakeawsserver):
+    # Counts the TCP connections accepted
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        fakeaws.fakeawsserver.process_request(self, request, client_address)
+
+@pytest.fixture
+def server():
+    server = countingserver(fakeaws.fakeaws(accounts=3))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def login(server, config):
+    sso = awssso('d-example', 'd-example', 'd-example.awsapps.com', 'us-east-1', 'user1@example.com', fakeaws.PASSWORD,
+                 http_config=config, portal_url=server.base_url, directory_endpoint=server.base_url)
+    authcode = sso.get_authentication_code()
+    sso.get_access_token(authcode['authcode'], authcode['referer'])
+    instance_id = sso.list_application_instances()['result'][0]['id']
+    sso.get_saml_assertion(instance_id, 'ReadOnlyAccess')
+    return sso
+
+def test_logins_reuse_one_connection(server):
+    # A config of its own, so the pool only holds connections of this test
+    config = awshttp.httpconfig(pool_connections=1, pool_maxsize=1)
+    first = login(server, config)
+    second = login(server, config)
+    assert server.fake.requests['authcode'] == 2
+    assert server.connections == 1
+    # Each login keeps its own portal session
+    assert first.session.cookies is not second.session.cookies
+    assert first.session.get_adapter(server.base_url) is second.session.get_adapter(server.base_url)
+
+def test_reset_forgets_the_portal_session(server):
+    sso = login(server, awshttp.httpconfig(pool_connections=1, pool_maxsize=1))
+    sso.reset()
+    assert not list(sso.session.cookies)
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import fakeaws
+
+# aiohttp is optional
+pytest.importorskip('aiohttp')
+
+import awsssoasync
+from awsexceptions import AuthCodeError, PortalSessionError
+
+def new_client(fake, password=fakeaws.PASSWORD, **kwargs):
+    return awsssoasync.awsssoasync('d-example', 'd-example', 'd-example.awsapps.com', 'us-east-1', 'user1@example.com', password,
+                                   portal_url=fake.base_url, directory_endpoint=fake.base_url, **kwargs)
+
+async def login(sso):
+    authcode = await sso.get_authentication_code()
+    await sso.get_access_token(authcode['authcode'], authcode['referer'])
+
+def test_assume_many_returns_every_pair(fake):
+    async def run():
+        async with new_client(fake) as sso:
+            await login(sso)
+            instances = (await sso.list_application_instances())['result']
+            targets = [(instance, role['name']) for instance in instances for role in (await sso.list_roles_for_appinstanceid(instance['id']))['result']]
+            client = awsssoasync.awsstsclientasync('us-east-1', endpoint_url=fake.base_url + '/sts/')
+            try:
+                return [result async for result in awsssoasync.assume_many(sso, targets, 'us-east-1', concurrency=4, client=client)]
+            finally:
+                await client.close()
+
+    results = asyncio.run(run())
+    assert not [result for result in results if 'error' in result]
+    assert sorted(result['profile'] for result in results) == sorted(
+        'account-' + str(index) + '-' + role for index in range(3) for role in ('AdministratorAccess', 'ReadOnlyAccess'))
+    assert all(result['token']['Credentials']['AccessKeyId'].startswith('ASIA') for result in results)
+    assert fake.requests['sts'] == 6
+
+def test_clients_share_a_connector(fake):
+    async def run():
+        connector = awsssoasync.new_connector()
+        users = [new_client(fake, connector=connector) for _ in range(2)]
+        try:
+            for sso in users:
+                await login(sso)
+            # One cookie jar per client, the pool is shared
+            return [len((await sso.list_application_instances())['result']) for sso in users], users[0].cookies is not users[1].cookies
+        finally:
+            for sso in users:
+                await sso.close()
+            await connector.close()
+
+    assert asyncio.run(run()) == ([3, 3], True)
+    assert fake.requests['authcode'] == 2
+
+def test_wrong_password_and_revoked_session(fake):
+    async def run():
+        async with new_client(fake, password='wrong') as sso:
+            with pytest.raises(AuthCodeError):
+                await sso.get_authentication_code()
+        async with new_client(fake) as sso:
+            await login(sso)
+            fake.sessions.clear()
+            with pytest.raises(PortalSessionError):
+                await sso.list_application_instances()
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from awsstore import awscredentialstore
+from awscredfile import awscredentialsfile
+from awsexceptions import InputError
+
+def token(account, role, seconds=3600, secret='SECRETACCESSKEY'):
+    return {
+        'Credentials': {
+            'AccessKeyId': 'ASIA' + account,
+            'SecretAccessKey': secret,
+            'SessionToken': 'SESSIONTOKEN' + account,
+            'Expiration': datetime.now(timezone.utc) + timedelta(seconds=seconds),
+        },
+        'AssumedRoleUser': {'Arn': 'arn:aws:sts::' + account + ':assumed-role/AWSReservedSSO_' + role + '_0123/user1@example.com'},
+    }
+
+def fill(store):
+    store.save_many([
+        ('prod-admin', token('100000000000', 'AdministratorAccess'), 'us-west-2', 'ins-0000000000000000/AdministratorAccess'),
+        ('prod-readonly', token('100000000000', 'ReadOnlyAccess'), 'us-west-2', 'ins-0000000000000000/ReadOnlyAccess'),
+        ('dev-readonly', token('100000000001', 'ReadOnlyAccess', seconds=60), 'eu-west-1', 'ins-0000000000000001/ReadOnlyAccess'),
+        ('old', token('100000000002', 'ReadOnlyAccess', seconds=-60), 'us-west-2', None),
+    ])
+
+def test_get_honours_refresh_margin_and_source(tmp_path):
+    store = awscredentialstore(str(tmp_path / 'credentials.db'))
+    fill(store)
+    assert store.get('prod-admin')['Credentials']['SecretAccessKey'] == 'SECRETACCESSKEY'
+    assert store.get('prod-admin', source='ins-0000000000000000/AdministratorAccess') is not None
+    assert store.get('prod-admin', source='ins-0000000000000000/ReadOnlyAccess') is None
+    assert store.get('dev-readonly', refresh_margin=300) is None
+    assert store.get('old') is None
+
+def test_valid_filters_by_account_and_role(tmp_path):
+    store = awscredentialstore(str(tmp_path / 'credentials.db'))
+    fill(store)
+    assert [row['profile'] for row in store.valid()] == ['dev-readonly', 'prod-admin', 'prod-readonly']
+    assert [row['profile'] for row in store.valid(refresh_margin=300)] == ['prod-admin', 'prod-readonly']
+    assert [row['profile'] for row in store.valid(account='100000000000', role='ReadOnlyAccess')] == ['prod-readonly']
+    assert store.purge_expired() == 1
+
+def test_secrets_are_encrypted_with_a_key(tmp_path):
+    pytest.importorskip('cryptography')
+    filename = str(tmp_path / 'credentials.db')
+    store = awscredentialstore(filename, key='passphrase')
+    fill(store)
+    row = sqlite3.connect(filename).execute("SELECT secret_access_key, session_token, encrypted FROM credentials WHERE profile = 'prod-admin'").fetchone()
+    assert row[2] == 1
+    assert b'SECRETACCESSKEY' not in row[0] and b'SESSIONTOKEN' not in row[1]
+    store.close()
+    assert awscredentialstore(filename, key='passphrase').get('prod-admin')['Credentials']['SecretAccessKey'] == 'SECRETACCESSKEY'
+    # The profile listing needs no key
+    assert len(awscredentialstore(filename).valid()) == 3
+    with pytest.raises(InputError):
+        awscredentialstore(filename).get('prod-admin')
+
+def test_wrong_key_is_refused(tmp_path):
+    pytest.importorskip('cryptography')
+    filename = str(tmp_path / 'credentials.db')
+    awscredentialstore(filename, key='passphrase').close()
+    with pytest.raises(InputError) as error:
+        awscredentialstore(filename, key='another passphrase')
+    assert error.value.message == 'Wrong key for the credential store'
+
+def test_export_writes_the_valid_profiles(tmp_path, home):
+    store = awscredentialstore(str(tmp_path / 'credentials.db'))
+    fill(store)
+    assert store.export(refresh_margin=300) == ['prod-admin', 'prod-readonly']
+    sections = awscredentialsfile()._split((home / '.aws' / 'credentials').read_text())
+    assert [name for name, lines in sections if name] == ['prod-admin', 'prod-readonly']
+    assert 'aws_secret_access_key = SECRETACCESSKEY\n' in dict(sections)['prod-admin']
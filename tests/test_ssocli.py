@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import fakeaws
+import ssocli
+from awscredfile import awscredentialsfile
+
+BULK = ['-b', '-i', 'all', '-r', 'ReadOnlyAccess', '--sts-client', 'builtin']
+
+def run(argv):
+    try:
+        ssocli.main(argv)
+    except SystemExit as e:
+        # Only failures exit
+        pytest.fail('ssocli exited with ' + str(e.code))
+
+def profiles(home):
+    sections = awscredentialsfile()._split((home / '.aws' / 'credentials').read_text())
+    return dict((name, ''.join(lines)) for name, lines in sections if name)
+
+def test_bulk_reuses_the_cached_portal_session(portal, home):
+    run(BULK + ['-p', fakeaws.PASSWORD])
+    assert sorted(profiles(home)) == ['account-0-ReadOnlyAccess', 'account-1-ReadOnlyAccess', 'account-2-ReadOnlyAccess']
+    assert portal.requests['authcode'] == 1
+    # No password: the portal session cached by the first run is used
+    run(BULK + ['-r', 'AdministratorAccess'])
+    assert len(profiles(home)) == 6
+    assert portal.requests['authcode'] == 1
+    assert portal.requests['sts'] == 6
+
+def test_bulk_logs_in_again_when_the_cached_session_was_revoked(portal, home):
+    run(BULK + ['-p', fakeaws.PASSWORD])
+    portal.sessions.clear()
+    # The catalog is fresh, the assertions are the only portal calls of this run
+    run(BULK + ['-r', 'AdministratorAccess', '-p', fakeaws.PASSWORD])
+    assert len(profiles(home)) == 6
+    assert portal.requests['authcode'] == 2
+
+def test_expired_portal_session_without_password_fails(portal, home):
+    run(BULK + ['-p', fakeaws.PASSWORD])
+    portal.sessions.clear()
+    with pytest.raises(SystemExit) as error:
+        ssocli.main(BULK)
+    assert error.value.code == 1
+
+def test_every_mode_logs_in_again_when_the_cached_session_was_revoked(portal, home, capfd):
+    run(BULK + ['-p', fakeaws.PASSWORD])
+    instance_id = portal.instances[0]['id']
+    portal.sessions.clear()
+    run(['-i', instance_id, '-r', 'AdministratorAccess', '--credential-process', '--sts-client', 'builtin', '-p', fakeaws.PASSWORD])
+    assert '"AccessKeyId": "ASIA' in capfd.readouterr().out
+    assert portal.requests['authcode'] == 2
+    portal.sessions.clear()
+    run(['--crawl', '-p', fakeaws.PASSWORD])
+    assert capfd.readouterr().out.count('"roles": ["AdministratorAccess", "ReadOnlyAccess"]') == 3
+    assert portal.requests['authcode'] == 3
+
+def test_bulk_does_not_write_profiles_shared_by_two_pairs(portal, home, capsys):
+    # Instance names are not unique
+    portal.instances[1]['name'] = portal.instances[0]['name']
+    with pytest.raises(SystemExit) as error:
+        ssocli.main(BULK + ['-p', fakeaws.PASSWORD])
+    assert error.value.code == 1
+    assert sorted(profiles(home)) == ['account-2-ReadOnlyAccess']
+    out = capsys.readouterr().out
+    assert out.count('profile [account-0-ReadOnlyAccess] is shared by 2 pairs') == 2
+    assert '1 profiles written, 2 failed.' in out
+    assert portal.requests['sts'] == 1
+
+def test_crawl_writes_only_json_lines(portal, home, capfd):
+    run(['--crawl', '-p', fakeaws.PASSWORD])
+    out = capfd.readouterr().out
+    records = sorted((json.loads(line) for line in out.splitlines()), key=lambda record: record['name'])
+    assert [record['name'] for record in records] == ['account-0', 'account-1', 'account-2']
+    assert all(sorted(record['roles']) == ['AdministratorAccess', 'ReadOnlyAccess'] for record in records)
+
+def test_crawl_lists_instances_created_since_the_catalog_was_fetched(portal, home, capfd):
+    run(['--crawl', '-p', fakeaws.PASSWORD])
+    portal.instances.append(dict(portal.instances[0], id='ins-00000000000000ff', name='account-new'))
+    portal.profiles['ins-00000000000000ff'] = portal.profiles[portal.instances[0]['id']]
+    capfd.readouterr()
+    run(['--crawl'])
+    names = [json.loads(line)['name'] for line in capfd.readouterr().out.splitlines()]
+    assert sorted(names) == ['account-0', 'account-1', 'account-2', 'account-new']
+    assert portal.requests['appinstances'] == 2
+
+def test_credential_process_reuses_valid_credentials(portal, home, capfd):
+    argv = ['-i', portal.instances[0]['id'], '-r', 'ReadOnlyAccess', '--credential-process', '--sts-client', 'builtin', '-p', fakeaws.PASSWORD]
+    for attempt in range(2):
+        try:
+            ssocli.main(argv)
+        except SystemExit as e:
+            assert attempt == 1 and e.code == 0
+    outputs = [json.loads(line) for line in capfd.readouterr().out.splitlines() if line.startswith('{')]
+    assert len(outputs) == 2 and outputs[0] == outputs[1]
+    # The second run neither logged in nor called STS
+    assert portal.requests['authcode'] == 1
+    assert portal.requests['sts'] == 1